@@ -0,0 +1,211 @@
+import asyncio
+import json
+import os
+import uuid
+from sqlalchemy.ext.asyncio import AsyncSession
+from urllib.parse import parse_qsl
+from query import metrics
+from query.builder import bulk_create_request_history_async
+from query.clients import RESOURCES, bind_session, get_async_engine, LOGGER
+import lambda_function
+
+# API Gateway's payload limit, so a body the Lambda accepts is accepted here too
+SERVER_MAX_BODY_BYTES = int(os.getenv("SERVER_MAX_BODY_BYTES", str(10 * 1024 * 1024)))
+
+
+class Headers(dict):
+    """
+    ASGI header names are lower case; API Gateway passes them as sent, and
+    the handlers look them up as e.g. X-AUTH-API-KEY.
+    """
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+
+class RequestContext:
+    def __init__(self) -> None:
+        # the handlers quote it in 500 responses, as they do the Lambda's
+        self.aws_request_id = str(uuid.uuid4())
+
+
+def request_event(scope: dict, body: bytes) -> dict:
+    """
+    The API Gateway proxy event the handlers of lambda_function expect.
+    """
+    query_params = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    return {
+        "path": scope["path"],
+        "httpMethod": scope["method"],
+        "headers": Headers(
+            (name.decode("latin-1").lower(), value.decode("latin-1"))
+            for name, value in scope.get("headers", [])
+        ),
+        "queryStringParameters": query_params or None,
+        "body": body.decode("utf-8") if body else None,
+    }
+
+
+async def read_body(receive) -> bytes | None:
+    """
+    Returns the request body, or None when it exceeds SERVER_MAX_BODY_BYTES.
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > SERVER_MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def send_response(send, response: dict, request_id: str) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": response["statusCode"],
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"x-request-id", request_id.encode("latin-1")),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": response["body"].encode("utf-8")})
+
+
+async def handle_in_session(event: dict, context: RequestContext) -> dict:
+    """
+    Runs lambda_function.handle_event on the sync side of an AsyncSession:
+    the validation, query building and serialization are the Lambda's, while
+    every statement awaits an asyncpg connection instead of blocking.
+    """
+    async with AsyncSession(get_async_engine()) as session:
+        with bind_session(session.sync_session):
+            return await session.run_sync(
+                lambda _: lambda_function.handle_event(event, context)
+            )
+
+
+class ApiServer:
+    def __init__(self, handler=handle_in_session) -> None:
+        """
+        ASGI application serving the routes of lambda_function from a long
+        running process, e.g. `uvicorn asgi:app`: the engine, pool, secrets
+        and caches are created once at startup instead of per cold start.
+
+        Args:
+            handler: Coroutine function taking the API Gateway event and a
+                RequestContext and returning the handler's response.
+        """
+        self.handler = handler
+        self.loop = None
+        self.refresher = None
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def http(self, scope, receive, send) -> None:
+        context = RequestContext()
+        body = await read_body(receive)
+        if body is None:
+            response = {
+                "statusCode": 413,
+                "body": json.dumps({"message": "Request body is too large"}),
+            }
+            await send_response(send, response, context.aws_request_id)
+            return
+        with metrics.invocation("api"):
+            metrics.set_property("requestId", context.aws_request_id)
+            try:
+                response = await self.handler(request_event(scope, body), context)
+            except Exception as e:
+                # handle_event answers its own errors; this is the session's
+                metrics.count("errors")
+                LOGGER.error(e)
+                response = {
+                    "statusCode": 500,
+                    "body": json.dumps(
+                        {
+                            "message": f"Something went wrong, requestId: {context.aws_request_id}"
+                        }
+                    ),
+                }
+        await send_response(send, response, context.aws_request_id)
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    LOGGER.error(e)
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        # unlike a Lambda's, this process outlives the requests, so history is
+        # written by the worker thread, which hands its writes back to this loop
+        RESOURCES.override(
+            "request_history_sink",
+            lambda_function.create_request_history_sink(
+                self.write_request_history, start_worker=True
+            ),
+        )
+        # reads the database secret, opens the first connection and loads the
+        # snapshot now rather than in the first requests
+        async with AsyncSession(get_async_engine()) as session:
+            if lambda_function.RECOMMENDATION_SOURCE == "catalogue":
+                store = lambda_function.get_snapshot_store()
+                # boto3 would block the loop, and every request with it
+                await asyncio.to_thread(store.refresh_from_catalogue)
+                if store.snapshot is None:
+                    # nothing exported yet
+                    await session.run_sync(store.get)
+                store.refresh_in_requests = False
+                self.refresher = asyncio.create_task(self.refresh_catalogue(store))
+            elif lambda_function.RECOMMENDATION_SOURCE == "snapshot":
+                await session.run_sync(lambda_function.get_snapshot_store().get)
+            else:
+                await session.connection()
+
+    async def refresh_catalogue(self, store) -> None:
+        while True:
+            await asyncio.sleep(store.refresh_seconds)
+            try:
+                await asyncio.to_thread(store.refresh_from_catalogue)
+            except Exception as e:
+                LOGGER.error(f"Catalogue refresh failed: {e}")
+
+    async def shutdown(self) -> None:
+        if self.refresher is not None:
+            self.refresher.cancel()
+        try:
+            await asyncio.to_thread(lambda_function.get_request_history_sink().flush)
+        except Exception as e:
+            LOGGER.error(f"Request history lost on shutdown: {e}")
+        await get_async_engine().dispose()
+
+    def write_request_history(self, rows: list[dict]) -> None:
+        asyncio.run_coroutine_threadsafe(
+            bulk_create_request_history_async(get_async_engine(), rows), self.loop
+        ).result()
+
+
+app = ApiServer()
@@ -0,0 +1,70 @@
+"""
+Synthetic restaurant catalogue, produced as create records in the format
+accepted by POST /restaurant and the ETL create/ files.
+"""
+
+from query.common import Style
+import random
+
+TIMEZONES = ["America/Chicago", "America/New_York", "America/Los_Angeles", "UTC"]
+STREETS = ["Main", "Oak", "Pine", "Maple", "Cedar", "Elm", "Lake", "Hill", "Park"]
+NAME_ADJECTIVES = ["Golden", "Little", "Blue", "Old", "Happy", "Royal", "Green", "Lucky"]
+NAME_NOUNS = [
+    "Pizza", "Pizzeria", "Sushi", "Noodle", "Taco", "Burger", "Curry", "Dragon",
+    "Garden", "Bistro", "Kitchen", "Grill", "Cafe", "Diner", "Bakery", "Tavern",
+]
+# half the side of the square locations are drawn from, about 22km
+LOCATION_SPREAD_DEGREES = 0.2
+
+
+def generate_records(
+    count: int,
+    seed: int = 0,
+    style_weights: dict[str, float] = None,
+    vegetarian_ratio: float = 0.3,
+    delivers_ratio: float = 0.5,
+    timezones: list[str] = TIMEZONES,
+    descriptive_names: bool = False,
+    locations_around: tuple[float, float] = None,
+    opening_minutes: tuple[int, int] = (6 * 60, 13 * 60),
+    opening_lengths: tuple[int, int] = (6 * 60, 12 * 60),
+):
+    """
+    Yields `count` create records. The same arguments always produce the
+    same records. Descriptive names ("Golden Pizza Kitchen 0000042") give
+    the search something to match; the default names are "restaurant N".
+    With locations_around, a (latitude, longitude), records also carry a
+    location within LOCATION_SPREAD_DEGREES of it. Restaurants open at a
+    quarter hour in [opening_minutes) and stay open for a quarter hour
+    multiple in [opening_lengths), closing by 23:45.
+    """
+    rng = random.Random(seed)
+    style_weights = style_weights or {style: 1.0 for style in Style._member_names_}
+    styles = list(style_weights)
+    weights = [style_weights[style] for style in styles]
+    for index in range(count):
+        open_minute = rng.randrange(*opening_minutes, 15)
+        close_minute = min(open_minute + rng.randrange(*opening_lengths, 15), 23 * 60 + 45)
+        name = f"restaurant {index:07d}"
+        if descriptive_names:
+            name = (
+                f"{rng.choice(NAME_ADJECTIVES)} {rng.choice(NAME_NOUNS)} "
+                f"{rng.choice(NAME_NOUNS)} {index:07d}"
+            )
+        record = dict(
+            name=name,
+            style=rng.choices(styles, weights)[0],
+            address=f"{rng.randint(1, 9999)} {rng.choice(STREETS)} Street",
+            openHour=f"{open_minute // 60:02d}:{open_minute % 60:02d}",
+            closeHour=f"{close_minute // 60:02d}:{close_minute % 60:02d}",
+            vegetarian=str(rng.random() < vegetarian_ratio).lower(),
+            delivers=str(rng.random() < delivers_ratio).lower(),
+            timezone=rng.choice(timezones),
+        )
+        if locations_around:
+            latitude, longitude = locations_around
+            record.update(
+                latitude=f"{latitude + rng.uniform(-1, 1) * LOCATION_SPREAD_DEGREES:.6f}",
+                longitude=f"{longitude + rng.uniform(-1, 1) * LOCATION_SPREAD_DEGREES:.6f}",
+            )
+        yield record
@@ -0,0 +1,181 @@
+"""
+Cold start of the API Lambda: import time per module (python -X importtime)
+and the wall time of the import plus the first /recommend request, each in a
+fresh interpreter. Secrets Manager and KMS are stubbed; the database is an
+in-memory SQLite engine unless BENCHMARK_DATABASE_URL points at Postgres.
+
+Usage (from the repository root):
+    PYTHONPATH=app python -m benchmarks.cold_start_benchmark [--runs 5] \\
+        [--output cold_start.json] [--baseline cold_start.json --tolerance 0.2]
+
+With --baseline the run fails when the median cold start regresses by more
+than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RECOMMEND_EVENT = {
+    "path": "/recommend",
+    "httpMethod": "GET",
+    "headers": {"X-AUTH-API-KEY": "benchmark"},
+    "queryStringParameters": {
+        "query": "italian restaurants that deliver",
+        "requestTime": "2024-01-01T12:00:00+00:00",
+    },
+}
+
+
+class StubSecretsManager:
+    def get_secret_value(self, SecretId):
+        return {
+            "SecretString": json.dumps(
+                {"apiKey": "benchmark", "username": "user", "password": "password"}
+            )
+        }
+
+
+class StubKms:
+    def generate_data_key(self, KeyId, KeySpec):
+        return {"Plaintext": os.urandom(32), "CiphertextBlob": os.urandom(64)}
+
+
+class StubContext:
+    aws_request_id = "cold-start-benchmark"
+
+
+def child() -> None:
+    """
+    Runs inside a fresh interpreter and prints the timings as JSON.
+    """
+    start = time.perf_counter()
+    import lambda_function
+
+    imported = time.perf_counter()
+    from query.clients import RESOURCES
+    from sqlalchemy import create_engine
+
+    RESOURCES.override("secretsmanager", StubSecretsManager())
+    RESOURCES.override("kms", StubKms())
+    database_url = os.getenv("BENCHMARK_DATABASE_URL")
+    if database_url:
+        RESOURCES.override("engine", create_engine(database_url))
+    else:
+        from query.migrate import migrate
+
+        engine = create_engine("sqlite://")
+        migrate(engine)
+        RESOURCES.override("engine", engine)
+    configured = time.perf_counter()
+    response = lambda_function.lambda_handler(RECOMMEND_EVENT, StubContext())
+    responded = time.perf_counter()
+    print(
+        json.dumps(
+            dict(
+                import_ms=(imported - start) * 1000,
+                first_request_ms=(responded - configured) * 1000,
+                cold_start_ms=(imported - start + responded - configured) * 1000,
+                status_code=response["statusCode"],
+                initialized=RESOURCES.initialized(),
+            )
+        )
+    )
+
+
+def run_child() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cold_start_benchmark", "--child"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def import_times(module: str) -> list[tuple[int, str, int, int]]:
+    """
+    Returns (depth, name, self us, cumulative us) for every module imported
+    by module, parsed from python -X importtime. Depth 1 is a direct import.
+    """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    entries = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(own), int(cumulative)))
+    # children are reported before their parent, so walk back from module
+    root = max(index for index, entry in enumerate(entries) if entry[1] == module)
+    subtree = []
+    for entry in reversed(entries[:root]):
+        if entry[0] <= entries[root][0]:
+            break
+        subtree.append((entry[0] - entries[root][0], *entry[1:]))
+    return subtree
+
+
+def run(runs: int, top: int, output: str | None, baseline: str | None, tolerance: float):
+    subtree = import_times("lambda_function")
+    print("direct imports of lambda_function by cumulative time:")
+    direct = [entry for entry in subtree if entry[0] == 1]
+    for _, name, _, cumulative in sorted(direct, key=lambda entry: -entry[3])[:top]:
+        print(f"{cumulative / 1000:>10.1f}ms  {name}")
+    print("heaviest modules by self time:")
+    for _, name, own, _ in sorted(subtree, key=lambda entry: -entry[2])[:top]:
+        print(f"{own / 1000:>10.1f}ms  {name}")
+
+    samples = [run_child() for _ in range(runs)]
+    result = {
+        key: statistics.median(sample[key] for sample in samples)
+        for key in ("import_ms", "first_request_ms", "cold_start_ms")
+    }
+    print(
+        f"median of {runs} runs: import {result['import_ms']:.1f}ms, "
+        f"first request {result['first_request_ms']:.1f}ms "
+        f"(status {samples[-1]['status_code']}), "
+        f"cold start {result['cold_start_ms']:.1f}ms"
+    )
+    print(f"initialized on first request: {samples[-1]['initialized']}")
+    if output:
+        with open(output, "w") as file:
+            json.dump(result, file, indent=2)
+    if baseline:
+        with open(baseline) as file:
+            previous = json.load(file)["cold_start_ms"]
+        limit = previous * (1 + tolerance)
+        if result["cold_start_ms"] > limit:
+            sys.exit(
+                f"cold start regressed: {result['cold_start_ms']:.1f}ms > {limit:.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    argument_parser.add_argument("--runs", type=int, default=5)
+    argument_parser.add_argument("--top", type=int, default=15)
+    argument_parser.add_argument("--output")
+    argument_parser.add_argument("--baseline")
+    argument_parser.add_argument("--tolerance", type=float, default=0.2)
+    arguments = argument_parser.parse_args()
+    if arguments.child:
+        child()
+    else:
+        run(
+            arguments.runs,
+            arguments.top,
+            arguments.output,
+            arguments.baseline,
+            arguments.tolerance,
+        )
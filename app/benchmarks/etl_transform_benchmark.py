@@ -0,0 +1,54 @@
+"""
+Compares the columnar transform_create_lines with the per-row
+rows_to_object / is_valid_create_restaurant / record_to_restaurant_row path
+used by the ETL before.
+
+Usage (from the repository root):
+    PYTHONPATH=app python -m benchmarks.etl_transform_benchmark [--lines 100000]
+"""
+
+from benchmarks.catalogue import generate_records
+from etl.transform import CREATE_FIELDS, transform_create_lines, rows_to_object
+from query.utils import is_valid_create_restaurant, record_to_restaurant_row
+import argparse
+import itertools
+import time
+
+SEPARATOR = "|"
+
+
+def per_row(headers: list[str], lines: list[str]):
+    rows = []
+    rejected = []
+    for line in lines:
+        record = rows_to_object(headers, line.split(SEPARATOR))
+        if not is_valid_create_restaurant(record):
+            rejected.append(line)
+            continue
+        rows.append(record_to_restaurant_row(record))
+    return rows, rejected
+
+
+def run(line_count: int, batch_size: int) -> None:
+    lines = [
+        SEPARATOR.join(record[field] for field in CREATE_FIELDS)
+        for record in generate_records(line_count)
+    ]
+    batches = [list(batch) for batch in itertools.batched(lines, batch_size)]
+    for label, function in [("per-row", per_row), ("columnar", transform_create_lines)]:
+        start = time.perf_counter()
+        for batch in batches:
+            if function is per_row:
+                function(CREATE_FIELDS, batch)
+            else:
+                function(CREATE_FIELDS, batch, SEPARATOR)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>9}: {elapsed:.2f}s, {line_count / elapsed:,.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--lines", type=int, default=100000)
+    argument_parser.add_argument("--batch-size", type=int, default=100)
+    arguments = argument_parser.parse_args()
+    run(arguments.lines, arguments.batch_size)
@@ -0,0 +1,106 @@
+"""
+Compares the single-pass SentenceParser against the per-keyword regex helpers
+it replaced, kept here as the reference it must agree with, for the current
+styles and for larger synthetic cuisine lists.
+
+Usage (from the repository root):
+    PYTHONPATH=app python -m benchmarks.parser_benchmark [--number 2000]
+"""
+
+from query.common import Style, extract_time_and_context
+from query.parser import SentenceParser, BOOLEAN_KEY_WORDS
+import argparse
+import pendulum
+import re
+import timeit
+
+SENTENCES = [
+    "A vegetarian Italian restaurant open now",
+    "Find a non-vegetarian korean place that can deliver by 8 PM",
+    "Find an Italian not French restaurant open at 8:30pm",
+    "somewhere open soon",
+]
+
+
+def filter_negation_is_present(key_word: str, sentence: str):
+    negation_prefixes = ["non-", "not "]
+    for prefix in negation_prefixes:
+        word_to_search = f"{prefix}{key_word}"
+        if re.search(rf"\b{word_to_search}\b", sentence, re.IGNORECASE):
+            return True
+    return False
+
+
+def filter_is_present(key_word: str, sentence: str):
+    if re.search(rf"\b{key_word}\b", sentence, re.IGNORECASE):
+        return True
+    return False
+
+
+def get_boolean_filter(key_word: str, sentence: str) -> bool | None:
+    # check negation first
+    if filter_negation_is_present(key_word, sentence):
+        return False
+    elif filter_is_present(key_word, sentence):
+        return True
+    return None
+
+
+def get_style_filter(sentence: str) -> tuple[bool, list[str]]:
+    filters = []
+    filter_negations = []
+    for style in Style._member_names_:
+        # check negation first
+        if filter_negation_is_present(style, sentence):
+            filter_negations.append(style)
+        elif filter_is_present(style, sentence):
+            filters.append(style)
+    return (False, filters) if len(filters) > 0 else (True, filter_negations)
+
+
+def legacy_parse(styles: list[str], sentence: str, request_time: pendulum.DateTime):
+    filters = []
+    filter_negations = []
+    for style in styles:
+        if filter_negation_is_present(style, sentence):
+            filter_negations.append(style)
+        elif filter_is_present(style, sentence):
+            filters.append(style)
+    booleans = []
+    for key_word in BOOLEAN_KEY_WORDS:
+        if filter_negation_is_present(key_word, sentence):
+            booleans.append(False)
+        elif filter_is_present(key_word, sentence):
+            booleans.append(True)
+        else:
+            booleans.append(None)
+    return filters, filter_negations, booleans, extract_time_and_context(
+        sentence, request_time
+    )
+
+
+def run(number: int) -> None:
+    request_time = pendulum.now(tz="UTC")
+    print(f"{'styles':>8} {'legacy us/sentence':>20} {'parser us/sentence':>20} {'speedup':>8}")
+    for extra in [0, 25, 100]:
+        styles = Style._member_names_ + [f"cuisine{index}" for index in range(extra)]
+        parser = SentenceParser(styles, BOOLEAN_KEY_WORDS)
+        legacy = timeit.timeit(
+            lambda: [legacy_parse(styles, s, request_time) for s in SENTENCES],
+            number=number,
+        )
+        single_pass = timeit.timeit(
+            lambda: [parser.parse(s, request_time) for s in SENTENCES],
+            number=number,
+        )
+        per_sentence = number * len(SENTENCES) / 1e6
+        print(
+            f"{len(styles):>8} {legacy / per_sentence:>20.2f} "
+            f"{single_pass / per_sentence:>20.2f} {legacy / single_pass:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--number", type=int, default=2000)
+    run(argument_parser.parse_args().number)
@@ -0,0 +1,144 @@
+"""
+Latency of search sentences ("pizza near Main Street") at catalogue scale:
+the pure-Python SearchIndex behind the snapshot modes, and with
+BENCHMARK_DATABASE_URL set, the Postgres full-text ranking query too.
+Reports p50/p95 of a first page per path; the index timings are measured
+with its result cache cleared, i.e. every sentence is new.
+
+Usage (from the repository root):
+    PYTHONPATH=app python -m benchmarks.search_benchmark --rows 1000000 \\
+        [--repeat 20] [--skip-seed] [--check --budget-ms 10]
+
+With --check the run fails when a path's p95 is over the budget.
+"""
+
+from array import array
+from benchmarks.catalogue import generate_records
+from benchmarks.explain_benchmark import seed
+from query.builder import build_restaurant_query
+from query.parser import parse_sentence
+from query.snapshot import RestaurantSnapshot, STYLE_CODES
+import argparse
+import math
+import os
+import pendulum
+import statistics
+import sys
+import time
+
+PAGE_SIZE = 20
+SENTENCES = [
+    "pizza near Main Street",
+    "golden dragon",
+    "sushi on oak",
+    "a vegetarian italian bistro that delivers",
+    "luky garden",
+    "tavern on 1200 Lake Street",
+    "noodle kitchen open now",
+    "burger",
+]
+
+
+def percentile(timings: list[float], fraction: float) -> float:
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(label: str, timings: list[float]) -> float:
+    p95 = percentile(timings, 0.95)
+    print(
+        f"{label}: p50 {statistics.median(timings):.2f}ms, p95 {p95:.2f}ms, "
+        f"max {max(timings):.2f}ms over {len(timings)} queries"
+    )
+    return p95
+
+
+def build_snapshot(rows: int) -> RestaurantSnapshot:
+    """
+    Snapshot columns straight from the generated records; fragments are
+    placeholders since only the search and paging are measured.
+    """
+    records = sorted(
+        generate_records(rows, descriptive_names=True),
+        key=lambda record: (record["name"], record["address"]),
+    )
+    return RestaurantSnapshot(
+        1,
+        keys=[(record["name"], record["address"]) for record in records],
+        fragments=["{}"] * len(records),
+        style_codes=[STYLE_CODES.get(record["style"], 0) for record in records],
+        vegetarian=[record["vegetarian"] == "true" for record in records],
+        delivers=[record["delivers"] == "true" for record in records],
+        open_minutes=array("h", [0] * len(records)),
+        close_minutes=array("h", [1439] * len(records)),
+        latitudes=array("d", [math.nan] * len(records)),
+        longitudes=array("d", [math.nan] * len(records)),
+    )
+
+
+def time_queries(run_query, specs, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        for spec in specs:
+            start = time.perf_counter()
+            run_query(spec)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def run(rows: int, repeat: int, skip_seed: bool, check: bool, budget_ms: float) -> None:
+    request_time = pendulum.datetime(2024, 12, 29, 19, 0, tz="UTC")
+    specs = [parse_sentence(sentence, request_time) for sentence in SENTENCES]
+    for sentence, spec in zip(SENTENCES, specs):
+        print(f"{sentence!r}: terms {spec.terms}")
+
+    start = time.perf_counter()
+    snapshot = build_snapshot(rows)
+    print(f"snapshot of {rows} rows built in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    index = snapshot.search_index()
+    print(f"search index built in {time.perf_counter() - start:.1f}s")
+
+    def snapshot_page(spec):
+        index.results.clear()
+        snapshot.page(spec, 1, PAGE_SIZE)
+
+    p95s = {"search index": report("search index", time_queries(snapshot_page, specs, repeat))}
+
+    database_url = os.getenv("BENCHMARK_DATABASE_URL")
+    if database_url:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import Session
+
+        engine = create_engine(database_url)
+        if not skip_seed:
+            seed(engine, rows, batch_size=5000, descriptive_names=True)
+        with Session(engine) as session:
+
+            def database_page(spec):
+                build_restaurant_query(session, spec, 1, PAGE_SIZE).all()
+
+            # warm the buffer cache like a running service
+            time_queries(database_page, specs, 1)
+            p95s["postgres"] = report("postgres", time_queries(database_page, specs, repeat))
+
+    over = [label for label, p95 in p95s.items() if p95 > budget_ms]
+    if check and over:
+        sys.exit(f"p95 over {budget_ms}ms: {', '.join(over)}")
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--rows", type=int, default=1000000)
+    argument_parser.add_argument("--repeat", type=int, default=20)
+    argument_parser.add_argument("--skip-seed", action="store_true")
+    argument_parser.add_argument("--check", action="store_true")
+    argument_parser.add_argument("--budget-ms", type=float, default=10.0)
+    arguments = argument_parser.parse_args()
+    run(
+        arguments.rows,
+        arguments.repeat,
+        arguments.skip_seed,
+        arguments.check,
+        arguments.budget_ms,
+    )
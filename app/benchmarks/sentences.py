@@ -0,0 +1,67 @@
+"""
+Synthetic /recommend sentences covering the filter shapes of
+query.shapes: styles (some negated), vegetarian, deliver, the four time
+contexts plus "open now"/"open soon", and words left for the search.
+"""
+
+from benchmarks.catalogue import NAME_NOUNS, STREETS
+from query.common import Style
+import random
+
+OPENINGS = ["", "Find", "Show me", "Any", "I want"]
+PLACES = ["restaurant", "place", "spot"]
+TIME_PHRASES = [
+    "open now",
+    "open soon",
+    "by {hour}pm",
+    "after {hour}pm",
+    "before {hour}am",
+    "at {hour}:30am",
+]
+
+
+def generate_sentences(
+    count: int,
+    seed: int = 0,
+    style_ratio: float = 0.6,
+    negation_ratio: float = 0.2,
+    vegetarian_ratio: float = 0.3,
+    deliver_ratio: float = 0.3,
+    time_ratio: float = 0.5,
+    search_ratio: float = 0.2,
+):
+    """
+    Yields count sentences; the same arguments always produce the same
+    sentences. Each ratio is the share of sentences using that filter, and
+    negation_ratio the share of used styles and flags that are negated.
+    """
+    rng = random.Random(seed)
+    styles = Style._member_names_
+
+    def negated(word: str) -> str:
+        if rng.random() >= negation_ratio:
+            return word
+        return rng.choice([f"non-{word}", f"not {word}"])
+
+    for _ in range(count):
+        words = [rng.choice(OPENINGS)]
+        if rng.random() < vegetarian_ratio:
+            words.append(negated("vegetarian"))
+        if rng.random() < style_ratio:
+            chosen = rng.sample(styles, rng.choice([1, 1, 1, 2]))
+            words.append(" or ".join(negated(style) for style in chosen))
+        words.append(rng.choice(PLACES))
+        if rng.random() < deliver_ratio:
+            words.append(f"that can {negated('deliver')}")
+        if rng.random() < time_ratio:
+            words.append(rng.choice(TIME_PHRASES).format(hour=rng.randint(1, 11)))
+        if rng.random() < search_ratio:
+            words.append(
+                rng.choice(
+                    [
+                        rng.choice(NAME_NOUNS).lower(),
+                        f"near {rng.choice(STREETS)} Street",
+                    ]
+                )
+            )
+        yield " ".join(word for word in words if word)
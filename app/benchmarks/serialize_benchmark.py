@@ -0,0 +1,127 @@
+"""
+Latency and peak allocation of building one /recommend response at page
+sizes 20, 200 and 2000: ORM instances + dicts + json.dumps (the previous
+path), projected rows + dicts, projected rows rendered to fragments, and a
+cached page of fragments. Uses an in-memory SQLite catalogue unless
+BENCHMARK_DATABASE_URL points at a Postgres.
+
+Usage (from the repository root):
+    PYTHONPATH=app python -m benchmarks.serialize_benchmark [--sizes 20 200 2000] [--number 50]
+"""
+
+from benchmarks.catalogue import generate_records
+from query.builder import build_restaurant_query, bulk_upsert_restaurants
+from query.common import Restaurant, normalize_time
+from query.migrate import migrate
+from query.parser import FilterSpec
+from query.serialize import render_restaurant, render_recommendation_body
+from query.utils import record_to_restaurant_row
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+import argparse
+import datetime
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+NO_FILTERS = FilterSpec((), True, None, None, None, None, None)
+
+
+def seed(engine, rows: int) -> None:
+    migrate(engine)
+    rows = [record_to_restaurant_row(record) for record in generate_records(rows)]
+    with Session(engine) as session:
+        if engine.dialect.name == "postgresql":
+            bulk_upsert_restaurants(session, rows, create_batch_size=5000)
+            return
+        # SQLite has no time with time zone, store the wall-clock time
+        for row in rows:
+            for column in ("open_hour", "close_hour"):
+                row[column] = datetime.time.fromisoformat(
+                    normalize_time(row[column].split(" ")[1])
+                )
+        session.add_all(Restaurant(**row) for row in rows)
+        session.commit()
+
+
+def to_dict(restaurant) -> dict:
+    return dict(
+        name=restaurant.name,
+        style=restaurant.style,
+        address=restaurant.address,
+        openHour=str(restaurant.open_hour),
+        clouseHour=str(restaurant.close_hour),
+        vegetarian=restaurant.vegetarian,
+        delivers=restaurant.delivers,
+    )
+
+
+def orm_dicts(session: Session, size: int, fragments) -> str:
+    restaurants = (
+        session.query(Restaurant)
+        .order_by(Restaurant.name, Restaurant.address)
+        .limit(size)
+        .all()
+    )
+    output = [to_dict(restaurant) for restaurant in restaurants]
+    return json.dumps({"restaurantRecommendation": output, "nextPage": None})
+
+
+def projection_dicts(session: Session, size: int, fragments) -> str:
+    rows = build_restaurant_query(session, NO_FILTERS, 1, size).all()
+    output = [to_dict(row) for row in rows]
+    return json.dumps({"restaurantRecommendation": output, "nextPage": None})
+
+
+def projection_fragments(session: Session, size: int, fragments) -> str:
+    rows = build_restaurant_query(session, NO_FILTERS, 1, size).all()
+    return render_recommendation_body([render_restaurant(row) for row in rows], None)
+
+
+def cached_fragments(session: Session, size: int, fragments) -> str:
+    return render_recommendation_body(fragments, None)
+
+
+PATHS = [orm_dicts, projection_dicts, projection_fragments, cached_fragments]
+
+
+def measure(engine, path, size: int, number: int, fragments) -> tuple[float, int]:
+    timings = []
+    for _ in range(number):
+        with Session(engine) as session:
+            start = time.perf_counter()
+            path(session, size, fragments)
+            timings.append(time.perf_counter() - start)
+    with Session(engine) as session:
+        tracemalloc.start()
+        path(session, size, fragments)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def run(sizes: list[int], number: int) -> None:
+    database_url = os.getenv("BENCHMARK_DATABASE_URL")
+    engine = create_engine(database_url or "sqlite://")
+    if not database_url:
+        seed(engine, max(sizes))
+    print(f"{'size':>5} {'path':>22} {'median ms':>10} {'peak KiB':>9}")
+    for size in sizes:
+        with Session(engine) as session:
+            fragments = [
+                render_restaurant(row)
+                for row in build_restaurant_query(session, NO_FILTERS, 1, size).all()
+            ]
+        for path in PATHS:
+            elapsed, peak = measure(engine, path, size, number, fragments)
+            print(f"{size:>5} {path.__name__:>22} {elapsed * 1000:>10.3f} {peak / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--sizes", type=int, nargs="+", default=[20, 200, 2000])
+    argument_parser.add_argument("--number", type=int, default=50)
+    arguments = argument_parser.parse_args()
+    run(arguments.sizes, arguments.number)
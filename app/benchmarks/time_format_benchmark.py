@@ -0,0 +1,51 @@
+"""
+Compares normalize_time (compiled grammar, with and without its LRU cache)
+against the strptime cascade to_24_hour_format used before.
+
+Usage (from the repository root):
+    PYTHONPATH=app python -m benchmarks.time_format_benchmark [--number 20000]
+"""
+
+from datetime import datetime
+from query.common import normalize_time
+import argparse
+import timeit
+
+INPUTS = ["8AM", "8 am", "8:30pm", "11:45 PM", "20:30", "20", "07:05"]
+STRPTIME_FORMATS = ["%I:%M %p", "%I:%M%p", "%I%p", "%I %p", "%H:%M", "%H"]
+
+
+def strptime_to_24_hour_format(time_str):
+    """
+    The strptime cascade to_24_hour_format used before, kept as the oracle
+    of tests/time_format_test.py.
+    """
+    for time_format in STRPTIME_FORMATS:
+        try:
+            return datetime.strptime(time_str.strip(), time_format).strftime("%H:%M")
+        except ValueError:
+            continue
+    raise ValueError(f"time data {time_str!r} does not match any supported format")
+
+
+def run(number: int) -> None:
+    paths = [
+        ("strptime cascade", strptime_to_24_hour_format),
+        ("grammar, uncached", normalize_time.__wrapped__),
+        ("grammar, cached", normalize_time),
+    ]
+    for time_str in INPUTS:
+        timings = []
+        for _, function in paths:
+            elapsed = timeit.timeit(lambda: function(time_str), number=number)
+            timings.append(elapsed / number * 1e6)
+        print(
+            f"{time_str:>10}: "
+            + ", ".join(f"{label} {timing:.2f}us" for (label, _), timing in zip(paths, timings))
+        )
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--number", type=int, default=20000)
+    run(argument_parser.parse_args().number)
@@ -0,0 +1,112 @@
+import json
+import os
+from sqlalchemy.orm import Session
+from query.catalogue import (
+    CataloguePointer,
+    CATALOGUE_FORMAT_VERSION,
+    CATALOGUE_SUFFIX,
+    LATEST_POINTER,
+    catalogue_key,
+    encode_catalogue,
+    read_catalogue_header,
+    read_latest_pointer,
+    s3_error_code,
+)
+from query.clients import LOGGER
+from query.snapshot import get_catalogue_version, load_snapshot
+
+CATALOGUE_PREFIX = os.getenv("CATALOGUE_PREFIX", "catalogue/")
+# "false" leaves the catalogue to a separate job
+CATALOGUE_EXPORT = os.getenv("CATALOGUE_EXPORT", "true").lower() == "true"
+
+
+def export_catalogue(
+    session: Session, s3_client, bucket_name: str, prefix: str = CATALOGUE_PREFIX
+) -> CataloguePointer | None:
+    """
+    Writes the restaurants as a catalogue file named after their
+    catalogue_version, then points LATEST at it. Nothing is written when
+    LATEST already names the current version in the current format, so
+    replayed or no-op jobs are cheap. LATEST is only replaced if unchanged
+    since it was read, so a slower concurrent export can't move it back to
+    an older version. Files older than the previous version are removed; the
+    previous one is kept for readers still downloading it.
+
+    Returns the pointer written, or None if the catalogue was up to date.
+    """
+    previous, etag = read_latest_pointer(s3_client, bucket_name, prefix)
+    if (
+        previous is not None
+        and previous.format_version == CATALOGUE_FORMAT_VERSION
+        and previous.version >= get_catalogue_version(session)
+    ):
+        LOGGER.info(f"Catalogue {previous.version} is up to date")
+        return None
+
+    snapshot = load_snapshot(session)
+    data = encode_catalogue(snapshot)
+    pointer = CataloguePointer(
+        version=snapshot.version,
+        key=catalogue_key(prefix, snapshot.version),
+        checksum=read_catalogue_header(data).checksum,
+        size=len(data),
+        format_version=CATALOGUE_FORMAT_VERSION,
+    )
+    s3_client.put_object(Bucket=bucket_name, Key=pointer.key, Body=data)
+
+    while not put_latest_pointer(s3_client, bucket_name, prefix, pointer, etag):
+        # a concurrent export replaced LATEST since it was read
+        previous, etag = read_latest_pointer(s3_client, bucket_name, prefix)
+        if (
+            previous is not None
+            and previous.format_version == CATALOGUE_FORMAT_VERSION
+            and previous.version >= pointer.version
+        ):
+            LOGGER.info(f"Catalogue {previous.version} was exported concurrently")
+            return None
+    LOGGER.info(
+        f"Exported catalogue {pointer.version}: {len(snapshot)} restaurants, "
+        f"{pointer.size} bytes"
+    )
+    if previous is not None:
+        remove_catalogues_before(s3_client, bucket_name, prefix, previous.version)
+    return pointer
+
+
+def put_latest_pointer(
+    s3_client, bucket_name: str, prefix: str, pointer: CataloguePointer, etag: str | None
+) -> bool:
+    """
+    Writes pointer as LATEST if LATEST still has etag, or doesn't exist yet
+    when etag is None. Returns False when it was changed meanwhile.
+    """
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    try:
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=f"{prefix}{LATEST_POINTER}",
+            Body=json.dumps(pointer._asdict()).encode("utf-8"),
+            ContentType="application/json",
+            **condition,
+        )
+    except Exception as e:
+        # 409 when a concurrent conditional write is still in progress
+        if s3_error_code(e) in ("PreconditionFailed", "ConditionalRequestConflict"):
+            return False
+        raise
+    return True
+
+
+def remove_catalogues_before(s3_client, bucket_name: str, prefix: str, version: int):
+    stale = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for item in page.get("Contents", []):
+            key = item["Key"]
+            if key.endswith(CATALOGUE_SUFFIX) and key < catalogue_key(prefix, version):
+                stale.append({"Key": key})
+    # delete_objects takes at most 1000 keys
+    for start in range(0, len(stale), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket_name, Delete={"Objects": stale[start : start + 1000]}
+        )
@@ -0,0 +1,128 @@
+from typing import NamedTuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+
+DEFAULT_TAIL_SIZE = 64 * 1024
+
+
+class LineBatch(NamedTuple):
+    lines: list[str]
+    end_offset: int
+
+
+class S3RangeReader:
+    def __init__(
+        self,
+        s3_client,
+        bucket_name: str,
+        object_key: str,
+        range_size: int,
+        max_workers: int,
+        tail_size: int = DEFAULT_TAIL_SIZE,
+    ) -> None:
+        """
+        Reads a newline separated S3 object as byte ranges fetched concurrently.
+        A range owns every line that starts inside it, so ranges can be split
+        at arbitrary offsets; the header line is read once and shared.
+
+        Args:
+            s3_client: boto3 S3 client (or any object with head_object/get_object).
+            bucket_name (str): The name of the S3 bucket.
+            object_key (str): The key of the object to read.
+            range_size (int): Size in bytes of each ranged GET.
+            max_workers (int): Number of ranges fetched and split concurrently.
+            tail_size (int): Size of the extra GETs used to finish a line that
+                runs past the end of its range.
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.range_size = range_size
+        self.max_workers = max_workers
+        self.tail_size = tail_size
+        head = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        self.size = head["ContentLength"]
+        self.etag = head.get("ETag")
+        # the range [0, 1) owns exactly the header line
+        _, header = self._fetch_owned(0, 1)
+        self.header_end = len(header)
+        self.header = header.decode("utf-8").rstrip("\r\n")
+
+    def _get(self, start: int, end: int) -> bytes:
+        response = self.s3_client.get_object(
+            Bucket=self.bucket_name, Key=self.object_key, Range=f"bytes={start}-{end}"
+        )
+        return response["Body"].read()
+
+    def _fetch_owned(self, start: int, end: int) -> tuple[int, bytes]:
+        """
+        Returns the absolute offset and bytes of the lines starting in
+        [start, end), including the end of the last line when it runs past end.
+        """
+        if start >= self.size:
+            return start, b""
+        fetch_start = start - 1 if start > 0 else 0
+        data = self._get(fetch_start, end - 1)
+        begin = 0
+        if start > 0:
+            newline = data.find(b"\n")
+            if newline == -1 or fetch_start + newline + 1 >= end:
+                return start, b""
+            begin = newline + 1
+        position = end
+        while not data.endswith(b"\n") and position < self.size:
+            piece = self._get(position, min(position + self.tail_size, self.size) - 1)
+            position += len(piece)
+            newline = piece.find(b"\n")
+            if newline != -1:
+                data += piece[: newline + 1]
+                break
+            data += piece
+        return fetch_start + begin, data[begin:]
+
+    def _fetch_batches(self, start: int, end: int, batch_size: int) -> list[LineBatch]:
+        offset, data = self._fetch_owned(start, end)
+        if not data:
+            return []
+        raw_lines = data.split(b"\n")
+        if data.endswith(b"\n"):
+            raw_lines.pop()
+        batches = []
+        for raw_batch in itertools.batched(raw_lines, batch_size):
+            # one decode per batch rather than per line
+            offset += sum(len(raw_line) + 1 for raw_line in raw_batch)
+            text = b"\n".join(raw_batch).decode("utf-8")
+            if "\r" in text:
+                text = text.replace("\r", "")
+            lines = [line for line in text.split("\n") if line]
+            batches.append(LineBatch(lines, min(offset, self.size)))
+        return batches
+
+    def iter_batches(self, batch_size: int, start_offset: int = 0):
+        """
+        Yields LineBatch objects in file order, skipping the header and
+        starting at start_offset (which must be the start of a line). At most
+        2 * max_workers ranges are fetched ahead of the consumer.
+        """
+        start_offset = max(start_offset, self.header_end)
+        ranges = iter(
+            (start, min(start + self.range_size, self.size))
+            for start in range(start_offset, self.size, self.range_size)
+        )
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque(
+                executor.submit(self._fetch_batches, start, end, batch_size)
+                for start, end in itertools.islice(ranges, 2 * self.max_workers)
+            )
+            try:
+                while pending:
+                    batches = pending.popleft().result()
+                    for start, end in itertools.islice(ranges, 1):
+                        pending.append(
+                            executor.submit(self._fetch_batches, start, end, batch_size)
+                        )
+                    yield from batches
+            finally:
+                for future in pending:
+                    future.cancel()
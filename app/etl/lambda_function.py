@@ -1,113 +1,190 @@
 import json
+import os
 from query.builder import (
-    batch_create_restaurants,
-    delete_restaurant,
-    update_restaurant,
+    bulk_upsert_restaurants,
+    bulk_delete_restaurants,
+    bulk_update_restaurants,
+    start_etl_job,
+    checkpoint_etl_job,
 )
-from etl.utils import read_s3_file_by_lines, rows_to_object, S3StreamWriter
-from query.clients import SESSION, LOGGER
+from etl.export import export_catalogue, CATALOGUE_EXPORT
+from etl.ingest import S3RangeReader
+from etl.transform import rows_to_object, transform_create_lines
+from etl.utils import S3StreamWriter
+from query.migrate import lambda_handler as migrate_lambda_handler
+from query import metrics
+from query.clients import get_session, get_s3_client, session_scope, LOGGER
 from query.utils import (
-    is_valid_create_restaurant,
     is_valid_update_restaurant,
     is_valid_delete_restaurant,
-    record_to_create_restuarant,
-    record_to_delete_restuarant,
+    record_to_update_row,
 )
 
 DATA_SEPARATOR = "|"
 S3_fILE_LIMIT = 1000000
 MAX_BATCH_WRITE = 100
+ETL_RANGE_SIZE = int(os.getenv("ETL_RANGE_SIZE", str(8 * 1024 * 1024)))
+ETL_MAX_WORKERS = int(os.getenv("ETL_MAX_WORKERS", "4"))
 
 
 def lambda_handler(event, context):
     LOGGER.debug("Received event: {}".format(json.dumps(event)))
 
+    if event.get("action") == "migrate":
+        return migrate_lambda_handler(event, context)
+
     for record in event.get("Records", []):
         s3_info = record.get("s3", {})
         bucket_name = s3_info.get("bucket", {}).get("name")
         object_key: str = s3_info.get("object", {}).get("key")
 
-        if object_key.startswith("create"):
-            LOGGER.info("handling create restaurant")
-            handleCreateRestaurant(bucket_name, object_key)
-        elif object_key.startswith("update"):
-            LOGGER.info("handling update restaurant")
-            handleUpdateRestaurant(bucket_name, object_key)
-        elif object_key.startswith("delete"):
-            LOGGER.info("handling delete restaurant")
-            handleDeleteRestaurant(bucket_name, object_key)
-        else:
-            LOGGER.warning(f"Not implemented {bucket_name} {object_key}")
+        operation = object_key.split("/", 1)[0]
+        with metrics.invocation("etl", operation), session_scope() as session:
+            metrics.set_property("objectKey", object_key)
+            if object_key.startswith("create"):
+                LOGGER.info("handling create restaurant")
+                handleCreateRestaurant(bucket_name, object_key)
+            elif object_key.startswith("update"):
+                LOGGER.info("handling update restaurant")
+                handleUpdateRestaurant(bucket_name, object_key)
+            elif object_key.startswith("delete"):
+                LOGGER.info("handling delete restaurant")
+                handleDeleteRestaurant(bucket_name, object_key)
+            else:
+                LOGGER.warning(f"Not implemented {bucket_name} {object_key}")
+                continue
+            # also after a skipped job, so a retry exports what a failed
+            # export left out
+            if CATALOGUE_EXPORT:
+                with metrics.span("export"):
+                    export_catalogue(session, get_s3_client(), bucket_name)
+
+
+def run_job(bucket_name, object_key, unprocessed_prefix, process_lines):
+    """
+    Feeds the object's line batches to
+    process_lines(session, headers, lines, s3_writer),
+    which stages its writes without committing and returns
+    (rows_affected, rows_rejected). Must run inside session_scope, which
+    rolls back a failed batch. Each batch is committed together with
+    its checkpoint, so a retried invocation resumes after the last committed
+    batch with ranged GETs, and an ETag that already completed is skipped.
+    A batch's rejected lines are written to S3 before its checkpoint, as
+    one object named after the batch, which a retried batch overwrites.
+    """
+    session = get_session()
+    reader = S3RangeReader(
+        get_s3_client(), bucket_name, object_key, ETL_RANGE_SIZE, ETL_MAX_WORKERS
+    )
+    state = start_etl_job(session, object_key, reader.etag)
+    if state is None:
+        LOGGER.info(f"{object_key} {reader.etag} already processed or in progress, skipping")
+        return
+    if state.byte_offset > 0:
+        LOGGER.info(f"Resuming {object_key} after line {state.line_number}")
+    headers = reader.header.split(DATA_SEPARATOR)
+    # never flushed on the way out of a failed batch: it is rolled back
+    # and retried, rejecting the same lines again
+    s3_writer = S3StreamWriter(bucket_name, unprocessed_prefix, S3_fILE_LIMIT)
+    etag = (reader.etag or "").strip('"')
+    object_name = f"{os.path.basename(object_key)}_{etag}"
+    for batch in reader.iter_batches(MAX_BATCH_WRITE, state.byte_offset):
+        with metrics.span("process"):
+            rows_affected, rows_rejected = process_lines(
+                session, headers, batch.lines, s3_writer
+            )
+        with metrics.span("unprocessed"):
+            s3_writer.flush(f"{object_name}_line_{state.line_number + 1}")
+        with metrics.span("checkpoint"):
+            checkpoint_etl_job(
+                session,
+                state,
+                batch.end_offset,
+                len(batch.lines),
+                rows_affected,
+                rows_rejected,
+            )
+        metrics.count("lines", len(batch.lines))
+        metrics.count("rows_affected", rows_affected)
+        metrics.count("rows_rejected", rows_rejected)
+        LOGGER.info(
+            f"Processed {state.line_number} records of {object_key}, "
+            f"affected: {state.rows_affected}, rejected: {state.rows_rejected}"
+        )
+    checkpoint_etl_job(session, state, reader.size, 0, 0, 0, completed=True)
+    LOGGER.info(f"Completed {object_key}")
+
+
+def create_lines(session, headers, lines, s3_writer):
+    with metrics.span("transform"):
+        rows, rejected = transform_create_lines(headers, lines, DATA_SEPARATOR)
+    for line in rejected:
+        LOGGER.warning(f"Invalid record encountered: {line}")
+        s3_writer.append_line(line)
+    result = bulk_upsert_restaurants(session, rows, commit=False)
+    return result.created + result.updated, len(rejected) + result.rejected
+
+
+def delete_lines(session, headers, lines, s3_writer):
+    staged = {}
+    rejected = 0
+    for line in lines:
+        record = rows_to_object(headers, line.split(DATA_SEPARATOR))
+        if not is_valid_delete_restaurant(record):
+            LOGGER.warning(f"Invalid record encountered: {line}")
+            s3_writer.append_line(line)
+            rejected += 1
+            continue
+        staged[(record["name"], record["address"])] = line
+    matched = bulk_delete_restaurants(session, list(staged), commit=False)
+    return len(matched), rejected + write_unmatched(staged, matched, s3_writer)
+
+
+def update_lines(session, headers, lines, s3_writer):
+    staged = {}
+    rows = []
+    rejected = 0
+    for line in lines:
+        record = rows_to_object(headers, line.split(DATA_SEPARATOR))
+        try:
+            # a line that fails to convert is rejected, not the batch: the
+            # retry would resume at the same checkpoint and fail forever
+            row = record_to_update_row(record) if is_valid_update_restaurant(record) else None
+        except Exception as e:
+            LOGGER.warning(f"Failed to convert record: {e}")
+            row = None
+        if row is None:
+            LOGGER.warning(f"Invalid record encountered: {line}")
+            s3_writer.append_line(line)
+            rejected += 1
+            continue
+        staged[(record["name"], record["address"])] = line
+        rows.append(row)
+    matched = bulk_update_restaurants(session, rows, commit=False)
+    return len(matched), rejected + write_unmatched(staged, matched, s3_writer)
+
+
+def write_unmatched(staged: dict, matched: set, s3_writer: S3StreamWriter) -> int:
+    """
+    Sends the staged lines whose key matched no restaurant to the
+    unprocessed writer and returns how many there were.
+    """
+    unmatched = 0
+    for key, line in staged.items():
+        if key not in matched:
+            LOGGER.warning(f"No restaurant matched record: {line}")
+            s3_writer.append_line(line)
+            unmatched += 1
+    return unmatched
 
 
 def handleCreateRestaurant(bucket_name, object_key):
-    count = 0
-    s3_writer = S3StreamWriter(bucket_name, "unprocessed/create/", S3_fILE_LIMIT)
-    headers = None
-    restaurants = []
-    try:
-        for line in read_s3_file_by_lines(bucket_name, object_key):
-            row = line.split(DATA_SEPARATOR)
-            count += 1
-            if count == 1:
-                headers = row
-                continue
-            record = rows_to_object(headers, row)
-            if not is_valid_create_restaurant(record):
-                LOGGER.warning(f"Invalid record encountered: {line}")
-                s3_writer.append(line.encode(encoding="utf-8"))
-            restaurants.append(record_to_create_restuarant(record))
-
-            if (count - 1) % MAX_BATCH_WRITE == 0:
-                LOGGER.info(f"Creating {MAX_BATCH_WRITE} records, total records: {count - 1}")
-                batch_create_restaurants(SESSION, restaurants)
-                restaurants = []
-        if len(restaurants) > 0:
-            LOGGER.info(f"Creating {len(restaurants)} records, total records: {count - 1}")
-            batch_create_restaurants(SESSION, restaurants)
-    finally:
-        s3_writer.close()
+    run_job(bucket_name, object_key, "unprocessed/create/", create_lines)
 
 
 def handleDeleteRestaurant(bucket_name, object_key):
-    count = 0
-    s3_writer = S3StreamWriter(bucket_name, "unprocessed/delete/", S3_fILE_LIMIT)
-    headers = None
-    try:
-        for line in read_s3_file_by_lines(bucket_name, object_key):
-            row = line.split(DATA_SEPARATOR)
-            count += 1
-            if count == 1:
-                headers = row
-                continue
-            record = rows_to_object(headers, row)
-            if not is_valid_delete_restaurant(record):
-                LOGGER.warning(f"Invalid record encountered: {line}")
-                s3_writer.append(line.encode(encoding="utf-8"))
-            LOGGER.info(f"Deleting restaurant {record.get("name")}, total records: {count - 1}")
-            delete_restaurant(SESSION, record_to_delete_restuarant(record))
-    except Exception as e:
-        LOGGER.error(e)
-    finally:
-        s3_writer.close()
+    run_job(bucket_name, object_key, "unprocessed/delete/", delete_lines)
 
 
 def handleUpdateRestaurant(bucket_name, object_key):
-    count = 0
-    s3_writer = S3StreamWriter(bucket_name, "unprocessed/update/", S3_fILE_LIMIT)
-    headers = None
-    try:
-        for line in read_s3_file_by_lines(bucket_name, object_key):
-            row = line.split(DATA_SEPARATOR)
-            count += 1
-            if count == 1:
-                headers = row
-                continue
-            record = rows_to_object(headers, row)
-            if not is_valid_update_restaurant(record):
-                LOGGER.warning(f"Invalid record encountered: {line}")
-                s3_writer.append(line.encode(encoding="utf-8"))
-            LOGGER.info(f"Updating restaurant {record.get("name")}, total records: {count - 1}")
-            update_restaurant(SESSION, record)
-    finally:
-        s3_writer.close()
+    run_job(bucket_name, object_key, "unprocessed/update/", update_lines)
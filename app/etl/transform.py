@@ -0,0 +1,117 @@
+from typing import NamedTuple
+from query.common import (
+    Style,
+    LOGGER,
+    format_database_time,
+    is_valid_timezone,
+    normalize_time,
+    to_utc_minute,
+)
+from query.geo import parse_location
+import json
+
+CREATE_FIELDS = [
+    "name",
+    "style",
+    "address",
+    "openHour",
+    "closeHour",
+    "vegetarian",
+    "delivers",
+    "timezone",
+]
+STYLES = frozenset(Style._member_names_)
+BOOLEAN_VALUES = {"true": True, "false": False}
+
+
+class TransformResult(NamedTuple):
+    rows: list[dict]
+    rejected: list[str]
+
+
+def rows_to_object(headers: list[str], row: list[str]) -> dict:
+    output = {}
+    try:
+        for index in range(len(headers)):
+            output[headers[index]] = row[index]
+    except Exception as e:
+        LOGGER.error(f"Failed to convert row to record: {e}")
+        LOGGER.error(f"row: {json.dumps(row)}")
+        LOGGER.error(f"headers: {json.dumps(headers)}")
+
+    return output
+
+
+def transform_create_lines(
+    headers: list[str], lines: list[str], separator: str
+) -> TransformResult:
+    """
+    Validates and converts a batch of create lines column by column: every
+    field is split once, then each column is checked and normalised as a
+    whole. Returns the restaurant rows for the bulk loader and the lines
+    that were rejected.
+    """
+    positions = {header: index for index, header in enumerate(headers)}
+    if any(field not in positions for field in CREATE_FIELDS):
+        return TransformResult([], list(lines))
+
+    split_lines = [line.split(separator) for line in lines]
+    complete = [index for index, fields in enumerate(split_lines) if len(fields) >= len(headers)]
+    if not complete:
+        return TransformResult([], list(lines))
+    columns = list(zip(*(split_lines[index] for index in complete)))
+
+    def column(field: str) -> tuple[str, ...]:
+        return columns[positions[field]]
+
+    names = column("name")
+    addresses = column("address")
+    styles = [style.lower() for style in column("style")]
+    open_hours = [normalize_time(hour) for hour in column("openHour")]
+    close_hours = [normalize_time(hour) for hour in column("closeHour")]
+    vegetarian = [BOOLEAN_VALUES.get(value.lower()) for value in column("vegetarian")]
+    delivers = [BOOLEAN_VALUES.get(value.lower()) for value in column("delivers")]
+    timezones = column("timezone")
+    valid_timezones = [is_valid_timezone(timezone) for timezone in timezones]
+    # optional columns: files written before locations existed have neither
+    missing = ("",) * len(complete)
+    locations = [
+        parse_location(latitude, longitude)
+        for latitude, longitude in zip(
+            column("latitude") if "latitude" in positions else missing,
+            column("longitude") if "longitude" in positions else missing,
+        )
+    ]
+
+    rows = []
+    accepted = set()
+    for position, index in enumerate(complete):
+        if (
+            names[position]
+            and addresses[position]
+            and styles[position] in STYLES
+            and open_hours[position] is not None
+            and close_hours[position] is not None
+            and vegetarian[position] is not None
+            and delivers[position] is not None
+            and valid_timezones[position]
+            and locations[position] is not None
+        ):
+            accepted.add(index)
+            rows.append(
+                dict(
+                    name=names[position],
+                    style=styles[position],
+                    address=addresses[position],
+                    open_hour=format_database_time(open_hours[position], timezones[position]),
+                    close_hour=format_database_time(close_hours[position], timezones[position]),
+                    open_minute=to_utc_minute(open_hours[position], timezones[position]),
+                    close_minute=to_utc_minute(close_hours[position], timezones[position]),
+                    vegetarian=vegetarian[position],
+                    delivers=delivers[position],
+                    latitude=locations[position][0],
+                    longitude=locations[position][1],
+                )
+            )
+    rejected = [line for index, line in enumerate(lines) if index not in accepted]
+    return TransformResult(rows, rejected)
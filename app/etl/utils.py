@@ -1,26 +1,5 @@
-from query.clients import S3_CLIENT, LOGGER
+from query.clients import get_s3_client, LOGGER
 import time
-import json
-
-
-def read_s3_file_by_lines(bucket_name, file_key):
-    response = S3_CLIENT.get_object(Bucket=bucket_name, Key=file_key)
-    body = response["Body"]
-    for line in body.iter_lines():
-        yield line.decode("utf-8")
-
-
-def rows_to_object(headers: list[str], row: list[str]) -> dict:
-    output = {}
-    try:
-        for index in range(len(headers)):
-            output[headers[index]] = row[index]
-    except Exception as e:
-        LOGGER.error(f"Failed to convert row to record: {e}")
-        LOGGER.error(f"row: {json.dumps(row)}")
-        LOGGER.error(f"headers: {json.dumps(headers)}")
-
-    return output
 
 
 class S3StreamWriter:
@@ -42,15 +21,28 @@ class S3StreamWriter:
         if len(self.buffer) >= self.max_size:
             self._flush_to_s3()
 
+    def append_line(self, line: str) -> None:
+        self.append(line.encode(encoding="utf-8") + b"\n")
+
+    def flush(self, name: str = None) -> None:
+        """
+        Writes the buffered bytes, if any, as one object named name under
+        key_prefix, or as a new timestamped part without a name. Raises when
+        the write fails, keeping the buffer.
+        """
+        if not self.buffer:
+            return
+        if name is None:
+            self.part_number += 1
+            name = f"part_{self.part_number}_{int(time.time())}"
+        key = f"{self.key_prefix}{name}"
+        LOGGER.info(f"Writing {len(self.buffer)} bytes to S3 as {key}...")
+        get_s3_client().put_object(Bucket=self.bucket_name, Key=key, Body=bytes(self.buffer))
+        self.buffer.clear()
+
     def _flush_to_s3(self) -> None:
         try:
-            self.part_number += 1
-            unique_key = f"{self.key_prefix}part_{self.part_number}_{int(time.time())}"
-            LOGGER.info(f"Writing {len(self.buffer)} bytes to S3 as {unique_key}...")
-            S3_CLIENT.put_object(
-                Bucket=self.bucket_name, Key=unique_key, Body=self.buffer
-            )
-            self.buffer.clear()
+            self.flush()
         except Exception as e:
             LOGGER.error(f"Failed to write to S3: {e}")
 
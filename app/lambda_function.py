@@ -1,37 +1,110 @@
 import json
 import pendulum
 from query.builder import (
+    RecommendationPage,
     paginated_query_restaurants,
-    batch_create_restaurants,
+    paginated_query_restaurants_batch,
     delete_restaurant,
     update_restaurant,
-    create_request_history,
+    upsert_record_stream,
+    bulk_create_request_history,
+    RECOMMENDATION_CACHE,
+    QUERY_SHAPES,
 )
+import functools
 import os
-from query.common import (
-    Restaurant,
-    RequestHistory,
-    RequestType,
-    encrypt_data,
+from typing import NamedTuple
+from query.audit import EnvelopeEncryptor, RequestHistorySink
+from query.common import RequestType
+from query.counts import COUNT_MODES, get_result_counts
+from query.geo import get_geo_filter
+from query import metrics
+from query.parser import FilterSpec, parse_sentence, get_filter_fingerprint
+from query.serialize import (
+    iter_array_items,
+    render_batch_body,
+    render_recommendation_body,
+)
+from query.catalogue import CatalogueDownloader
+from query.snapshot import SnapshotStore, CatalogueSnapshotStore
+from query.clients import (
+    get_session,
+    session_scope,
+    get_secret,
+    get_kms_client,
+    get_s3_client,
+    get_engine,
+    RESOURCES,
+    LOGGER,
 )
-from query.clients import SESSION, SECRETS_MANAGER_CLIENT, KMS_CLIENT, LOGGER
 from query.utils import (
-    is_valid_create_restaurant,
     is_valid_update_restaurant,
     is_valid_delete_restaurant,
-    record_to_create_restuarant,
     record_to_delete_restuarant,
+    encode_page_cursor,
+    decode_page_cursor,
 )
 
 service_kms_key_arn = os.getenv("SERVICE_KMS_KEY_ARN")
-get_api_key_secret_response = SECRETS_MANAGER_CLIENT.get_secret_value(
-    SecretId=os.getenv("API_KEY_SECRET_ID")
-)
-API_KEY = json.loads(get_api_key_secret_response["SecretString"])["apiKey"]
 QUERY_PAGE_SIZE = int(os.getenv("QUERY_PAGE_SIZE", "20"))
+# "snapshot" answers /recommend from an in-memory copy of the catalogue,
+# "catalogue" from the catalogue file the ETL exports to S3
+RECOMMENDATION_SOURCE = os.getenv("RECOMMENDATION_SOURCE", "database")
+SNAPSHOT_REFRESH_SECONDS = float(os.getenv("SNAPSHOT_REFRESH_SECONDS", "30"))
+# sentences answered by one POST /recommend/batch
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "10"))
+
+
+def create_request_history_sink(writer=None, start_worker: bool = None) -> RequestHistorySink:
+    if start_worker is None:
+        # a Lambda flushes at the end of every invocation instead, see lambda_handler
+        start_worker = os.getenv("REQUEST_HISTORY_ASYNC", "false").lower() == "true"
+    return RequestHistorySink(
+        EnvelopeEncryptor(get_kms_client(), service_kms_key_arn),
+        writer or (lambda rows: bulk_create_request_history(get_engine(), rows)),
+        batch_size=int(os.getenv("REQUEST_HISTORY_BATCH_SIZE", "25")),
+        flush_interval=float(os.getenv("REQUEST_HISTORY_FLUSH_INTERVAL_SECONDS", "1")),
+        max_buffered=int(os.getenv("REQUEST_HISTORY_MAX_BUFFERED", "1000")),
+        start_worker=start_worker,
+    )
+
+
+RESOURCES.register("request_history_sink", create_request_history_sink)
+
+
+def get_request_history_sink() -> RequestHistorySink:
+    return RESOURCES.get("request_history_sink")
+
+
+@functools.cache
+def get_snapshot_store() -> SnapshotStore:
+    if RECOMMENDATION_SOURCE == "catalogue":
+        downloader = CatalogueDownloader(
+            get_s3_client(),
+            os.getenv("CATALOGUE_BUCKET_NAME"),
+            os.getenv("CATALOGUE_PREFIX", "catalogue/"),
+        )
+        return CatalogueSnapshotStore(downloader, SNAPSHOT_REFRESH_SECONDS)
+    return SnapshotStore(SNAPSHOT_REFRESH_SECONDS)
 
 
 def lambda_handler(event, context):
+    try:
+        with metrics.invocation("api"):
+            metrics.set_property("requestId", getattr(context, "aws_request_id", None))
+            return handle_event(event, context)
+    finally:
+        # written synchronously, on the response path: the process is frozen
+        # once the handler returns, so a background write would never run. A
+        # failed batch stays buffered, up to REQUEST_HISTORY_MAX_BUFFERED
+        # records, and is only written if this container is invoked again.
+        try:
+            get_request_history_sink().flush()
+        except Exception as e:
+            LOGGER.error(f"Failed to write request history, records stay buffered: {e}")
+
+
+def handle_event(event, context):
     LOGGER.debug("Received event: {}".format(json.dumps(event)))
     request_time = pendulum.now(tz="UTC")
     path = event.get("path")
@@ -39,27 +112,36 @@ def lambda_handler(event, context):
     response = None
     request_type = None
     try:
-        if path == "/recommend" and http_method == "GET":
-            LOGGER.info("handling get recommendation")
-            request_type = RequestType.Recommend
-            response = handleRecommendation(event, context)
-        elif path == "/restaurant" and http_method == "POST":
-            LOGGER.info("handling create restaurant")
-            request_type = RequestType.Create
-            response = handleCreateRestaurant(event, context)
-        elif path == "/restaurant" and http_method == "PUT":
-            LOGGER.info("handling update restaurant")
-            request_type = RequestType.Update
-            response = handleUpdateRestaurant(event, context)
-        elif path == "/deleteRestaurant" and http_method == "POST":
-            request_type = RequestType.Delete
-            LOGGER.info("handling delete restaurant")
-            response = handleDeleteRestaurant(event, context)
-        else:
-            LOGGER.info(f"Not implemented {path} {http_method}")
-            response = {"statusCode": 404, "body": json.dumps({"message": "Not Found"})}
-            request_type = RequestType.NotImplemented
+        with session_scope():
+            if path == "/recommend" and http_method == "GET":
+                LOGGER.info("handling get recommendation")
+                request_type = RequestType.Recommend
+                response = handleRecommendation(event, context)
+            elif path == "/recommend/batch" and http_method == "POST":
+                LOGGER.info("handling batch recommendation")
+                request_type = RequestType.RecommendBatch
+                response = handleRecommendationBatch(event, context)
+            elif path == "/restaurant" and http_method == "POST":
+                LOGGER.info("handling create restaurant")
+                request_type = RequestType.Create
+                response = handleCreateRestaurant(event, context)
+            elif path == "/restaurant" and http_method == "PUT":
+                LOGGER.info("handling update restaurant")
+                request_type = RequestType.Update
+                response = handleUpdateRestaurant(event, context)
+            elif path == "/deleteRestaurant" and http_method == "POST":
+                request_type = RequestType.Delete
+                LOGGER.info("handling delete restaurant")
+                response = handleDeleteRestaurant(event, context)
+            else:
+                LOGGER.info(f"Not implemented {path} {http_method}")
+                response = {
+                    "statusCode": 404,
+                    "body": json.dumps({"message": "Not Found"}),
+                }
+                request_type = RequestType.NotImplemented
     except Exception as e:
+        metrics.count("errors")
         LOGGER.error(e)
         response = {
             "statusCode": 500,
@@ -70,19 +152,18 @@ def lambda_handler(event, context):
             ),
         }
 
+    metrics.set_operation(request_type.name if request_type else "unknown")
+    metrics.set_property("statusCode", response["statusCode"])
     request = {
         "path": path,
         "http_method": http_method,
         "query_params": event.get("queryStringParameters"),
         "body": event.get("body"),
     }
-    request_history = RequestHistory(
-        request=encrypt_data(KMS_CLIENT, service_kms_key_arn, json.dumps(request)),
-        response=encrypt_data(KMS_CLIENT, service_kms_key_arn, json.dumps(response)),
-        request_type=request_type,
-        request_time=request_time,
-    )
-    create_request_history(SESSION, request_history)
+    with metrics.span("history"):
+        get_request_history_sink().record(
+            json.dumps(request), json.dumps(response), request_type, request_time
+        )
     return response
 
 
@@ -91,7 +172,9 @@ def authorize(event):
     if not header or header is None or header == "null":
         LOGGER.info(header)
         return False
-    return API_KEY == header.get("X-AUTH-API-KEY")
+    return get_secret(os.getenv("API_KEY_SECRET_ID"))["apiKey"] == header.get(
+        "X-AUTH-API-KEY"
+    )
 
 
 def get_request_time(string_date_time):
@@ -101,43 +184,181 @@ def get_request_time(string_date_time):
         LOGGER.error(e)
 
 
-def handleRecommendation(event, context):
-    query_params = event.get("queryStringParameters") or {}
+class RecommendationRequest(NamedTuple):
+    filter_spec: FilterSpec
+    fingerprint: str
+    page_number: int
+    # key of the last row of the previous page, for keyset paging
+    after: tuple | None
+    # an integer nextPage from an older client, answered with OFFSET paging
+    legacy_paging: bool
+    # one of COUNT_MODES when the response should carry counts and facets
+    counts: str | None = None
+
+
+def bad_request(message: str) -> dict:
+    return {
+        "statusCode": 400,
+        "body": json.dumps({"message": message}),
+    }
+
+
+def parse_recommendation_request(query_params: dict) -> RecommendationRequest | dict:
+    """
+    Validates the parameters of one recommendation, returning the request
+    or the 400 response to answer it with.
+    """
     if "query" not in query_params or "requestTime" not in query_params:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({"message": "query and requestTime required"}),
-        }
+        return bad_request("query and requestTime required")
     request_time = get_request_time(query_params.get("requestTime"))
     if not request_time:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({"message": "RequestTime is not properly formated"}),
-        }
+        return bad_request("RequestTime is not properly formated")
+
+    try:
+        near = get_geo_filter(query_params)
+    except ValueError as e:
+        return bad_request(str(e))
+
+    counts = query_params.get("counts")
+    if counts == "true":
+        counts = "auto"
+    if counts is not None and counts not in COUNT_MODES:
+        return bad_request(f"counts must be true or one of {', '.join(COUNT_MODES)}")
+
+    with metrics.span("parse"):
+        filter_spec = parse_sentence(query_params.get("query"), request_time)
+    if near:
+        filter_spec = filter_spec._replace(near=near)
+    fingerprint = get_filter_fingerprint(filter_spec)
+    next_page = query_params.get("nextPage")
+    legacy_paging = next_page is not None and next_page.isdigit()
+    page_number = int(next_page) if legacy_paging else 1
+    after = None
+    if next_page is not None and not legacy_paging:
+        cursor = decode_page_cursor(next_page)
+        # searches continue after (name, address, score) and queries near a
+        # location after (name, address, distance), see build_restaurant_query
+        key_length = 3 if filter_spec.near or filter_spec.terms else 2
+        if (
+            not cursor
+            or cursor["fingerprint"] != fingerprint
+            or len(cursor["last_key"]) != key_length
+        ):
+            return bad_request("nextPage is not valid for this query")
+        after = cursor["last_key"]
+    return RecommendationRequest(
+        filter_spec, fingerprint, page_number, after, legacy_paging, counts
+    )
+
 
-    next_page = int(query_params.get("nextPage", "1"))
-    output = []
-
-    restaurant: Restaurant
-    for restaurant in paginated_query_restaurants(
-        SESSION, query_params.get("query"), request_time, next_page, QUERY_PAGE_SIZE
-    ):
-        output.append(
-            dict(
-                name=restaurant.name,
-                style=restaurant.style,
-                address=restaurant.address,
-                openHour=str(restaurant.open_hour),
-                clouseHour=str(restaurant.close_hour),
-                vegetarian=restaurant.vegetarian,
-                delivers=restaurant.delivers,
+def get_next_page(request: RecommendationRequest, page: RecommendationPage):
+    if len(page.fragments) < QUERY_PAGE_SIZE:
+        return None
+    if request.legacy_paging:
+        return request.page_number + 1
+    return encode_page_cursor(page.last_key, request.fingerprint)
+
+
+def get_recommendation_pages(requests: list[RecommendationRequest]) -> list[RecommendationPage]:
+    """
+    The page of every request, in order; identical requests are read once,
+    and from the database the rest with a single statement.
+    """
+    keys = [(request.filter_spec, request.page_number, request.after) for request in requests]
+    distinct = list(dict.fromkeys(keys))
+    if RECOMMENDATION_SOURCE in ("snapshot", "catalogue"):
+        with metrics.span("snapshot_refresh"):
+            snapshot = get_snapshot_store().get(get_session())
+        with metrics.span("snapshot_page"):
+            pages = [snapshot.page(*key[:2], QUERY_PAGE_SIZE, key[2]) for key in distinct]
+    elif len(distinct) == 1:
+        (filter_spec, page_number, after), = distinct
+        pages = [
+            paginated_query_restaurants(
+                get_session(), filter_spec, page_number, QUERY_PAGE_SIZE, after
             )
+        ]
+    else:
+        pages = paginated_query_restaurants_batch(get_session(), distinct, QUERY_PAGE_SIZE)
+    LOGGER.info(
+        f"Get recommendation completed successfully, cache: {RECOMMENDATION_CACHE.stats()}, "
+        f"query shapes: {json.dumps(QUERY_SHAPES.stats())}"
+    )
+    by_key = dict(zip(distinct, pages))
+    return [by_key[key] for key in keys]
+
+
+def get_recommendation_counts(request: RecommendationRequest) -> dict | None:
+    if request.counts is None:
+        return None
+    if RECOMMENDATION_SOURCE in ("snapshot", "catalogue"):
+        # exact and cheap in memory, whatever the mode
+        counts = get_snapshot_store().get(get_session()).counts(request.filter_spec)
+    else:
+        counts = get_result_counts(get_session(), request.filter_spec, request.counts)
+    return counts.to_dict()
+
+
+def handleRecommendation(event, context):
+    query_params = event.get("queryStringParameters") or {}
+    request = parse_recommendation_request(query_params)
+    if isinstance(request, dict):
+        return request
+    (page,) = get_recommendation_pages([request])
+    counts = get_recommendation_counts(request)
+    metrics.count("rows_returned", len(page.fragments))
+    with metrics.span("render"):
+        body = render_recommendation_body(
+            page.fragments, get_next_page(request, page), counts
         )
-    LOGGER.info("Get recommendation completed successfully")
-    next_page = next_page + 1 if len(output) == QUERY_PAGE_SIZE else None
     return {
         "statusCode": 200,
-        "body": json.dumps({"restaurantRecommendation": output, "nextPage": next_page}),
+        "body": body,
+    }
+
+
+def handleRecommendationBatch(event, context):
+    try:
+        queries = json.loads(event.get("body") or "{}").get("queries")
+    except (ValueError, AttributeError):
+        return bad_request("Body must be a JSON object with a queries array")
+    if not isinstance(queries, list) or not queries:
+        return bad_request("queries must be a non-empty array")
+    if len(queries) > MAX_BATCH_QUERIES:
+        return bad_request(f"At most {MAX_BATCH_QUERIES} queries per batch")
+
+    # each answered like GET /recommend with the query's members as parameters
+    results = []
+    for query in queries:
+        if not isinstance(query, dict):
+            results.append(bad_request("Each query must be an object"))
+            continue
+        # as they would read in a query string, e.g. "counts": true
+        query_params = {
+            key: str(value).lower() if isinstance(value, bool) else str(value)
+            for key, value in query.items()
+            if value is not None
+        }
+        results.append(parse_recommendation_request(query_params))
+    requests = [result for result in results if not isinstance(result, dict)]
+    pages = iter(get_recommendation_pages(requests) if requests else [])
+    counts = iter([get_recommendation_counts(request) for request in requests])
+    bodies = []
+    with metrics.span("render"):
+        for result in results:
+            if isinstance(result, dict):
+                bodies.append((result["statusCode"], result["body"]))
+                continue
+            page = next(pages)
+            metrics.count("rows_returned", len(page.fragments))
+            body = render_recommendation_body(
+                page.fragments, get_next_page(result, page), next(counts)
+            )
+            bodies.append((200, body))
+        body = render_batch_body(bodies)
+    return {
+        "statusCode": 200,
+        "body": body,
     }
 
 
@@ -148,24 +369,28 @@ def handleCreateRestaurant(event, context):
             "body": json.dumps({"message": "Not Authorized"}),
         }
 
-    body = json.loads(event.get("body", "{}"))
-    restaurants = []
-    for record in body.get("records", []):
-        if not is_valid_create_restaurant(record):
-            return {
-                "statusCode": 400,
-                "body": json.dumps(
-                    {"message": "Object is not valid", "object": record}
-                ),
-            }
-        restaurants.append(record_to_create_restuarant(record))
-    batch_create_restaurants(SESSION, restaurants)
-    LOGGER.info("Batch create completed successfully")
+    # records are validated and written batch by batch as they are parsed
+    records = iter_array_items(event.get("body") or "{}", "records")
+    result = upsert_record_stream(get_session(), records)
+    LOGGER.info(
+        f"Batch create completed: created {result.created}, updated {result.updated}, "
+        f"rejected {result.rejected}"
+    )
+    written = result.created + result.updated
+    body = {
+        "message": f"Successfully created {result.created} and updated {result.updated} records",
+        "created": result.created,
+        "updated": result.updated,
+        "rejected": result.rejected,
+        "errors": [error._asdict() for error in result.errors],
+    }
+    if result.source_error:
+        body["message"] = f"Body is not valid JSON: {result.source_error}; {body['message']}"
+    # nothing written because of the payload: the request as a whole is invalid
+    status_code = 400 if written == 0 and (result.errors or result.source_error) else 201
     return {
-        "statusCode": 201,
-        "body": json.dumps(
-            {"message": f"Successfully created {len(restaurants)} records"}
-        ),
+        "statusCode": status_code,
+        "body": json.dumps(body),
     }
 
 
@@ -183,7 +408,7 @@ def handleDeleteRestaurant(event, context):
             "statusCode": 400,
             "body": json.dumps({"message": "Object is not valid", "object": record}),
         }
-    delete_restaurant(SESSION, record_to_delete_restuarant(record))
+    delete_restaurant(get_session(), record_to_delete_restuarant(record))
     LOGGER.info(f"Delete restaurant completed successfully {record.get("name")}")
     return {
         "statusCode": 200,
@@ -208,7 +433,7 @@ def handleUpdateRestaurant(event, context):
             "body": json.dumps({"message": "Object is not valid", "object": record}),
         }
 
-    update_restaurant(SESSION, record)
+    update_restaurant(get_session(), record)
     LOGGER.info(f"Update restaurant completed successfully {record.get("name")}")
     return {
         "statusCode": 200,
@@ -0,0 +1,191 @@
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import base64
+import os
+import queue
+import threading
+import time
+from query import metrics
+from query.common import LOGGER
+
+ENVELOPE_VERSION = "v2"
+NONCE_SIZE = 12
+
+
+class EnvelopeEncryptor:
+    def __init__(self, kms_client, key_id: str) -> None:
+        """
+        Encrypts a batch of values with a single KMS data key; each value is
+        sealed locally with AES-GCM and carries the encrypted data key.
+
+        Args:
+            kms_client: boto3 KMS client (or any object with generate_data_key).
+            key_id (str): The KMS Key ID or ARN used to wrap the data key.
+        """
+        self.kms_client = kms_client
+        self.key_id = key_id
+
+    def encrypt_batch(self, plaintexts: list[str]) -> list[str]:
+        data_key = self.kms_client.generate_data_key(
+            KeyId=self.key_id, KeySpec="AES_256"
+        )
+        cipher = AESGCM(data_key["Plaintext"])
+        encrypted_key = base64.b64encode(data_key["CiphertextBlob"]).decode("utf-8")
+        output = []
+        for plaintext in plaintexts:
+            nonce = os.urandom(NONCE_SIZE)
+            sealed = nonce + cipher.encrypt(nonce, plaintext.encode("utf-8"), None)
+            output.append(
+                f"{ENVELOPE_VERSION}:{encrypted_key}:{base64.b64encode(sealed).decode("utf-8")}"
+            )
+        return output
+
+
+def decrypt_data(kms_client, encrypted_data: str) -> str:
+    """
+    Decrypts a value written by EnvelopeEncryptor, or a plain KMS ciphertext
+    written by query.common.encrypt_data.
+    """
+    if not encrypted_data.startswith(f"{ENVELOPE_VERSION}:"):
+        response = kms_client.decrypt(CiphertextBlob=base64.b64decode(encrypted_data))
+        return response["Plaintext"].decode("utf-8")
+
+    _, encrypted_key, sealed = encrypted_data.split(":")
+    data_key = kms_client.decrypt(CiphertextBlob=base64.b64decode(encrypted_key))
+    sealed = base64.b64decode(sealed)
+    plaintext = AESGCM(data_key["Plaintext"]).decrypt(
+        sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], None
+    )
+    return plaintext.decode("utf-8")
+
+
+class RequestHistorySink:
+    def __init__(
+        self,
+        encryptor: EnvelopeEncryptor,
+        writer,
+        batch_size: int,
+        flush_interval: float,
+        max_buffered: int = 1000,
+        start_worker: bool = True,
+    ) -> None:
+        """
+        Buffers request history records and writes them in bulk: off the
+        response path when the background worker is running, else
+        synchronously in flush. A batch that fails to be written is put back
+        in the buffer, and records that don't fit in it are dropped and
+        logged, so an outage can't grow the process without bound.
+
+        Args:
+            encryptor (EnvelopeEncryptor): Encrypts request/response payloads.
+            writer: Callable receiving a list of RequestHistory row dicts.
+            batch_size (int): Maximum number of records per write.
+            flush_interval (float): Seconds a record may wait for a full
+                batch, and the worker's pause after a failed write.
+            max_buffered (int): Most records kept waiting to be written.
+            start_worker (bool): Only for long-running processes. Without a
+                worker records are buffered until flush, which a Lambda must
+                call before returning: its threads are frozen in between
+                invocations and lost with the container.
+        """
+        self.encryptor = encryptor
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_buffered)
+        self.write_lock = threading.Lock()
+        self.worker = None
+        if start_worker:
+            self.worker = threading.Thread(target=self._run, daemon=True)
+            self.worker.start()
+
+    def record(self, request: str, response: str, request_type, request_time) -> None:
+        self._buffer(
+            [
+                dict(
+                    request=request,
+                    response=response,
+                    request_type=request_type,
+                    request_time=request_time,
+                )
+            ]
+        )
+
+    def _buffer(self, records: list[dict]) -> None:
+        dropped = 0
+        for record in records:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                dropped += 1
+        if dropped:
+            metrics.count("dropped", dropped)
+            LOGGER.error(
+                f"Request history buffer full ({self.queue.maxsize} records), dropped {dropped}"
+            )
+
+    def flush(self) -> int:
+        """
+        Synchronously writes every buffered record, returns how many were
+        written. Raises the error of a failed batch, which stays buffered.
+        """
+        written = 0
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                return written
+            written += self._write(batch)
+
+    def _drain(self, limit: int) -> list[dict]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                LOGGER.error(f"Failed to write {len(batch)} request history records, retrying: {e}")
+                time.sleep(self.flush_interval)
+
+    def _write(self, batch: list[dict]) -> int:
+        # metered apart from the request; a Lambda still waits for it, see
+        # lambda_handler
+        with self.write_lock, metrics.invocation("api", "RequestHistory"):
+            metrics.count("records", len(batch))
+            try:
+                with metrics.span("encrypt"):
+                    encrypted = self.encryptor.encrypt_batch(
+                        [record["request"] for record in batch]
+                        + [record["response"] for record in batch]
+                    )
+                # the buffered records stay plaintext, so a retry encrypts them once
+                rows = [
+                    dict(
+                        record,
+                        request=encrypted[index],
+                        response=encrypted[len(batch) + index],
+                    )
+                    for index, record in enumerate(batch)
+                ]
+                with metrics.span("write"):
+                    self.writer(rows)
+                return len(batch)
+            except Exception:
+                # raised through the invocation, which counts it as errors
+                self._buffer(batch)
+                raise
@@ -1,179 +1,674 @@
+from typing import NamedTuple
+from sqlalchemy import (
+    Integer,
+    String,
+    tuple_,
+    insert,
+    update,
+    delete,
+    values,
+    column,
+    cast,
+    func,
+    literal,
+    literal_column,
+    null,
+    and_,
+    false,
+    or_,
+    select,
+    union_all,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, Query
-from sqlalchemy.sql import ColumnExpressionArgument
 import itertools
 import os
 import pendulum
-import re
 import pendulum
 from query.common import (
     TimeContext,
     Restaurant,
     RequestHistory,
-    Style,
-    extract_time_and_context,
-    get_database_time,
+    EtlJobState,
+    EtlJobStatus,
+    CatalogueVersion,
+    RestaurantTombstone,
+    KEY_WORD_TO_COLUMN_MAP,
+    MINUTES_PER_DAY,
+    local_day_ranges,
+    opening_hours_range,
+    to_utc_minute,
 )
-from sqlalchemy.sql import ColumnExpressionArgument
-
-KEY_WORD_TO_COLUMN_MAP = dict(
-    style=Restaurant.style,
-    deliver=Restaurant.delivers,
-    vegetarian=Restaurant.vegetarian,
-    open_hour=Restaurant.open_hour,
-    close_hour=Restaurant.close_hour,
+from query.utils import (
+    is_valid_create_restaurant,
+    record_to_restaurant_row,
+    record_to_update_row,
 )
+from query import metrics
+from query.cache import ResultCache
+from query.shapes import ShapeRecorder, get_query_shape
+from query.serialize import RECOMMENDATION_COLUMNS, render_restaurant, with_distance
+from query.geo import distance_meters, near_condition
+from query.parser import FilterSpec, BOOLEAN_KEY_WORDS
+from query.search import search_score
 
+UPDATABLE_COLUMNS = [
+    "style",
+    "open_hour",
+    "close_hour",
+    "open_minute",
+    "close_minute",
+    "vegetarian",
+    "delivers",
+    "latitude",
+    "longitude",
+]
 MAX_CREATE_BATCH_SIZE = int(os.getenv("MAX_CREATE_BATCH_SIZE", "50"))
+# per-record errors reported back, so a bad payload gets a bounded response
+MAX_RECORD_ERRORS = int(os.getenv("MAX_RECORD_ERRORS", "100"))
+# a running job is checkpointed every batch; shorter than Lambda's first
+# retry delay of a minute, so a failed invocation's retry resumes it
+ETL_JOB_LEASE_SECONDS = float(os.getenv("ETL_JOB_LEASE_SECONDS", "50"))
+RECOMMENDATION_CACHE = ResultCache(
+    max_size=int(os.getenv("RECOMMENDATION_CACHE_MAX_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", "60")),
+)
+QUERY_SHAPES = ShapeRecorder()
 
 
-def filter_negation_is_present(key_word: str, sentence: str):
-    negation_prefixes = ["non-", "not "]
-    for prefix in negation_prefixes:
-        word_to_search = f"{prefix}{key_word}"
-        if re.search(rf"\b{word_to_search}\b", sentence, re.IGNORECASE):
-            return True
-    return False
-
-
-def filter_is_present(key_word: str, sentence: str):
-    if re.search(rf"\b{key_word}\b", sentence, re.IGNORECASE):
-        return True
-    return False
-
-
-def get_boolean_filter(key_word: str, sentence: str) -> ColumnExpressionArgument:
-    # check negation first
-    if filter_negation_is_present(key_word, sentence):
-        return False
-    elif filter_is_present(key_word, sentence):
-        return True
-    return None
-
+def add_time_filter(query: Query, filter_spec: FilterSpec) -> Query:
+    """
+    Compares UTC minutes of the day: "by" (and "open now") is a containment
+    test on the GiST indexed opening_hours range, checked on both days of
+    its axis so overnight hours match after midnight; the other contexts
+    compare the btree indexed opening minute, "after" and "before" within
+    the request's local day.
+    """
+    if not filter_spec.time_context:
+        return query
 
-def get_style_filter(sentence: str) -> ColumnExpressionArgument:
-    filters = []
-    filter_negations = []
-    for style in Style._member_names_:
-        # check negation first
-        if filter_negation_is_present(style, sentence):
-            filter_negations.append(style)
-        elif filter_is_present(style, sentence):
-            filters.append(style)
-    return (False, filters) if len(filters) > 0 else (True, filter_negations)
+    minute = to_utc_minute(filter_spec.time, filter_spec.timezone)
+    if filter_spec.time_context == TimeContext.at:
+        return query.filter(Restaurant.open_minute == minute)
+    if filter_spec.time_context == TimeContext.by:
+        opening_hours = opening_hours_range(
+            Restaurant.open_minute, Restaurant.close_minute
+        )
+        return query.filter(
+            or_(
+                opening_hours.op("@>")(minute),
+                opening_hours.op("@>")(minute + MINUTES_PER_DAY),
+            )
+        )
+    ranges = local_day_ranges(filter_spec.time_context, minute, filter_spec.timezone)
+    return query.filter(
+        or_(
+            false(),
+            *(
+                and_(Restaurant.open_minute >= start, Restaurant.open_minute < end)
+                for start, end in ranges
+            ),
+        )
+    )
 
 
-def add_style_filter(query: Query, filters_tuple: tuple[bool, list[str]]) -> Query:
-    filters = filters_tuple[1]
-    is_negation = filters_tuple[0]
-    if len(filters) > 1:
-        return query.filter(
-            Restaurant.style.in_(filters)
-            if not is_negation
-            else Restaurant.style.not_in(filters)
+def add_recommendation_filters(query: Query, filter_spec: FilterSpec) -> Query:
+    """
+    The conditions a restaurant must meet to be recommended for filter_spec,
+    whatever is selected and however it is ordered.
+    """
+    styles = list(filter_spec.styles)
+    if len(styles) > 1:
+        query = query.filter(
+            Restaurant.style.not_in(styles)
+            if filter_spec.style_negation
+            else Restaurant.style.in_(styles)
         )
-    elif len(filters) == 1:
-        return query.filter(
-            Restaurant.style == filters[0]
-            if not is_negation
-            else Restaurant.style != filters[0]
+    elif styles:
+        query = query.filter(
+            Restaurant.style != styles[0]
+            if filter_spec.style_negation
+            else Restaurant.style == styles[0]
         )
+
+    for boolean_key_word in BOOLEAN_KEY_WORDS:
+        filter = getattr(filter_spec, boolean_key_word)
+        if filter is not None:
+            query = query.filter(KEY_WORD_TO_COLUMN_MAP[boolean_key_word].is_(filter))
+
+    query = add_time_filter(query, filter_spec)
+    # search terms only rank the rows, see search_score
+    if filter_spec.near:
+        query = query.filter(near_condition(filter_spec.near))
     return query
 
 
-def add_time_filter(
-    query: Query, sentence: str, request_time: pendulum.DateTime
+def build_restaurant_query(
+    session: Session,
+    filter_spec: FilterSpec,
+    page_number: int,
+    page_size,
+    after: tuple = None,
+    numbered: bool = False,
 ) -> Query:
-    time_context = extract_time_and_context(sentence, request_time)
-    if not time_context:
-        return query
-
-    hour = f"{time_context["time"]} {time_context["timezone"]}"
-    if time_context["context"] == TimeContext.at:
-        return query.filter(Restaurant.open_hour == hour)
-    if time_context["context"] == TimeContext.by:
-        return query.filter(Restaurant.open_hour <= hour).filter(
-            Restaurant.close_hour > hour
+    """
+    Selects only RECOMMENDATION_COLUMNS, as plain rows rather than instances.
+    Near a location the rows also carry their distance in meters and come
+    nearest first; otherwise, with search terms, they carry their search
+    score and are ranked by it. Either comes before the (name, address) key.
+    When numbered, each row ends with its position in that order, which
+    keeps the page's order when it is combined with others.
+    """
+    columns = list(RECOMMENDATION_COLUMNS)
+    # ordered by the label, the keyset condition repeats the expression
+    if filter_spec.near:
+        rank = distance_meters(filter_spec.near)
+        columns.append(rank.label("distance"))
+    elif filter_spec.terms:
+        rank = search_score(filter_spec.terms)
+        columns.append(rank.label("score"))
+    query = add_recommendation_filters(session.query(*columns), filter_spec)
+    if numbered:
+        # the expressions, a window can't order by the select's labels
+        if filter_spec.near or filter_spec.terms:
+            ordering = [rank if filter_spec.near else rank.desc()]
+        else:
+            ordering = []
+        ordering += [Restaurant.name, Restaurant.address]
+        query = query.add_columns(func.row_number().over(order_by=ordering).label("position"))
+    if filter_spec.near or filter_spec.terms:
+        # nearest first, or highest score first
+        query = query.order_by(
+            columns[-1] if filter_spec.near else columns[-1].desc(),
+            Restaurant.name,
+            Restaurant.address,
         )
-    if time_context["context"] == TimeContext.after:
-        return query.filter(Restaurant.open_hour > hour)
-    if time_context["context"] == TimeContext.before:
-        return query.filter(Restaurant.open_hour < hour)
+        if after is not None:
+            name, address, last_rank = after
+            if not filter_spec.near:
+                rank, last_rank = -rank, -last_rank
+            query = query.filter(
+                tuple_(rank, Restaurant.name, Restaurant.address)
+                > (last_rank, name, address)
+            )
+    else:
+        query = query.order_by(Restaurant.name, Restaurant.address)
+        if after is not None:
+            query = query.filter(tuple_(Restaurant.name, Restaurant.address) > after)
+    if after is None:
+        query = query.offset((page_number - 1) * page_size)
+    return query.limit(page_size)
+
+
+class RecommendationPage(NamedTuple):
+    fragments: tuple[str, ...]
+    # (name, address) of the last row, followed by its distance near a
+    # location or its score for searches
+    last_key: tuple | None
 
 
 def paginated_query_restaurants(
     session: Session,
-    sentence: str,
-    request_time: pendulum.DateTime,
+    filter_spec: FilterSpec,
     page_number: int,
     page_size,
-):
-    query = session.query(Restaurant).filter()
-    query = add_style_filter(query, get_style_filter(sentence))
+    after: tuple = None,
+) -> RecommendationPage:
+    """
+    Results are ordered by the (name, address) primary key. When `after` holds
+    the key of the last row of the previous page the page is read with a single
+    index range scan; otherwise `page_number` is honoured with OFFSET paging.
+    Searches are ranked by score first and queries near a location by
+    distance, whose fragments then carry it; see build_restaurant_query.
+
+    Returns the rows as rendered JSON fragments plus the key of the last row.
+    Pages are cached in RECOMMENDATION_CACHE; the time in a filter spec is
+    already at minute resolution so "open now" queries share entries within
+    a minute. The shape of every query that reaches the database is counted
+    in QUERY_SHAPES.
+    """
+    cache_key = (filter_spec, page_number if after is None else after, page_size)
+    page = RECOMMENDATION_CACHE.get(cache_key)
+    if page is not None:
+        metrics.count("cache_hits")
+        return page
+
+    QUERY_SHAPES.record(get_query_shape(filter_spec, after is not None))
+    with metrics.span("database_query"):
+        rows = build_restaurant_query(
+            session, filter_spec, page_number, page_size, after
+        ).all()
+    metrics.count("rows_read", len(rows))
+    page = recommendation_page(filter_spec, rows)
+    RECOMMENDATION_CACHE.put(cache_key, page)
+    return page
+
+
+def recommendation_page(filter_spec: FilterSpec, rows: list[tuple]) -> RecommendationPage:
+    """
+    Renders rows of RECOMMENDATION_COLUMNS, each followed by its distance
+    near a location or its score for searches.
+    """
+    last_key = None
+    if rows:
+        # (name, address) of the last row, and its rank
+        last_key = (rows[-1][0], rows[-1][2])
+        if filter_spec.near or filter_spec.terms:
+            last_key += (rows[-1][7],)
+    if filter_spec.near:
+        fragments = tuple(
+            with_distance(render_restaurant(tuple(row)[:7]), row[7]) for row in rows
+        )
+    else:
+        fragments = tuple(render_restaurant(tuple(row)[:7]) for row in rows)
+    return RecommendationPage(fragments=fragments, last_key=last_key)
+
+
+def build_batch_query(session: Session, requests: list[tuple], page_size):
+    """
+    One statement reading the page of every (filter_spec, page_number,
+    after) request: a UNION ALL of their queries, each keeping its own
+    filters, order and LIMIT, so every member is still served by the index
+    of its shape. Rows come as (batch_index, RECOMMENDATION_COLUMNS...,
+    rank, position), ordered by request and then by position in its page;
+    rank is the distance or score, else NULL.
+    """
+    members = []
+    for index, (filter_spec, page_number, after) in enumerate(requests):
+        page = build_restaurant_query(
+            session, filter_spec, page_number, page_size, after, numbered=True
+        ).subquery()
+        # members of a UNION ALL need the same columns; distances and scores
+        # are both integers
+        if filter_spec.near:
+            rank = page.c.distance
+        elif filter_spec.terms:
+            rank = page.c.score
+        else:
+            rank = cast(null(), Integer)
+        members.append(
+            select(
+                literal(index, Integer).label("batch_index"),
+                *[page.c[attribute.key] for attribute in RECOMMENDATION_COLUMNS],
+                rank.label("rank"),
+                page.c.position,
+            )
+        )
+    batch = union_all(*members).subquery()
+    return select(batch).order_by(batch.c.batch_index, batch.c.position)
+
+
+def paginated_query_restaurants_batch(
+    session: Session, requests: list[tuple], page_size
+) -> list[RecommendationPage]:
+    """
+    paginated_query_restaurants for several distinct (filter_spec,
+    page_number, after) requests, in their order: cached pages are served
+    from RECOMMENDATION_CACHE and the rest are read with a single statement,
+    see build_batch_query.
+    """
+    pages = {}
+    missing = []
+    for filter_spec, page_number, after in requests:
+        cache_key = (filter_spec, page_number if after is None else after, page_size)
+        page = RECOMMENDATION_CACHE.get(cache_key)
+        if page is None:
+            missing.append((filter_spec, page_number, after))
+        else:
+            metrics.count("cache_hits")
+            pages[cache_key] = page
+    if missing:
+        for filter_spec, _, after in missing:
+            QUERY_SHAPES.record(get_query_shape(filter_spec, after is not None))
+        with metrics.span("database_query"):
+            rows = session.execute(build_batch_query(session, missing, page_size)).all()
+        metrics.count("rows_read", len(rows))
+        by_index = {
+            index: [row[1:-1] for row in group]
+            for index, group in itertools.groupby(rows, key=lambda row: row.batch_index)
+        }
+        for index, (filter_spec, page_number, after) in enumerate(missing):
+            page_rows = by_index.get(index, [])
+            if not (filter_spec.near or filter_spec.terms):
+                page_rows = [row[:7] for row in page_rows]
+            cache_key = (filter_spec, page_number if after is None else after, page_size)
+            pages[cache_key] = recommendation_page(filter_spec, page_rows)
+            RECOMMENDATION_CACHE.put(cache_key, pages[cache_key])
+    return [
+        pages[(filter_spec, page_number if after is None else after, page_size)]
+        for filter_spec, page_number, after in requests
+    ]
 
-    for boolean_key_word in ["vegetarian", "deliver"]:
-        filter = get_boolean_filter(boolean_key_word, sentence)
-        if filter is not None:
-            query = query.filter(KEY_WORD_TO_COLUMN_MAP[boolean_key_word].is_(filter))
 
-    query = add_time_filter(query, sentence, request_time)
-    return query.offset((page_number - 1) * page_size).limit(page_size).all()
+def bump_catalogue_version(session: Session) -> int:
+    """
+    Increments the catalogue version inside the caller's transaction and
+    returns it. Writes stamp the rows they touch with it, so snapshots can
+    load only what changed; the row lock orders concurrent writers.
+    """
+    statement = postgresql.insert(CatalogueVersion).values(id=1, version=1)
+    statement = statement.on_conflict_do_update(
+        index_elements=[CatalogueVersion.id],
+        set_={"version": CatalogueVersion.version + 1},
+    ).returning(CatalogueVersion.version)
+    return session.execute(statement).scalar_one()
 
 
-def batch_create_restaurants(
+class UpsertResult(NamedTuple):
+    created: int
+    updated: int
+    rejected: int
+
+
+@metrics.timed("upsert")
+def bulk_upsert_restaurants(
     session: Session,
-    restaurants: list[Restaurant],
+    rows: list[dict],
     create_batch_size=MAX_CREATE_BATCH_SIZE,
-):
-    for batch in list(itertools.batched(restaurants, create_batch_size)):
-        session.add_all(batch)
+    commit: bool = True,
+) -> UpsertResult:
+    """
+    Writes restaurant rows with one INSERT ... ON CONFLICT (name, address)
+    DO UPDATE per batch, bypassing the ORM unit of work. A row repeating the
+    key of a later row in the same call is superseded and counted as
+    rejected, since Postgres can't update the same row twice in a statement.
+    With commit=False the caller owns the transaction.
+    """
+    deduplicated = {}
+    for row in rows:
+        deduplicated[(row["name"], row["address"])] = row
+    created = 0
+    updated = 0
+    for batch in itertools.batched(deduplicated.values(), create_batch_size):
+        version = bump_catalogue_version(session)
+        batch = [dict(row, change_version=version) for row in batch]
+        statement = postgresql.insert(Restaurant).values(batch)
+        statement = statement.on_conflict_do_update(
+            index_elements=[Restaurant.name, Restaurant.address],
+            set_={
+                column: statement.excluded[column]
+                for column in batch[0]
+                if column not in ("name", "address")
+            },
+        ).returning(literal_column("xmax = 0"))
+        inserted = session.execute(statement).scalars().all()
+        if commit:
+            session.commit()
+        created += sum(inserted)
+        updated += len(inserted) - sum(inserted)
+    RECOMMENDATION_CACHE.invalidate()
+    metrics.count("rows_written", created + updated)
+    return UpsertResult(created, updated, len(rows) - len(deduplicated))
+
+
+class RecordError(NamedTuple):
+    index: int
+    message: str
+    record: object
+
+
+class StreamUpsertResult(NamedTuple):
+    created: int
+    updated: int
+    rejected: int
+    # the first MAX_RECORD_ERRORS invalid records
+    errors: list[RecordError]
+    # why the records stopped early, e.g. malformed JSON
+    source_error: str | None
+
+
+def upsert_record_stream(
+    session: Session, records, batch_size: int = MAX_CREATE_BATCH_SIZE
+) -> StreamUpsertResult:
+    """
+    Validates create records as they are read and writes every batch_size
+    valid ones with bulk_upsert_restaurants, so writing starts with the
+    first batch and only one batch is held. Invalid records are counted
+    as rejected and reported instead of failing the others. A ValueError
+    raised by the records iterator ends the stream; the batches before it
+    stay written and the error is returned as source_error.
+    """
+    created = updated = rejected = 0
+    errors = []
+    batch = []
+    source_error = None
+
+    def write() -> None:
+        nonlocal created, updated, rejected
+        result = bulk_upsert_restaurants(session, batch)
+        created += result.created
+        updated += result.updated
+        rejected += result.rejected
+        batch.clear()
+
+    records = iter(records)
+    for index in itertools.count():
+        try:
+            record = next(records)
+        except StopIteration:
+            break
+        except ValueError as e:
+            source_error = str(e)
+            break
+        try:
+            if not isinstance(record, dict) or not is_valid_create_restaurant(record):
+                raise ValueError("Object is not valid")
+            batch.append(record_to_restaurant_row(record))
+        # whatever a malformed record breaks in the conversion is its own error
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            metrics.count("records_invalid")
+            rejected += 1
+            if len(errors) < MAX_RECORD_ERRORS:
+                errors.append(RecordError(index, str(e), record))
+            continue
+        if len(batch) == batch_size:
+            write()
+    if batch:
+        write()
+    return StreamUpsertResult(created, updated, rejected, errors, source_error)
+
+
+@metrics.timed("delete")
+def bulk_delete_restaurants(
+    session: Session,
+    keys: list[tuple[str, str]],
+    commit: bool = True,
+) -> set[tuple[str, str]]:
+    """
+    Deletes every (name, address) key with a single DELETE ... USING (VALUES ...)
+    and returns the keys that matched a restaurant. Deleted keys are kept as
+    tombstones so snapshots can drop them.
+    """
+    if not keys:
+        return set()
+    deleted_keys = values(
+        column("name", String), column("address", String), name="deleted_keys"
+    ).data(list(dict.fromkeys(keys)))
+    statement = (
+        delete(Restaurant)
+        .where(Restaurant.name == deleted_keys.c.name)
+        .where(Restaurant.address == deleted_keys.c.address)
+        .returning(Restaurant.name, Restaurant.address)
+        .execution_options(synchronize_session=False)
+    )
+    matched = {tuple(row) for row in session.execute(statement)}
+    if matched:
+        version = bump_catalogue_version(session)
+        tombstones = postgresql.insert(RestaurantTombstone).values(
+            [
+                dict(name=name, address=address, change_version=version)
+                for name, address in matched
+            ]
+        )
+        session.execute(
+            tombstones.on_conflict_do_update(
+                index_elements=[RestaurantTombstone.name, RestaurantTombstone.address],
+                set_={"change_version": tombstones.excluded.change_version},
+            )
+        )
+    if commit:
         session.commit()
+    RECOMMENDATION_CACHE.invalidate()
+    return matched
 
 
-def delete_restaurant(
+@metrics.timed("update")
+def bulk_update_restaurants(
     session: Session,
-    restaurant: Restaurant,
-):
-    db_restaurant = (
-        session.query(Restaurant)
-        .filter(Restaurant.name == restaurant.name)
-        .filter(Restaurant.address == restaurant.address)
-        .first()
+    rows: list[dict],
+    commit: bool = True,
+) -> set[tuple[str, str]]:
+    """
+    Applies partial updates with a single UPDATE ... FROM (VALUES ...). Each row
+    holds the name and address plus any of UPDATABLE_COLUMNS; columns a row
+    leaves out keep their current value. Returns the keys that matched.
+    """
+    if not rows:
+        return set()
+    deduplicated = {}
+    for row in rows:
+        deduplicated[(row["name"], row["address"])] = row
+    columns = Restaurant.__table__.columns
+    changes = values(
+        column("name", String),
+        column("address", String),
+        *[column(name, columns[name].type) for name in UPDATABLE_COLUMNS],
+        name="changes",
+    ).data(
+        [
+            (row["name"], row["address"], *[row.get(name) for name in UPDATABLE_COLUMNS])
+            for row in deduplicated.values()
+        ]
     )
-    if db_restaurant:
-        session.delete(db_restaurant)
+    existing = (
+        select(Restaurant.name)
+        .where(Restaurant.name == changes.c.name)
+        .where(Restaurant.address == changes.c.address)
+        .limit(1)
+    )
+    # like deletes, the version only moves when a row changes; checked before
+    # the bump so writers still lock the version row before any restaurant
+    if session.execute(existing).first() is None:
+        if commit:
+            session.commit()
+        return set()
+    version = bump_catalogue_version(session)
+    statement = (
+        update(Restaurant)
+        .where(Restaurant.name == changes.c.name)
+        .where(Restaurant.address == changes.c.address)
+        .values(
+            {
+                name: func.coalesce(cast(changes.c[name], columns[name].type), columns[name])
+                for name in UPDATABLE_COLUMNS
+            }
+            | {"change_version": version}
+        )
+        .returning(Restaurant.name, Restaurant.address)
+        .execution_options(synchronize_session=False)
+    )
+    matched = {tuple(row) for row in session.execute(statement)}
+    if commit:
         session.commit()
+    RECOMMENDATION_CACHE.invalidate()
+    return matched
+
+
+def delete_restaurant(
+    session: Session,
+    restaurant: Restaurant,
+) -> bool:
+    return bool(bulk_delete_restaurants(session, [(restaurant.name, restaurant.address)]))
 
 
 def update_restaurant(
     session: Session,
     record: dict,
-):
-    db_restaurant = (
-        session.query(Restaurant)
-        .filter(Restaurant.name == record.get("name"))
-        .filter(Restaurant.address == record.get("address"))
-        .first()
-    )
-    if db_restaurant:
-        if "style" in record:
-            db_restaurant.style = record["style"].lower()
-        if "openHour" in record and "timezone" in record:
-            db_restaurant.open_hour = get_database_time(
-                record["openHour"], record["timezone"]
-            )
-        if "closeHour" in record and "timezone" in record:
-            db_restaurant.close_hour = get_database_time(
-                record["closeHour"], record["timezone"]
-            )
-        if "vegetarian" in record:
-            db_restaurant.vegetarian = str(record["vegetarian"].lower()) == "true"
+) -> bool:
+    return bool(bulk_update_restaurants(session, [record_to_update_row(record)]))
+
 
-        if "delivers" in record:
-            db_restaurant.delivers = str(record["delivers"].lower()) == "true"
+def get_etl_job_state(session: Session, object_key: str) -> EtlJobState:
+    return session.get(EtlJobState, object_key)
 
+
+def start_etl_job(session: Session, object_key: str, etag: str) -> EtlJobState | None:
+    """
+    Returns the job state to resume from, or None when this ETag was already
+    fully processed or another invocation is processing it: S3 may deliver
+    an event more than once. The row is locked while it is claimed, and a
+    running job checkpointed within ETL_JOB_LEASE_SECONDS is left to its
+    invocation. A new ETag for the same key restarts from the beginning.
+    """
+    state = session.get(EtlJobState, object_key, with_for_update=True)
+    if state is not None and state.etag == etag:
+        if state.status == EtlJobStatus.completed:
+            session.rollback()
+            return None
+        idle = pendulum.now(tz="UTC") - pendulum.instance(state.updated_time)
+        if (
+            state.status == EtlJobStatus.running
+            and idle.total_seconds() < ETL_JOB_LEASE_SECONDS
+        ):
+            session.rollback()
+            return None
+    else:
+        if state is None:
+            state = EtlJobState(object_key=object_key)
+            session.add(state)
+        state.etag = etag
+        state.status = EtlJobStatus.running
+        state.byte_offset = 0
+        state.line_number = 0
+        state.rows_affected = 0
+        state.rows_rejected = 0
+    state.updated_time = pendulum.now(tz="UTC")
+    try:
         session.commit()
+    except IntegrityError:
+        # a concurrent invocation inserted the row first
+        session.rollback()
+        return None
+    return state
 
 
-def create_request_history(session: Session, request_history: RequestHistory):
-    session.add(request_history)
+def checkpoint_etl_job(
+    session: Session,
+    state: EtlJobState,
+    byte_offset: int,
+    lines: int,
+    rows_affected: int,
+    rows_rejected: int,
+    completed: bool = False,
+):
+    """
+    Records progress and commits it together with any writes pending in the
+    session, so a batch and its checkpoint are applied atomically.
+    """
+    state.byte_offset = byte_offset
+    state.line_number += lines
+    state.rows_affected += rows_affected
+    state.rows_rejected += rows_rejected
+    state.updated_time = pendulum.now(tz="UTC")
+    if completed:
+        state.status = EtlJobStatus.completed
     session.commit()
+
+
+def bulk_create_request_history(engine: Engine, rows: list[dict]):
+    """
+    Writes request history rows with a single multi-row INSERT on a
+    connection of its own, so it can run outside the request's session.
+    """
+    with engine.begin() as connection:
+        connection.execute(insert(RequestHistory), rows)
+
+
+async def bulk_create_request_history_async(engine, rows: list[dict]):
+    """
+    bulk_create_request_history on the ASGI server's AsyncEngine.
+    """
+    async with engine.begin() as connection:
+        await connection.execute(insert(RequestHistory), rows)
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class ResultCache:
+    def __init__(self, max_size: int, ttl_seconds: float, clock=time.monotonic) -> None:
+        """
+        Least-recently-used cache whose entries also expire after a fixed time.
+        Lives at module level so it survives across warm Lambda invocations.
+
+        Args:
+            max_size (int): Maximum number of entries, 0 disables the cache.
+            ttl_seconds (float): Seconds an entry stays valid after being stored.
+            clock: Monotonic time source, replaceable in tests.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Returns the cached value, or None on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(
+                size=len(self.entries),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                expirations=self.expirations,
+                invalidations=self.invalidations,
+            )
@@ -0,0 +1,303 @@
+from typing import NamedTuple
+import json
+import mmap
+import os
+import struct
+import zlib
+from query.clients import LOGGER
+
+# little endian: magic, format version, catalogue_version, row count,
+# string blob size, crc32 of everything after the header
+CATALOGUE_MAGIC = b"RCAT"
+# 2 added the location columns
+CATALOGUE_FORMAT_VERSION = 2
+CATALOGUE_HEADER = struct.Struct("<4sHxxQIIQ")
+CATALOGUE_ALIGNMENT = 8
+CATALOGUE_SUFFIX = ".rcat"
+LATEST_POINTER = "LATEST"
+VEGETARIAN_FLAG = 1
+DELIVERS_FLAG = 2
+
+
+class CatalogueHeader(NamedTuple):
+    catalogue_version: int
+    row_count: int
+    checksum: int
+    blob_size: int
+
+
+class CataloguePointer(NamedTuple):
+    version: int
+    key: str
+    checksum: int
+    size: int
+    # pointers written before the field existed name format 1 files
+    format_version: int = 1
+
+
+def catalogue_sections(row_count: int, blob_size: int) -> list[tuple]:
+    """
+    (name, typecode, offset, length) of every section, each aligned so a
+    memoryview cast to its typecode is valid.
+    """
+    sections = []
+    offset = CATALOGUE_HEADER.size
+    for name, typecode, length in [
+        ("style_codes", "B", row_count),
+        ("flags", "B", row_count),
+        ("open_minutes", "h", row_count),
+        ("close_minutes", "h", row_count),
+        ("latitudes", "d", row_count),
+        ("longitudes", "d", row_count),
+        ("name_offsets", "I", row_count + 1),
+        ("address_offsets", "I", row_count + 1),
+        ("fragment_offsets", "I", row_count + 1),
+        ("blob", "B", blob_size),
+    ]:
+        offset += -offset % CATALOGUE_ALIGNMENT
+        sections.append((name, typecode, offset, length))
+        offset += length * struct.calcsize(typecode)
+    return sections
+
+
+def encode_catalogue(snapshot) -> bytes:
+    """
+    Serializes a RestaurantSnapshot: fixed width columns followed by one
+    UTF-8 string table holding every name, address and JSON fragment, so
+    a reader can map the file and use it without parsing.
+    """
+    blob = bytearray()
+    offsets = {"name_offsets": [], "address_offsets": [], "fragment_offsets": []}
+    strings = {
+        "name_offsets": [key[0] for key in snapshot.keys],
+        "address_offsets": [key[1] for key in snapshot.keys],
+        "fragment_offsets": snapshot.fragments,
+    }
+    for name, values in strings.items():
+        for value in values:
+            offsets[name].append(len(blob))
+            blob += value.encode("utf-8")
+        offsets[name].append(len(blob))
+
+    row_count = len(snapshot)
+    columns = {
+        "style_codes": bytes(snapshot.style_codes),
+        "flags": bytes(
+            VEGETARIAN_FLAG * bool(vegetarian) | DELIVERS_FLAG * bool(delivers)
+            for vegetarian, delivers in zip(snapshot.vegetarian, snapshot.delivers)
+        ),
+        "open_minutes": struct.pack(f"<{row_count}h", *snapshot.open_minutes),
+        "close_minutes": struct.pack(f"<{row_count}h", *snapshot.close_minutes),
+        "latitudes": struct.pack(f"<{row_count}d", *snapshot.latitudes),
+        "longitudes": struct.pack(f"<{row_count}d", *snapshot.longitudes),
+        "blob": bytes(blob),
+    }
+    for name, values in offsets.items():
+        columns[name] = struct.pack(f"<{len(values)}I", *values)
+
+    body = bytearray()
+    for name, _, offset, _ in catalogue_sections(row_count, len(blob)):
+        body += bytes(offset - CATALOGUE_HEADER.size - len(body))
+        body += columns[name]
+    header = CATALOGUE_HEADER.pack(
+        CATALOGUE_MAGIC,
+        CATALOGUE_FORMAT_VERSION,
+        snapshot.version,
+        row_count,
+        len(blob),
+        zlib.crc32(body),
+    )
+    return header + bytes(body)
+
+
+def read_catalogue_header(data) -> CatalogueHeader:
+    if len(data) < CATALOGUE_HEADER.size:
+        raise ValueError("Catalogue is truncated")
+    magic, format_version, version, row_count, blob_size, checksum = (
+        CATALOGUE_HEADER.unpack_from(data)
+    )
+    if magic != CATALOGUE_MAGIC:
+        raise ValueError("Not a restaurant catalogue")
+    if format_version != CATALOGUE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported catalogue format {format_version}")
+    return CatalogueHeader(version, row_count, checksum, blob_size)
+
+
+class StringColumn:
+    def __init__(self, blob: memoryview, offsets: memoryview) -> None:
+        """
+        Sequence of the strings stored in blob between consecutive offsets,
+        decoded only when read.
+        """
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return str(self.blob[self.offsets[index] : self.offsets[index + 1]], "utf-8")
+
+
+class KeyColumn:
+    def __init__(self, names: StringColumn, addresses: StringColumn) -> None:
+        """
+        Sequence of (name, address) keys, enough for bisect without
+        decoding every key up front.
+        """
+        self.names = names
+        self.addresses = addresses
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index: int) -> tuple[str, str]:
+        return self.names[index], self.addresses[index]
+
+
+class CatalogueFile:
+    def __init__(self, path: str, checksum: int = None) -> None:
+        """
+        Read-only view of a catalogue file. The file is memory mapped and
+        every column is a memoryview over the mapping, so opening it copies
+        nothing and pages are loaded from /tmp as they are touched.
+
+        Args:
+            path (str): The catalogue file.
+            checksum (int): Expected crc32, e.g. from the LATEST pointer. The
+                checksum in the header is verified either way.
+        """
+        with open(path, "rb") as file:
+            # the mapping keeps its own handle to the file
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mapping)
+        self.header = read_catalogue_header(view)
+        if checksum is not None and checksum != self.header.checksum:
+            raise ValueError(f"Catalogue {path} is not the expected version")
+        sections = catalogue_sections(self.header.row_count, self.header.blob_size)
+        _, typecode, offset, length = sections[-1]
+        if len(view) != offset + length:
+            raise ValueError(f"Catalogue {path} is truncated")
+        if zlib.crc32(view[CATALOGUE_HEADER.size :]) != self.header.checksum:
+            raise ValueError(f"Catalogue {path} is corrupt")
+        self.columns = {
+            name: view[offset : offset + length * struct.calcsize(typecode)].cast(
+                typecode
+            )
+            for name, typecode, offset, length in sections
+        }
+
+    @property
+    def version(self) -> int:
+        return self.header.catalogue_version
+
+    def __len__(self) -> int:
+        return self.header.row_count
+
+    def strings(self, name: str) -> StringColumn:
+        return StringColumn(self.columns["blob"], self.columns[f"{name}_offsets"])
+
+
+def catalogue_key(prefix: str, version: int) -> str:
+    # zero padded so keys list in version order
+    return f"{prefix}{version:020d}{CATALOGUE_SUFFIX}"
+
+
+def s3_error_code(error: Exception) -> str:
+    # botocore ClientError without importing botocore
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code")
+
+
+def read_latest_pointer(s3_client, bucket_name: str, prefix: str, etag: str = None):
+    """
+    Returns (pointer, etag) of the LATEST pointer, (None, None) if nothing
+    was exported yet, or (None, etag) if it still has the given etag.
+    """
+    parameters = dict(Bucket=bucket_name, Key=f"{prefix}{LATEST_POINTER}")
+    if etag:
+        parameters["IfNoneMatch"] = etag
+    try:
+        response = s3_client.get_object(**parameters)
+    except Exception as e:
+        if s3_error_code(e) == "NoSuchKey":
+            return None, None
+        if s3_error_code(e) in ("304", "NotModified"):
+            return None, etag
+        raise
+    fields = json.loads(response["Body"].read())
+    # fields added by later versions are left for their readers
+    pointer = CataloguePointer(
+        **{name: value for name, value in fields.items() if name in CataloguePointer._fields}
+    )
+    return pointer, response["ETag"]
+
+
+class CatalogueDownloader:
+    def __init__(
+        self, s3_client, bucket_name: str, prefix: str, directory: str = "/tmp"
+    ) -> None:
+        """
+        Keeps the newest exported catalogue in directory. Each check is a
+        conditional GET of the small LATEST pointer; a catalogue file is
+        downloaded only when the pointer names a version not on disk yet.
+
+        Args:
+            s3_client: boto3 S3 client.
+            bucket_name (str): Bucket the ETL exports to.
+            prefix (str): Key prefix of the catalogue files and pointer.
+            directory (str): Local directory the files are kept in.
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.directory = directory
+        self.etag = None
+        self.catalogue = None
+
+    def path(self, version: int) -> str:
+        return os.path.join(self.directory, f"catalogue-{version:020d}{CATALOGUE_SUFFIX}")
+
+    def _open(self, pointer: CataloguePointer) -> CatalogueFile:
+        path = self.path(pointer.version)
+        if os.path.exists(path):
+            try:
+                return CatalogueFile(path, pointer.checksum)
+            except ValueError as e:
+                LOGGER.warning(f"Downloading catalogue again: {e}")
+        temporary_path = f"{path}.download"
+        self.s3_client.download_file(self.bucket_name, pointer.key, temporary_path)
+        os.replace(temporary_path, path)
+        LOGGER.info(f"Downloaded catalogue {pointer.version} ({pointer.size} bytes)")
+        return CatalogueFile(path, pointer.checksum)
+
+    def _remove_older(self, version: int) -> None:
+        for file_name in os.listdir(self.directory):
+            if (
+                file_name.startswith("catalogue-")
+                and file_name.endswith(CATALOGUE_SUFFIX)
+                and file_name != os.path.basename(self.path(version))
+            ):
+                os.remove(os.path.join(self.directory, file_name))
+
+    def refresh(self):
+        """
+        Returns the newest catalogue, None if nothing was exported yet.
+        """
+        pointer, etag = read_latest_pointer(
+            self.s3_client, self.bucket_name, self.prefix, self.etag
+        )
+        if pointer is not None and pointer.format_version != CATALOGUE_FORMAT_VERSION:
+            # exported before or after this reader was deployed; the ETL
+            # exports the current format again on its next run
+            LOGGER.warning(f"Ignoring catalogue in format {pointer.format_version}")
+        elif pointer is not None and (
+            self.catalogue is None or pointer.version != self.catalogue.version
+        ):
+            self.catalogue = self._open(pointer)
+            # mappings of older files stay valid after the unlink
+            self._remove_older(pointer.version)
+        self.etag = etag
+        return self.catalogue
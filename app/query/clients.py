@@ -1,27 +1,304 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 import logging
 import json
-import boto3
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
-from query.common import Base
+import threading
+import time
+from sqlalchemy import create_engine, event, Engine
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from query import metrics
 
-SECRETS_MANAGER_CLIENT = boto3.client("secretsmanager")
-get_database_secret_response = SECRETS_MANAGER_CLIENT.get_secret_value(
-    SecretId=os.getenv("DATABASE_CREDENTIAL_SECRET_ID")
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "2"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "2"))
+DATABASE_POOL_TIMEOUT_SECONDS = float(os.getenv("DATABASE_POOL_TIMEOUT_SECONDS", "10"))
+DATABASE_POOL_RECYCLE_SECONDS = int(os.getenv("DATABASE_POOL_RECYCLE_SECONDS", "300"))
+DATABASE_STATEMENT_TIMEOUT_MS = int(os.getenv("DATABASE_STATEMENT_TIMEOUT_MS", "10000"))
+# the session of the request being served by the ASGI server, see bind_session
+CURRENT_SESSION = ContextVar("current_session", default=None)
+
+
+class ResourceRegistry:
+    def __init__(self) -> None:
+        """
+        Creates clients, secrets and the database engine on first use instead
+        of at import, so a cold start only pays for what the request needs.
+        """
+        self.factories = {}
+        self.instances = {}
+        self.lock = threading.RLock()
+
+    def register(self, name: str, factory) -> None:
+        self.factories[name] = factory
+
+    def get(self, name: str):
+        instance = self.instances.get(name)
+        if instance is not None:
+            return instance
+        with self.lock:
+            if name not in self.instances:
+                LOGGER.info(f"Initializing {name}")
+                self.instances[name] = self.factories[name]()
+            return self.instances[name]
+
+    def override(self, name: str, instance) -> None:
+        """
+        Replaces a resource, e.g. with a stub in tests and benchmarks.
+        """
+        with self.lock:
+            self.instances[name] = instance
+
+    def initialized(self) -> list[str]:
+        return list(self.instances)
+
+
+def boto3_client(service_name: str):
+    import boto3
+
+    return boto3.client(service_name)
+
+
+def get_secret(secret_id: str) -> dict:
+    name = f"secret:{secret_id}"
+    if name not in RESOURCES.factories:
+        RESOURCES.register(
+            name,
+            lambda: json.loads(
+                get_secrets_manager_client().get_secret_value(SecretId=secret_id)[
+                    "SecretString"
+                ]
+            ),
+        )
+    return RESOURCES.get(name)
+
+
+class PoolMetrics:
+    def __init__(self) -> None:
+        """
+        Counts connection pool checkouts, the time spent waiting for them and
+        the connections (re)opened or invalidated, e.g. after a failed pre-ping.
+        """
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_seconds = 0.0
+        self.checkout_wait_max_seconds = 0.0
+        self.connects = 0
+        self.reconnects = 0
+        self.invalidations = 0
+
+    def attach(self, engine: Engine) -> None:
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def record_checkout(self, wait_seconds: float) -> None:
+        with self.lock:
+            self.checkouts += 1
+            self.checkout_wait_seconds += wait_seconds
+            self.checkout_wait_max_seconds = max(
+                self.checkout_wait_max_seconds, wait_seconds
+            )
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        # record_info outlives the DBAPI connection when a pool entry reconnects
+        reconnect = connection_record.record_info.get("connected", False)
+        connection_record.record_info["connected"] = True
+        with self.lock:
+            self.connects += 1
+            self.reconnects += reconnect
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        with self.lock:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(
+                checkouts=self.checkouts,
+                checkout_wait_ms=round(self.checkout_wait_seconds * 1000, 3),
+                checkout_wait_max_ms=round(self.checkout_wait_max_seconds * 1000, 3),
+                connects=self.connects,
+                reconnects=self.reconnects,
+                invalidations=self.invalidations,
+            )
+
+
+POOL_METRICS = PoolMetrics()
+
+
+class MeasuredCheckout:
+    """
+    Pool mixin that reports how long each checkout waited for a connection,
+    including the time to open a new one.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait_seconds = time.perf_counter() - start
+            POOL_METRICS.record_checkout(wait_seconds)
+            metrics.add_milliseconds("pool_checkout", wait_seconds * 1000)
+
+
+class MeasuredQueuePool(MeasuredCheckout, QueuePool):
+    pass
+
+
+class MeasuredAsyncQueuePool(MeasuredCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def create_pooled_engine(
+    connection_string: str, statement_timeout_ms: int = DATABASE_STATEMENT_TIMEOUT_MS
+) -> Engine:
+    """
+    Engine that outlives warm invocations: connections are pinged before
+    use, recycled before the server drops them, and Postgres cancels any
+    statement running longer than statement_timeout_ms.
+    """
+    connect_args = {}
+    if connection_string.startswith("postgresql"):
+        connect_args["options"] = f"-c statement_timeout={statement_timeout_ms}"
+    engine = create_engine(
+        connection_string,
+        echo=False,
+        poolclass=MeasuredQueuePool,
+        pool_pre_ping=True,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+        pool_timeout=DATABASE_POOL_TIMEOUT_SECONDS,
+        pool_recycle=DATABASE_POOL_RECYCLE_SECONDS,
+        connect_args=connect_args,
+    )
+    POOL_METRICS.attach(engine)
+    return engine
+
+
+def create_pooled_async_engine(
+    connection_string: str, statement_timeout_ms: int = DATABASE_STATEMENT_TIMEOUT_MS
+):
+    """
+    The AsyncEngine counterpart of create_pooled_engine, for the ASGI server:
+    same pool settings and metrics, with an asyncio-compatible queue.
+    """
+    # needs greenlet and an async driver, which the Lambdas never load
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    connect_args = {}
+    if connection_string.startswith("postgresql"):
+        connect_args["server_settings"] = {"statement_timeout": str(statement_timeout_ms)}
+    engine = create_async_engine(
+        connection_string,
+        echo=False,
+        poolclass=MeasuredAsyncQueuePool,
+        pool_pre_ping=True,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+        pool_timeout=DATABASE_POOL_TIMEOUT_SECONDS,
+        pool_recycle=DATABASE_POOL_RECYCLE_SECONDS,
+        connect_args=connect_args,
+    )
+    POOL_METRICS.attach(engine.sync_engine)
+    return engine
+
+
+def get_database_url(driver: str, ssl: str) -> str:
+    secret = get_secret(os.getenv("DATABASE_CREDENTIAL_SECRET_ID"))
+    database_endpoint = os.getenv("DATABASE_ENDPOINT")
+    database_name = os.getenv("DATABASE_NAME")
+    return f"postgresql+{driver}://{secret['username']}:{secret['password']}@{database_endpoint}/{database_name}?{ssl}"
+
+
+def create_database_engine() -> Engine:
+    return create_pooled_engine(get_database_url("psycopg2", "sslmode=require"))
+
+
+def create_async_database_engine():
+    return create_pooled_async_engine(get_database_url("asyncpg", "ssl=require"))
+
+
+RESOURCES = ResourceRegistry()
+RESOURCES.register("secretsmanager", lambda: boto3_client("secretsmanager"))
+RESOURCES.register("kms", lambda: boto3_client("kms"))
+RESOURCES.register("s3", lambda: boto3_client("s3"))
+RESOURCES.register("engine", create_database_engine)
+RESOURCES.register("async_engine", create_async_database_engine)
+# one session per thread, replaced at the end of every session_scope
+RESOURCES.register(
+    "session", lambda: scoped_session(sessionmaker(bind=get_engine()))
 )
-secret = json.loads(get_database_secret_response["SecretString"])
-database_endpoint = os.getenv("DATABASE_ENDPOINT")
-database_name = os.getenv("DATABASE_NAME")
-connection_string = f"postgresql+psycopg2://{secret['username']}:{secret['password']}@{database_endpoint}/{database_name}?sslmode=require"
-engine = create_engine(connection_string, echo=False)
-Base.metadata.create_all(engine)
 
-SESSION = Session(engine)
 
-KMS_CLIENT = boto3.client("kms")
+def get_secrets_manager_client():
+    return RESOURCES.get("secretsmanager")
 
-S3_CLIENT = boto3.client('s3')
 
-LOGGER = logging.getLogger()
-LOGGER.setLevel(logging.INFO)
+def get_kms_client():
+    return RESOURCES.get("kms")
+
+
+def get_s3_client():
+    return RESOURCES.get("s3")
+
+
+def get_engine():
+    return RESOURCES.get("engine")
+
+
+def get_async_engine():
+    return RESOURCES.get("async_engine")
+
+
+def get_session() -> Session:
+    """
+    Returns the session of the current invocation, see session_scope.
+    """
+    session = CURRENT_SESSION.get()
+    if session is not None:
+        return session
+    return RESOURCES.get("session")()
+
+
+@contextmanager
+def bind_session(session: Session):
+    """
+    Makes session the one get_session and session_scope return in this
+    thread or task, e.g. the sync side of the ASGI server's AsyncSession;
+    whoever binds it closes it.
+    """
+    token = CURRENT_SESSION.set(session)
+    try:
+        yield session
+    finally:
+        CURRENT_SESSION.reset(token)
+
+
+@contextmanager
+def session_scope():
+    """
+    Scopes a session to one invocation: an exception rolls back whatever the
+    session has pending and the session is closed on exit, returning its
+    connection to the pool so a failed request can't poison the next one.
+    """
+    bound = CURRENT_SESSION.get()
+    sessions = RESOURCES.get("session") if bound is None else None
+    session = sessions() if bound is None else bound
+    start = time.perf_counter()
+    try:
+        yield session
+    except Exception:
+        LOGGER.warning("Rolling back session after an error")
+        session.rollback()
+        raise
+    finally:
+        if sessions is not None:
+            sessions.remove()
+        LOGGER.info(
+            f"Session closed after {(time.perf_counter() - start) * 1000:.1f}ms, "
+            f"pool: {POOL_METRICS.stats()}"
+        )
@@ -3,17 +3,22 @@ from sqlalchemy import (
     String,
     Time,
     Boolean,
+    Float,
     BigInteger,
+    SmallInteger,
     Index,
     TIMESTAMP,
     Enum as SqlalchemyEnum,
+    case,
+    func,
+    literal_column,
 )
 from sqlalchemy.orm import declarative_base
 import base64
 
 from enum import Enum
+import functools
 import re
-from datetime import datetime
 import pendulum
 import logging
 
@@ -36,6 +41,12 @@ class RequestType(Enum):
     Update = 3
     Delete = 4
     NotImplemented = 5
+    RecommendBatch = 6
+
+
+class EtlJobStatus(Enum):
+    running = 1
+    completed = 2
 
 
 class Style(Enum):
@@ -44,6 +55,58 @@ class Style(Enum):
     korean = 3
 
 
+MINUTES_PER_DAY = 1440
+
+
+def opening_hours_range(open_minute, close_minute):
+    """
+    int4range of the UTC minutes a restaurant is open, on a two day axis: a
+    close at or before the open minute is on the next day, so overnight
+    hours stay one contiguous range. The index and the queries must render
+    this expression identically, hence the literal instead of a parameter.
+    """
+    return func.int4range(
+        open_minute,
+        case(
+            (
+                close_minute <= open_minute,
+                close_minute + literal_column(str(MINUTES_PER_DAY)),
+            ),
+            else_=close_minute,
+        ),
+    )
+
+
+# text search configuration without stemming or stop words, so prefixes of
+# names and street names match as typed
+SEARCH_CONFIGURATION = literal_column("'simple'::regconfig")
+
+
+def search_document(text):
+    return func.to_tsvector(SEARCH_CONFIGURATION, text)
+
+
+def location_point(latitude, longitude):
+    """
+    Built-in point of a restaurant's location, x being the longitude; no
+    PostGIS needed for its GiST index and box containment.
+    """
+    return func.point(longitude, latitude)
+
+
+# columns a recommendation page reads besides the (name, address) key, carried
+# in the leaf pages of idx_style_name_address so style pages are index-only scans
+COVERING_COLUMNS = [
+    "style",
+    "open_hour",
+    "close_hour",
+    "open_minute",
+    "close_minute",
+    "vegetarian",
+    "delivers",
+]
+
+
 class Restaurant(Base):
     __tablename__ = "restaurants"
 
@@ -52,15 +115,86 @@ class Restaurant(Base):
     style = Column(String, nullable=False)
     open_hour = Column(Time(timezone=True), nullable=False)
     close_hour = Column(Time(timezone=True), nullable=False)
+    # UTC minute of the day of open_hour/close_hour, see to_utc_minute
+    open_minute = Column(SmallInteger)
+    close_minute = Column(SmallInteger)
     vegetarian = Column(Boolean, nullable=False)
     delivers = Column(Boolean, nullable=False)
+    # WGS84 degrees, both set or both unknown
+    latitude = Column(Float)
+    longitude = Column(Float)
+    # catalogue_version of the last write, see query.snapshot
+    change_version = Column(BigInteger)
 
     __table_args__ = (
-        Index("idx_style", "style"),
-        Index("idx_style_vegetarian_delivers", "style", "vegetarian", "delivers"),
+        Index("idx_change_version", "change_version"),
+        # style = x, walked in page order; also replaces the plain style index
+        Index(
+            "idx_style_name_address",
+            "style",
+            "name",
+            "address",
+            postgresql_include=[
+                column for column in COVERING_COLUMNS if column != "style"
+            ],
+        ),
+        # no style filter or a negated one walks the primary key and reads the
+        # heap; a covering copy of it would cost every write more than it saves.
+        # Vegetarian or delivering restaurants are walked in page order by
+        # these partial keys alone, reading the heap for the page's rows only
+        Index(
+            "idx_vegetarian_name_address",
+            "name",
+            "address",
+            postgresql_where=vegetarian.is_(True),
+        ),
+        Index(
+            "idx_delivers_name_address",
+            "name",
+            "address",
+            postgresql_where=delivers.is_(True),
+        ),
+        Index("idx_open_minute", "open_minute"),
+        Index(
+            "idx_opening_hours",
+            opening_hours_range(open_minute, close_minute),
+            postgresql_using="gist",
+        ).ddl_if(dialect="postgresql"),
+        # bounding boxes of lat/lon/radius recommendations
+        Index(
+            "idx_location",
+            location_point(latitude, longitude),
+            postgresql_using="gist",
+        ).ddl_if(dialect="postgresql"),
     )
 
 
+KEY_WORD_TO_COLUMN_MAP = dict(
+    style=Restaurant.style,
+    deliver=Restaurant.delivers,
+    vegetarian=Restaurant.vegetarian,
+    open_hour=Restaurant.open_hour,
+    close_hour=Restaurant.close_hour,
+)
+
+
+class CatalogueVersion(Base):
+    __tablename__ = "catalogue_version"
+
+    id = Column(SmallInteger, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
+class RestaurantTombstone(Base):
+    __tablename__ = "restaurant_tombstones"
+
+    name = Column(String, primary_key=True, nullable=False)
+    address = Column(String, primary_key=True, nullable=False)
+    change_version = Column(BigInteger, nullable=False)
+
+    __table_args__ = (Index("idx_tombstone_change_version", "change_version"),)
+
+
 class RequestHistory(Base):
     __tablename__ = "request_history"
 
@@ -71,42 +205,121 @@ class RequestHistory(Base):
     request_type = Column(SqlalchemyEnum(RequestType), nullable=False)
 
 
+class EtlJobState(Base):
+    __tablename__ = "etl_job_state"
+
+    object_key = Column(String, primary_key=True)
+    etag = Column(String, nullable=False)
+    status = Column(SqlalchemyEnum(EtlJobStatus), nullable=False)
+    byte_offset = Column(BigInteger, nullable=False)
+    line_number = Column(BigInteger, nullable=False)
+    rows_affected = Column(BigInteger, nullable=False)
+    rows_rejected = Column(BigInteger, nullable=False)
+    updated_time = Column(TIMESTAMP(timezone=True), nullable=False)
+
+
 def get_database_time(time_str, timezone):
-    return f"2000-01-01 {to_24_hour_format(time_str)} {timezone}"
+    return format_database_time(to_24_hour_format(time_str), timezone)
+
+
+def format_database_time(time_24_hours, timezone):
+    return f"2000-01-01 {time_24_hours} {timezone}"
+
+
+@functools.lru_cache(maxsize=1024)
+def is_valid_timezone(timezone: str) -> bool:
+    try:
+        pendulum.timezone(timezone)
+        return True
+    except Exception:
+        return False
+
+
+@functools.lru_cache(maxsize=4096)
+def to_utc_minute(time_24_hours: str, timezone: str) -> int:
+    """
+    UTC minute of the day of a "HH:MM" wall-clock time. The offset is taken
+    on the same 2000-01-01 reference date as format_database_time, so it
+    agrees with the offset Postgres stores in open_hour/close_hour.
+    """
+    hour, minute = time_24_hours.split(":")
+    if timezone[:1] in ("+", "-"):
+        # fixed offsets such as "+05:30", the name pendulum gives parsed offsets
+        offset_hours, _, offset_minutes = timezone[1:].partition(":")
+        offset = int(offset_hours) * 3600 + int(offset_minutes or 0) * 60
+        timezone = pendulum.fixed_timezone(-offset if timezone[0] == "-" else offset)
+    utc = pendulum.datetime(2000, 1, 1, int(hour), int(minute), tz=timezone).in_timezone(
+        "UTC"
+    )
+    return utc.hour * 60 + utc.minute
+
+
+def local_day_ranges(
+    time_context: TimeContext, minute: int, timezone: str
+) -> list[tuple[int, int]]:
+    """
+    Half-open ranges of UTC opening minutes "after" or "before" the UTC
+    minute within the request's local day. Where that day crosses UTC
+    midnight the range is split at it: after 10pm in America/Chicago is
+    04:01-06:00 UTC, not every opening after 04:00 UTC.
+    """
+    day_start = to_utc_minute("00:00", timezone)
+    if time_context == TimeContext.after:
+        start, end = (minute + 1) % MINUTES_PER_DAY, day_start
+    else:
+        start, end = day_start, minute
+    if start < end:
+        return [(start, end)]
+    if start == end:
+        # after the day's last minute or before its first
+        return []
+    return [(start, MINUTES_PER_DAY)] + ([(0, end)] if end else [])
+
+
+# Accepts exactly what the strptime formats "%I:%M %p", "%I:%M%p", "%I%p",
+# "%I %p", "%H:%M" and "%H" accepted, using strptime's own field patterns.
+TIME_GRAMMAR = re.compile(
+    r"(?:(?P<hour_12>1[0-2]|0[1-9]|[1-9])(?::(?P<minute_12>[0-5]\d|\d))?\s*(?P<meridiem>[ap]m)"
+    r"|(?P<hour_24>2[0-3]|[0-1]\d|\d)(?::(?P<minute_24>[0-5]\d|\d))?)",
+    re.IGNORECASE,
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_time(time_str: str):
+    """
+    Returns the time in 24-hour "HH:MM" format, or None if it is not in one
+    of the supported forms ("8AM", "8 am", "8:30pm", "20:30", "20").
+    """
+    match = TIME_GRAMMAR.fullmatch(time_str.strip())
+    if not match:
+        return None
+    if match.group("meridiem"):
+        hour = int(match.group("hour_12")) % 12
+        if match.group("meridiem").lower() == "pm":
+            hour += 12
+        minute = int(match.group("minute_12") or 0)
+    else:
+        hour = int(match.group("hour_24"))
+        minute = int(match.group("minute_24") or 0)
+    return f"{hour:02d}:{minute:02d}"
 
 
 def to_24_hour_format(time_str):
     """
     Convert time string to 24-hour format.
     """
-    try:
-        # Handle time with space (e.g., "8 AM")
-        return datetime.strptime(time_str.strip(), "%I:%M %p").strftime("%H:%M")
-    except ValueError:
-        try:
-            return datetime.strptime(time_str.strip(), "%I:%M%p").strftime("%H:%M")
-        except ValueError:
-            try:
-                # Handle time without space (e.g., "8AM")
-                return datetime.strptime(time_str.strip(), "%I%p").strftime("%H:%M")
-            except ValueError:
-                try:
-                    return datetime.strptime(time_str.strip(), "%I %p").strftime(
-                        "%H:%M"
-                    )
-                except ValueError:
-                    try:
-                        return datetime.strptime(time_str.strip(), "%H:%M").strftime(
-                            "%H:%M"
-                        )
-                    except ValueError:
-                        try:
-                            return datetime.strptime(time_str.strip(), "%H").strftime(
-                                "%H:%M"
-                            )
-                        except ValueError as e:
-                            LOGGER.error(e)
-                            raise e
+    time_24_hours = normalize_time(time_str)
+    if time_24_hours is None:
+        error = ValueError(f"time data {time_str!r} does not match any supported format")
+        LOGGER.error(error)
+        raise error
+    return time_24_hours
+
+
+TIME_PATTERN = re.compile(
+    r"\b(at|by|after|before)?\b\s*(\d{1,2}(:\d{2})?(?:\s?[APap][Mm])?)\b", re.IGNORECASE
+)
 
 
 def extract_time_and_context(sentence: str, request_time: pendulum.DateTime):
@@ -115,9 +328,7 @@ def extract_time_and_context(sentence: str, request_time: pendulum.DateTime):
     Includes context words: at, by, after, before.
     Handles cases with or without spaces between time and AM/PM.
     """
-    time_pattern = r"\b(at|by|after|before)?\b\s*(\d{1,2}(:\d{2})?(?:\s?[APap][Mm])?)"
-
-    match = re.search(time_pattern, sentence, re.IGNORECASE)
+    match = TIME_PATTERN.search(sentence)
 
     if match:
         context = match.group(1)  # Context word like 'at', 'by', etc.
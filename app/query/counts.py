@@ -0,0 +1,231 @@
+from typing import NamedTuple
+from sqlalchemy import case, func, text, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query, Session
+from query import metrics
+from query.builder import RECOMMENDATION_CACHE, add_recommendation_filters
+from query.cache import ResultCache
+from query.common import Restaurant, Style
+from query.parser import FilterSpec
+import json
+import os
+
+COUNT_MODES = ("exact", "estimate", "auto")
+# in auto mode, queries the planner expects to match more rows are estimated
+COUNTS_EXACT_MAX_ROWS = int(os.getenv("COUNTS_EXACT_MAX_ROWS", "100000"))
+# pg_stats only changes when the table is analyzed
+STATISTICS_CACHE = ResultCache(
+    max_size=1,
+    ttl_seconds=float(os.getenv("COUNTS_STATISTICS_TTL_SECONDS", "300")),
+)
+STYLES = Style._member_names_
+# response facet -> FilterSpec field
+BOOLEAN_FACETS = {"vegetarian": "vegetarian", "delivers": "deliver"}
+
+
+class ResultCounts(NamedTuple):
+    total: int
+    # {"style": {style: count}, "vegetarian": {"true": count, "false": count},
+    # "delivers": {...}}
+    facets: dict
+    # planner estimates rather than counted rows
+    estimated: bool
+
+    def to_dict(self) -> dict:
+        return {"total": self.total, "facets": self.facets, "estimated": self.estimated}
+
+
+def facet_counts(total: int, styles: dict, vegetarian: int, delivers: int) -> dict:
+    """
+    Facets from the count of every style and of the vegetarian and
+    delivering restaurants among total.
+    """
+    return {
+        "style": {style: styles.get(style, 0) for style in STYLES}
+        | {style: count for style, count in styles.items() if style not in STYLES},
+        "vegetarian": {"true": vegetarian, "false": total - vegetarian},
+        "delivers": {"true": delivers, "false": total - delivers},
+    }
+
+
+def build_counts_query(session: Session, filter_spec: FilterSpec) -> Query:
+    """
+    The total and the count per style, vegetarian and delivers of the rows
+    matching filter_spec in one scan: GROUPING SETS ((), style, vegetarian,
+    delivers). The columns are NOT NULL, so a row's grouping set is the one
+    column that isn't NULL, or none for the total.
+    """
+    query = session.query(
+        Restaurant.style, Restaurant.vegetarian, Restaurant.delivers, func.count()
+    ).group_by(
+        func.grouping_sets(
+            tuple_(), Restaurant.style, Restaurant.vegetarian, Restaurant.delivers
+        )
+    )
+    return add_recommendation_filters(query, filter_spec)
+
+
+def count_restaurants(session: Session, filter_spec: FilterSpec) -> ResultCounts:
+    """
+    Counts the rows matching filter_spec: in one GROUPING SETS scan on
+    Postgres, elsewhere (SQLite has no GROUPING SETS) with
+    count_restaurants_per_facet.
+    """
+    if session.bind.dialect.name != "postgresql":
+        return count_restaurants_per_facet(session, filter_spec)
+    total = 0
+    styles = {}
+    flags = {"vegetarian": 0, "delivers": 0}
+    with metrics.span("count_query"):
+        rows = build_counts_query(session, filter_spec).all()
+    for style, vegetarian, delivers, count in rows:
+        if style is not None:
+            styles[style] = count
+        elif vegetarian is not None:
+            flags["vegetarian"] += count if vegetarian else 0
+        elif delivers is not None:
+            flags["delivers"] += count if delivers else 0
+        else:
+            total = count
+    return ResultCounts(total, facet_counts(total, styles, **flags), estimated=False)
+
+
+def count_restaurants_per_facet(session: Session, filter_spec: FilterSpec) -> ResultCounts:
+    """
+    The counts of count_restaurants in two queries: per style, whose sum is
+    the total, and the vegetarian and delivering rows.
+    """
+    styles = add_recommendation_filters(
+        session.query(Restaurant.style, func.count()).group_by(Restaurant.style), filter_spec
+    )
+    flags = add_recommendation_filters(
+        session.query(
+            func.coalesce(func.sum(case((Restaurant.vegetarian, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((Restaurant.delivers, 1), else_=0)), 0),
+        ),
+        filter_spec,
+    )
+    with metrics.span("count_query"):
+        styles = dict(styles.all())
+        vegetarian, delivers = flags.one()
+    total = sum(styles.values())
+    return ResultCounts(
+        total, facet_counts(total, styles, vegetarian, delivers), estimated=False
+    )
+
+
+def estimate_total(session: Session, filter_spec: FilterSpec) -> int:
+    """
+    The planner's row estimate for filter_spec, from EXPLAIN without
+    running the query. The query is compiled with named parameters and
+    bound again through text(), so every driver gets its own placeholders:
+    psycopg2's %(name)s, or asyncpg's $n under the ASGI server.
+    """
+    query = add_recommendation_filters(session.query(Restaurant.name), filter_spec)
+    compiled = query.statement.compile(
+        dialect=postgresql.dialect(paramstyle="named"),
+        compile_kwargs={"render_postcompile": True},
+    )
+    with metrics.span("count_estimate"):
+        plan = session.execute(
+            text(f"EXPLAIN (FORMAT JSON) {compiled}"), compiled.params
+        ).scalar()
+    if isinstance(plan, str):
+        # drivers without a json codec
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def parse_array_text(value: str) -> list[str]:
+    # anyarray cast to text, e.g. {french,italian} or {f,t}; styles and
+    # booleans need no quoting
+    return value.strip("{}").split(",") if value else []
+
+
+def get_value_frequencies(session: Session) -> dict | None:
+    """
+    Share of the table holding each style and vegetarian/delivers value,
+    from the most common values ANALYZE collected; None before the table
+    was first analyzed.
+    """
+    cached = STATISTICS_CACHE.get("frequencies")
+    if cached is not None:
+        return cached or None
+    rows = session.execute(
+        text(
+            "SELECT attname, most_common_vals::text, most_common_freqs FROM pg_stats "
+            "WHERE schemaname = current_schema() AND tablename = 'restaurants' "
+            "AND attname IN ('style', 'vegetarian', 'delivers')"
+        )
+    ).all()
+    frequencies = {}
+    for name, values, shares in rows:
+        values = parse_array_text(values)
+        if name != "style":
+            values = [value == "t" for value in values]
+        frequencies[name] = dict(zip(values, shares or []))
+    if len(frequencies) < 3:
+        frequencies = {}
+    # an empty dict caches the absence of statistics
+    STATISTICS_CACHE.put("frequencies", frequencies)
+    return frequencies or None
+
+
+def estimate_counts(
+    filter_spec: FilterSpec, total: int, frequencies: dict
+) -> ResultCounts:
+    """
+    Splits the estimated total across facet values in proportion to their
+    frequency among the values filter_spec allows, assuming, as the planner
+    does, that columns are independent.
+    """
+    allowed = STYLES
+    if filter_spec.styles:
+        if filter_spec.style_negation:
+            allowed = [style for style in STYLES if style not in filter_spec.styles]
+        else:
+            allowed = [style for style in STYLES if style in filter_spec.styles]
+    style_shares = {style: frequencies["style"].get(style, 0.0) for style in allowed}
+    allowed_share = sum(style_shares.values())
+    styles = {
+        style: round(total * share / allowed_share) if allowed_share else 0
+        for style, share in style_shares.items()
+    }
+    flags = {}
+    for facet, field in BOOLEAN_FACETS.items():
+        required = getattr(filter_spec, field)
+        if required is not None:
+            flags[facet] = total if required else 0
+            continue
+        shares = frequencies[facet]
+        known = shares.get(True, 0.0) + shares.get(False, 0.0)
+        flags[facet] = round(total * shares.get(True, 0.0) / known) if known else 0
+    return ResultCounts(total, facet_counts(total, styles, **flags), estimated=True)
+
+
+def get_result_counts(session: Session, filter_spec: FilterSpec, mode: str) -> ResultCounts:
+    """
+    Counts of the rows filter_spec matches, whatever page is read. "exact"
+    counts them, "estimate" takes the planner's estimate, and "auto" counts
+    unless the estimate exceeds COUNTS_EXACT_MAX_ROWS. Estimates need
+    Postgres statistics and fall back to counting without them. Results
+    are cached in RECOMMENDATION_CACHE with the pages.
+    """
+    cache_key = ("counts", filter_spec, mode)
+    counts = RECOMMENDATION_CACHE.get(cache_key)
+    if counts is not None:
+        metrics.count("cache_hits")
+        return counts
+    frequencies = None
+    if mode != "exact" and session.bind.dialect.name == "postgresql":
+        frequencies = get_value_frequencies(session)
+    if frequencies is None:
+        counts = count_restaurants(session, filter_spec)
+    else:
+        total = estimate_total(session, filter_spec)
+        if mode == "auto" and total <= COUNTS_EXACT_MAX_ROWS:
+            counts = count_restaurants(session, filter_spec)
+        else:
+            counts = estimate_counts(filter_spec, total, frequencies)
+    RECOMMENDATION_CACHE.put(cache_key, counts)
+    return counts
@@ -0,0 +1,211 @@
+from typing import NamedTuple
+from collections import defaultdict
+import math
+import os
+from sqlalchemy import Integer, and_, cast, func, or_
+from query.common import Restaurant, location_point
+
+# mean Earth radius, as used by the haversine formula
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_METERS / 180
+GEO_DEFAULT_RADIUS_METERS = int(os.getenv("GEO_DEFAULT_RADIUS_METERS", "5000"))
+GEO_MAX_RADIUS_METERS = int(os.getenv("GEO_MAX_RADIUS_METERS", "50000"))
+# about 11km of latitude, so a default radius covers a handful of cells
+GRID_CELL_DEGREES = 0.1
+
+
+class GeoFilter(NamedTuple):
+    """
+    The circle /recommend's lat, lon and radius describe.
+    """
+
+    latitude: float
+    longitude: float
+    radius_meters: int
+
+
+def parse_coordinate(value, limit: float) -> float | None:
+    """
+    The value as a finite float within [-limit, limit], else None.
+    """
+    try:
+        coordinate = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(coordinate) or abs(coordinate) > limit:
+        return None
+    return coordinate
+
+
+NO_LOCATION = (None, None)
+
+
+def parse_location(latitude, longitude) -> tuple | None:
+    """
+    (latitude, longitude) of a record as floats, NO_LOCATION when both are
+    missing or empty, or None when only one is given or either is invalid.
+    """
+    if latitude in (None, "") and longitude in (None, ""):
+        return NO_LOCATION
+    location = (parse_coordinate(latitude, 90), parse_coordinate(longitude, 180))
+    return None if None in location else location
+
+
+def get_geo_filter(query_params: dict) -> GeoFilter | None:
+    """
+    The GeoFilter of /recommend's lat, lon and optional radius (meters,
+    GEO_DEFAULT_RADIUS_METERS by default), or None without lat and lon.
+    Raises ValueError naming the invalid parameter.
+    """
+    latitude, longitude = query_params.get("lat"), query_params.get("lon")
+    radius = query_params.get("radius")
+    if latitude is None and longitude is None:
+        if radius is not None:
+            raise ValueError("radius requires lat and lon")
+        return None
+    location = parse_location(latitude, longitude)
+    if location in (None, NO_LOCATION):
+        raise ValueError("lat and lon must be valid coordinates in degrees")
+    if radius is None:
+        radius_meters = GEO_DEFAULT_RADIUS_METERS
+    elif radius.isdigit() and 0 < int(radius) <= GEO_MAX_RADIUS_METERS:
+        radius_meters = int(radius)
+    else:
+        raise ValueError(f"radius must be whole meters up to {GEO_MAX_RADIUS_METERS}")
+    return GeoFilter(*location, radius_meters)
+
+
+def haversine_meters(latitude1, longitude1, latitude2, longitude2) -> float:
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1)
+        * math.cos(phi2)
+        * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(near: GeoFilter) -> list[tuple[float, float, float, float]]:
+    """
+    (min_latitude, min_longitude, max_latitude, max_longitude) boxes that
+    together cover the circle: one, or two when it crosses the antimeridian.
+    """
+    latitude_delta = near.radius_meters / METERS_PER_DEGREE
+    min_latitude = near.latitude - latitude_delta
+    max_latitude = near.latitude + latitude_delta
+    if min_latitude <= -90 or max_latitude >= 90:
+        # the circle holds a pole: every longitude is in range
+        return [(max(min_latitude, -90), -180, min(max_latitude, 90), 180)]
+    longitude_delta = math.degrees(
+        math.asin(
+            min(
+                1.0,
+                math.sin(near.radius_meters / EARTH_RADIUS_METERS)
+                / math.cos(math.radians(near.latitude)),
+            )
+        )
+    )
+    min_longitude = near.longitude - longitude_delta
+    max_longitude = near.longitude + longitude_delta
+    if min_longitude < -180:
+        return [
+            (min_latitude, min_longitude + 360, max_latitude, 180),
+            (min_latitude, -180, max_latitude, max_longitude),
+        ]
+    if max_longitude > 180:
+        return [
+            (min_latitude, min_longitude, max_latitude, 180),
+            (min_latitude, -180, max_latitude, max_longitude - 360),
+        ]
+    return [(min_latitude, min_longitude, max_latitude, max_longitude)]
+
+
+def distance_meters(near: GeoFilter):
+    """
+    Haversine distance of each restaurant from the filter's centre, rounded
+    to whole meters so pages can be continued after a distance.
+    """
+    phi = math.radians(near.latitude)
+    latitude = func.radians(Restaurant.latitude)
+    longitude = func.radians(Restaurant.longitude)
+    # halved with * 0.5: / 2 would be rendered as a numeric division
+    a = func.power(func.sin((latitude - phi) * 0.5), 2) + math.cos(phi) * func.cos(
+        latitude
+    ) * func.power(func.sin((longitude - math.radians(near.longitude)) * 0.5), 2)
+    distance = 2 * EARTH_RADIUS_METERS * func.asin(func.least(1.0, func.sqrt(a)))
+    return cast(func.round(distance), Integer)
+
+
+def near_condition(near: GeoFilter):
+    """
+    Inside a bounding box, served by idx_location, then inside the circle.
+    """
+    return and_(
+        or_(
+            *[
+                location_point(Restaurant.latitude, Restaurant.longitude).op("<@")(
+                    func.box(
+                        func.point(min_longitude, min_latitude),
+                        func.point(max_longitude, max_latitude),
+                    )
+                )
+                for min_latitude, min_longitude, max_latitude, max_longitude in bounding_boxes(
+                    near
+                )
+            ]
+        ),
+        distance_meters(near) <= near.radius_meters,
+    )
+
+
+def grid_cell(latitude: float, longitude: float) -> tuple[int, int]:
+    return (
+        math.floor(latitude / GRID_CELL_DEGREES),
+        math.floor(longitude / GRID_CELL_DEGREES),
+    )
+
+
+class GridIndex:
+    def __init__(self, latitudes, longitudes) -> None:
+        """
+        Row positions bucketed by GRID_CELL_DEGREES cells, the snapshot's
+        counterpart of idx_location: a search reads the cells overlapping
+        the bounding boxes and measures only the rows in them.
+
+        Args:
+            latitudes: Latitude of every row, NaN if unknown.
+            longitudes: Longitude of every row, NaN if unknown.
+        """
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.cells = defaultdict(list)
+        for position, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+            if not (math.isnan(latitude) or math.isnan(longitude)):
+                self.cells[grid_cell(latitude, longitude)].append(position)
+
+    def within(self, near: GeoFilter) -> list[tuple[int, int]]:
+        """
+        (distance in meters, position) of the rows inside the circle,
+        rounded like distance_meters.
+        """
+        found = []
+        for min_latitude, min_longitude, max_latitude, max_longitude in bounding_boxes(near):
+            low = grid_cell(min_latitude, min_longitude)
+            high = grid_cell(max_latitude, max_longitude)
+            for latitude_cell in range(low[0], high[0] + 1):
+                for longitude_cell in range(low[1], high[1] + 1):
+                    for position in self.cells.get((latitude_cell, longitude_cell), ()):
+                        distance = round(
+                            haversine_meters(
+                                near.latitude,
+                                near.longitude,
+                                self.latitudes[position],
+                                self.longitudes[position],
+                            )
+                        )
+                        if distance <= near.radius_meters:
+                            found.append((distance, position))
+        # a row on a box edge can be read by both boxes
+        return sorted(set(found))
@@ -0,0 +1,164 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import json
+import os
+import sys
+import time
+
+# off, every span and count is a no-op; the Lambdas turn it on
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "RestaurantSearchService")
+CURRENT_INVOCATION = ContextVar("metrics_invocation", default=None)
+
+
+class Invocation:
+    def __init__(self, service: str, operation: str) -> None:
+        """
+        Timings and counts of one handler invocation, emitted as a single
+        CloudWatch embedded metric format (EMF) line when it ends.
+
+        Args:
+            service (str): The Service dimension, e.g. "api" or "etl".
+            operation (str): The Operation dimension, replaceable once the
+                request has been routed.
+        """
+        self.dimensions = {"Service": service, "Operation": operation}
+        self.milliseconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.properties = {}
+
+    def to_emf(self, namespace: str, timestamp_ms: int) -> dict:
+        metrics = [
+            {"Name": f"{name}_ms", "Unit": "Milliseconds"} for name in self.milliseconds
+        ] + [{"Name": name, "Unit": "Count"} for name in self.counts]
+        return {
+            "_aws": {
+                "Timestamp": timestamp_ms,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [list(self.dimensions)],
+                        "Metrics": metrics,
+                    }
+                ],
+            },
+            **self.dimensions,
+            **self.properties,
+            **{f"{name}_ms": round(value, 3) for name, value in self.milliseconds.items()},
+            **self.counts,
+        }
+
+
+class Span:
+    __slots__ = ("invocation", "name", "start")
+
+    def __init__(self, invocation: Invocation, name: str) -> None:
+        self.invocation = invocation
+        self.name = name
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        # a stage run several times in an invocation, e.g. per batch, adds up
+        self.invocation.milliseconds[self.name] += (time.perf_counter() - self.start) * 1000
+        return False
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name: str):
+    """
+    Context manager adding its duration to the current invocation as
+    <name>_ms; a shared no-op outside an invocation or when disabled.
+    """
+    invocation = CURRENT_INVOCATION.get()
+    if invocation is None:
+        return NULL_SPAN
+    return Span(invocation, name)
+
+
+def timed(name: str):
+    """
+    Decorator running the function in span(name).
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, value: int = 1) -> None:
+    invocation = CURRENT_INVOCATION.get()
+    if invocation is not None:
+        invocation.counts[name] += value
+
+
+def add_milliseconds(name: str, milliseconds: float) -> None:
+    # for durations measured elsewhere, e.g. the pool's checkout wait
+    invocation = CURRENT_INVOCATION.get()
+    if invocation is not None:
+        invocation.milliseconds[name] += milliseconds
+
+
+def set_operation(operation: str) -> None:
+    invocation = CURRENT_INVOCATION.get()
+    if invocation is not None:
+        invocation.dimensions["Operation"] = operation
+
+
+def set_property(name: str, value) -> None:
+    # searchable in CloudWatch Logs Insights, not a metric
+    invocation = CURRENT_INVOCATION.get()
+    if invocation is not None:
+        invocation.properties[name] = value
+
+
+def emit_line(line: str) -> None:
+    # straight to stdout: the Lambda log formatter's prefix would hide the
+    # JSON from CloudWatch's EMF extraction
+    sys.stdout.write(line + "\n")
+
+
+@contextmanager
+def invocation(service: str, operation: str = "unknown", emit=emit_line, enabled: bool = None):
+    """
+    Collects the spans and counts of the code it wraps, in this thread or
+    task, and emits them with emit when it exits, also after an error, which
+    is counted as errors. Yields the Invocation, or None when disabled.
+    """
+    if not (METRICS_ENABLED if enabled is None else enabled):
+        yield None
+        return
+    current = Invocation(service, operation)
+    token = CURRENT_INVOCATION.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception:
+        current.counts["errors"] += 1
+        raise
+    finally:
+        current.milliseconds["total"] += (time.perf_counter() - start) * 1000
+        CURRENT_INVOCATION.reset(token)
+        emit(json.dumps(current.to_emf(METRICS_NAMESPACE, int(time.time() * 1000))))
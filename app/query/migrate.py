@@ -0,0 +1,132 @@
+from sqlalchemy import Connection, Engine, text
+from query.common import Base, LOGGER, MINUTES_PER_DAY
+
+
+def utc_minute_sql(column_name: str) -> str:
+    """
+    UTC minute of the day of a time with time zone column; EXTRACT(EPOCH)
+    of a timetz is its UTC seconds since midnight, which can fall outside
+    a single day.
+    """
+    return (
+        f"((EXTRACT(EPOCH FROM {column_name})::integer / 60) % {MINUTES_PER_DAY}"
+        f" + {MINUTES_PER_DAY}) % {MINUTES_PER_DAY}"
+    )
+
+
+def add_opening_minutes(connection: Connection) -> None:
+    connection.execute(
+        text(
+            "ALTER TABLE restaurants "
+            "ADD COLUMN IF NOT EXISTS open_minute SMALLINT, "
+            "ADD COLUMN IF NOT EXISTS close_minute SMALLINT"
+        )
+    )
+    backfilled = connection.execute(
+        text(
+            f"UPDATE restaurants SET open_minute = {utc_minute_sql("open_hour")}, "
+            f"close_minute = {utc_minute_sql("close_hour")} "
+            "WHERE open_minute IS NULL OR close_minute IS NULL"
+        )
+    ).rowcount
+    LOGGER.info(f"Backfilled opening minutes of {backfilled} restaurants")
+
+
+def drop_replaced_indexes(connection: Connection) -> None:
+    # idx_style is a prefix of the covering idx_style_name_address
+    connection.execute(text("DROP INDEX IF EXISTS idx_style"))
+
+
+def drop_name_address_covering(connection: Connection) -> None:
+    # keyed like the primary key, a fourth near full copy of the table
+    connection.execute(text("DROP INDEX IF EXISTS idx_name_address_covering"))
+
+
+def drop_search_indexes(connection: Connection) -> None:
+    # search terms only rank the rows the other filters match
+    connection.execute(text("DROP INDEX IF EXISTS idx_search_document"))
+    connection.execute(text("DROP INDEX IF EXISTS idx_search_trigram"))
+
+
+def drop_boolean_covering(connection: Connection) -> None:
+    # the vegetarian and delivers partial indexes used to INCLUDE every
+    # covering column, near copies of the table; dropped once so they are
+    # created again with their keys alone
+    for name in ("idx_vegetarian_name_address", "idx_delivers_name_address"):
+        covering = connection.execute(
+            text(
+                "SELECT indnatts > indnkeyatts FROM pg_index "
+                "WHERE indexrelid = to_regclass(:name)"
+            ),
+            {"name": name},
+        ).scalar()
+        if covering:
+            connection.execute(text(f"DROP INDEX {name}"))
+    # its filters are served by idx_style_name_address and the partial indexes
+    connection.execute(text("DROP INDEX IF EXISTS idx_style_vegetarian_delivers"))
+
+
+def add_change_version(connection: Connection) -> None:
+    connection.execute(
+        text("ALTER TABLE restaurants ADD COLUMN IF NOT EXISTS change_version BIGINT")
+    )
+
+
+def add_location(connection: Connection) -> None:
+    connection.execute(
+        text(
+            "ALTER TABLE restaurants "
+            "ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION, "
+            "ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION"
+        )
+    )
+
+
+def add_batch_request_type(connection: Connection) -> None:
+    # request_type is a native enum of the RequestType names
+    connection.execute(text("ALTER TYPE requesttype ADD VALUE IF NOT EXISTS 'RecommendBatch'"))
+
+
+# Postgres upgrades of tables created by earlier versions, in order; each
+# must be safe to run again
+UPGRADES = [
+    add_opening_minutes,
+    drop_replaced_indexes,
+    add_change_version,
+    add_location,
+    add_batch_request_type,
+    drop_name_address_covering,
+    drop_search_indexes,
+    drop_boolean_covering,
+]
+
+
+def migrate(engine: Engine) -> list[str]:
+    """
+    Creates missing tables and indexes. Runs once per deployment rather than
+    on every Lambda cold start; returns the tables that exist afterwards.
+    """
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # index builds may outlive the request statement_timeout
+            connection.execute(text("SET LOCAL statement_timeout = 0"))
+        Base.metadata.create_all(connection)
+        if connection.dialect.name == "postgresql":
+            for upgrade in UPGRADES:
+                upgrade(connection)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+    tables = sorted(Base.metadata.tables)
+    LOGGER.info(f"Migrated tables: {tables}")
+    return tables
+
+
+def lambda_handler(event, context):
+    from query.clients import get_engine
+
+    return {"tables": migrate(get_engine())}
+
+
+if __name__ == "__main__":
+    lambda_handler({}, None)
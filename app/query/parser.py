@@ -0,0 +1,154 @@
+from typing import NamedTuple
+from sqlalchemy import Boolean
+import hashlib
+import pendulum
+import re
+from query.common import (
+    TimeContext,
+    Style,
+    KEY_WORD_TO_COLUMN_MAP,
+    TIME_PATTERN,
+    extract_time_and_context,
+    to_24_hour_format,
+)
+from query.geo import GeoFilter
+from query.search import search_terms, tokenize
+
+NEGATION_PREFIXES = ["non-", "not "]
+BOOLEAN_KEY_WORDS = [
+    key_word
+    for key_word, column in KEY_WORD_TO_COLUMN_MAP.items()
+    if isinstance(column.type, Boolean)
+]
+
+
+class FilterSpec(NamedTuple):
+    """
+    Hashable result of parsing a recommendation sentence.
+    """
+
+    styles: tuple[str, ...]
+    style_negation: bool
+    vegetarian: bool | None
+    deliver: bool | None
+    time_context: TimeContext | None
+    time: str | None
+    timezone: str | None
+    # words left for the full-text search, see query.search
+    terms: tuple[str, ...] = ()
+    # lat/lon/radius of the request rather than the sentence, see query.geo
+    near: GeoFilter | None = None
+
+
+class SentenceParser:
+    def __init__(self, styles: list[str], boolean_key_words: list[str]) -> None:
+        """
+        Builds a single alternation over every keyword, with an optional
+        negation prefix, so a sentence is scanned once whatever the number
+        of styles.
+
+        Args:
+            styles (list[str]): Style names in the order filters are reported.
+            boolean_key_words (list[str]): Keywords mapped to boolean columns.
+        """
+        self.style_order = {style: index for index, style in enumerate(styles)}
+        self.boolean_key_words = list(boolean_key_words)
+        key_words = sorted(
+            set(self.style_order) | set(self.boolean_key_words), key=len, reverse=True
+        )
+        prefixes = "|".join(re.escape(prefix) for prefix in NEGATION_PREFIXES)
+        alternation = "|".join(re.escape(key_word) for key_word in key_words)
+        self.pattern = re.compile(
+            rf"\b({prefixes})?({alternation})\b", re.IGNORECASE
+        )
+
+    def parse_key_words(self, sentence: str) -> tuple:
+        """
+        Returns the style filter as (is_negation, styles) followed by one
+        True/False/None value per boolean keyword. A negated keyword wins over
+        a plain mention of the same keyword.
+        """
+        present = set()
+        negated = set()
+        for match in self.pattern.finditer(sentence):
+            key_word = match.group(2).lower()
+            if match.group(1):
+                negated.add(key_word)
+            else:
+                present.add(key_word)
+
+        styles = sorted(
+            (key_word for key_word in present - negated if key_word in self.style_order),
+            key=self.style_order.__getitem__,
+        )
+        if styles:
+            style_filter = (False, styles)
+        else:
+            style_filter = (
+                True,
+                sorted(
+                    (key_word for key_word in negated if key_word in self.style_order),
+                    key=self.style_order.__getitem__,
+                ),
+            )
+
+        boolean_filters = tuple(
+            False if key_word in negated else True if key_word in present else None
+            for key_word in self.boolean_key_words
+        )
+        return (style_filter,) + boolean_filters
+
+    def residual_words(self, sentence: str) -> list[str]:
+        """
+        Words of the sentence outside its keywords, their inflections (e.g.
+        "delivers", "vegetarians") and the time the filters already use.
+        """
+        residual = self.pattern.sub(" ", sentence)
+        match = TIME_PATTERN.search(residual)
+        if match and to_24_hour_format(match.group(2)):
+            residual = residual[: match.start()] + " " + residual[match.end() :]
+        key_words = set(self.style_order) | set(self.boolean_key_words)
+        return [
+            word
+            for word in tokenize(residual)
+            if word not in ("not", "non")
+            and not any(word.startswith(key_word) for key_word in key_words)
+        ]
+
+    def parse(self, sentence: str, request_time: pendulum.DateTime) -> FilterSpec:
+        style_filter, *boolean_filters = self.parse_key_words(sentence)
+        booleans = dict(zip(self.boolean_key_words, boolean_filters))
+        time_context = extract_time_and_context(sentence, request_time) or {}
+        return FilterSpec(
+            styles=tuple(style_filter[1]),
+            style_negation=style_filter[0],
+            vegetarian=booleans.get("vegetarian"),
+            deliver=booleans.get("deliver"),
+            time_context=time_context.get("context"),
+            time=time_context.get("time"),
+            timezone=time_context.get("timezone"),
+            terms=search_terms(self.residual_words(sentence)),
+        )
+
+
+SENTENCE_PARSER = SentenceParser(Style._member_names_, BOOLEAN_KEY_WORDS)
+
+
+def parse_sentence(sentence: str, request_time: pendulum.DateTime) -> FilterSpec:
+    return SENTENCE_PARSER.parse(sentence, request_time)
+
+
+def get_filter_fingerprint(filter_spec: FilterSpec) -> str:
+    """
+    Stable digest of a filter spec, used to tie a page cursor to the query
+    that produced it. Python's hash() is salted per process so it can't be
+    used across Lambda containers.
+    """
+    values = tuple(filter_spec)
+    # cursors issued before the search and location filters keep their
+    # fingerprint: trailing fields at their defaults are left out
+    for default in reversed(FilterSpec._field_defaults.values()):
+        if values[-1] != default:
+            break
+        values = values[:-1]
+    return hashlib.sha256(repr(values).encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,192 @@
+from typing import NamedTuple
+from collections import OrderedDict, defaultdict
+import bisect
+import re
+import threading
+from sqlalchemy import case, func
+from query.common import Restaurant, SEARCH_CONFIGURATION, search_document
+
+SEARCH_TOKEN_PATTERN = re.compile(r"[^\W_]+")
+# words of a recommendation sentence that never narrow the search
+SEARCH_STOP_WORDS = frozenset(
+    """
+    a an and any are around at be best breakfast brunch by can cheap close
+    cuisine delivery dinner eat eating find food for from get give good i in
+    is it like looking lunch me meal my near nearby now of on open or place
+    places please restaurant restaurants serve serves serving show some
+    somewhere soon spot style that the to today tonight vegan want we where which
+    with would you
+    """.split()
+)
+MAX_SEARCH_TERMS = 5
+# one letter terms would match most of the catalogue as prefixes
+MIN_SEARCH_TERM_LENGTH = 2
+NAME_SCORE = 2
+ADDRESS_SCORE = 1
+SEARCH_CACHE_SIZE = 256
+# words in at least this share of the rows keep a ready bitset
+FREQUENT_WORD_SHARE = 1 / 64
+
+
+def tokenize(text: str) -> list[str]:
+    return SEARCH_TOKEN_PATTERN.findall(text.lower())
+
+
+def search_terms(words: list[str]) -> tuple[str, ...]:
+    """
+    The words of a sentence left for the search, in order and without stop
+    words, short words or repeats.
+    """
+    terms = []
+    for word in words:
+        if (
+            len(word) >= MIN_SEARCH_TERM_LENGTH
+            and word not in SEARCH_STOP_WORDS
+            and word not in terms
+        ):
+            terms.append(word)
+    return tuple(terms[:MAX_SEARCH_TERMS])
+
+
+def term_query(term: str):
+    # terms are letters and digits only, so they need no tsquery quoting
+    return func.to_tsquery(SEARCH_CONFIGURATION, f"{term}:*")
+
+
+def search_score(terms: tuple[str, ...]):
+    """
+    NAME_SCORE for every term that is a word prefix in the name, else
+    ADDRESS_SCORE if one in the address. The terms only rank the rows the
+    other filters match, so words the catalogue doesn't know, e.g. "tasty",
+    never empty the results. An integer, so pages can be continued after a
+    score.
+    """
+    name_document = search_document(Restaurant.name)
+    address_document = search_document(Restaurant.address)
+    cases = [
+        case(
+            (name_document.op("@@")(term_query(term)), NAME_SCORE),
+            (address_document.op("@@")(term_query(term)), ADDRESS_SCORE),
+            else_=0,
+        )
+        for term in terms
+    ]
+    return sum(cases[1:], cases[0])
+
+
+def add_bitsets(planes: list[int], addend: list[int]) -> list[int]:
+    """
+    Adds two bit-sliced numbers: plane i holds bit i of every row's value.
+    """
+    result = []
+    carry = 0
+    for index in range(max(len(planes), len(addend))):
+        left = planes[index] if index < len(planes) else 0
+        right = addend[index] if index < len(addend) else 0
+        result.append(left ^ right ^ carry)
+        carry = (left & right) | (carry & (left ^ right))
+    if carry:
+        result.append(carry)
+    return result
+
+
+def positions_bitset(positions, size: int) -> int:
+    flags = bytearray((size + 7) // 8)
+    for position in positions:
+        flags[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(flags, "little")
+
+
+class SearchResult(NamedTuple):
+    score_planes: list[int]
+
+    def score_levels(self, bits: int) -> list[tuple[int, int]]:
+        """
+        (score, rows) of the rows in bits, highest score first, down to the
+        rows no term scores.
+        """
+        levels = []
+        for score in range(2 ** len(self.score_planes) - 1, -1, -1):
+            rows = bits
+            for index, plane in enumerate(self.score_planes):
+                rows &= plane if score >> index & 1 else ~plane
+            if rows:
+                levels.append((score, rows))
+        return levels
+
+
+class SearchIndex:
+    def __init__(self, names, addresses) -> None:
+        """
+        Inverted index over the rows of a snapshot, the fallback of the
+        Postgres search where there is no database: postings are row
+        positions, turned into bitsets like the snapshot's other columns.
+        Terms match word prefixes, with the scores of search_score.
+
+        Args:
+            names: Name of every row.
+            addresses: Address of every row.
+        """
+        self.size = len(names)
+        postings = {field: defaultdict(list) for field in ("name", "address")}
+        for position in range(self.size):
+            for field, values in (("name", names), ("address", addresses)):
+                for word in set(tokenize(values[position])):
+                    postings[field][word].append(position)
+        self.postings = postings
+        # e.g. "street": rebuilding its bitset from positions on every
+        # search would cost more than the rest of the search
+        frequent = max(1024, int(self.size * FREQUENT_WORD_SHARE))
+        self.frequent_bitsets = {
+            (field, word): positions_bitset(positions, self.size)
+            for field, field_postings in postings.items()
+            for word, positions in field_postings.items()
+            if len(positions) >= frequent
+        }
+        self.words = sorted(set().union(*(field for field in postings.values())))
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def prefixed(self, term: str) -> list[str]:
+        start = bisect.bisect_left(self.words, term)
+        end = bisect.bisect_left(self.words, term + "\U0010ffff")
+        return self.words[start:end]
+
+    def field_bitset(self, field: str, words: list[str]) -> int:
+        postings = self.postings[field]
+        bits = 0
+        rare = []
+        for word in words:
+            if (field, word) in self.frequent_bitsets:
+                bits |= self.frequent_bitsets[(field, word)]
+            else:
+                rare.append(word)
+        return bits | positions_bitset(
+            (position for word in rare for position in postings.get(word, ())),
+            self.size,
+        )
+
+    def search(self, terms: tuple[str, ...]) -> SearchResult:
+        """
+        The scores of every row as bit planes.
+        """
+        with self.lock:
+            if terms in self.results:
+                self.results.move_to_end(terms)
+                return self.results[terms]
+        planes = []
+        for term in terms:
+            words = self.prefixed(term)
+            name_bits = self.field_bitset("name", words)
+            address_bits = self.field_bitset("address", words)
+            # NAME_SCORE is 2 and ADDRESS_SCORE 1: one bit plane each
+            planes = add_bitsets(planes, [address_bits & ~name_bits, name_bits])
+        result = SearchResult(planes)
+        with self.lock:
+            self.results[terms] = result
+            while len(self.results) > SEARCH_CACHE_SIZE:
+                self.results.popitem(last=False)
+        return result
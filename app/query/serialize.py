@@ -0,0 +1,130 @@
+from query.common import Restaurant
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+JSON_DECODER = json.JSONDecoder()
+
+# columns of a recommendation, in the order render_restaurant unpacks them
+RECOMMENDATION_COLUMNS = [
+    Restaurant.name,
+    Restaurant.style,
+    Restaurant.address,
+    Restaurant.open_hour,
+    Restaurant.close_hour,
+    Restaurant.vegetarian,
+    Restaurant.delivers,
+]
+
+
+def dumps(value) -> str:
+    """
+    Compact JSON, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def render_restaurant(row: tuple) -> str:
+    """
+    JSON object of one RECOMMENDATION_COLUMNS row. Fragments are rendered
+    once per row and cached with the page, so a cached page is only joined.
+    """
+    name, style, address, open_hour, close_hour, vegetarian, delivers = row
+    return dumps(
+        dict(
+            name=name,
+            style=style,
+            address=address,
+            openHour=str(open_hour),
+            clouseHour=str(close_hour),
+            vegetarian=vegetarian,
+            delivers=delivers,
+        )
+    )
+
+
+def with_distance(fragment: str, distance_meters: int) -> str:
+    """
+    A rendered row with its distance from the requested location appended,
+    leaving the cached fragment itself untouched.
+    """
+    return f'{fragment[:-1]},"distanceMeters":{distance_meters}}}'
+
+
+def render_recommendation_body(fragments, next_page, counts: dict = None) -> str:
+    """
+    The /recommend response body, joined from pre-rendered row fragments
+    without building the list of dicts again; counts, when requested, are
+    appended as members of their own.
+    """
+    rows = ",".join(fragments)
+    members = "" if counts is None else f",{dumps(counts)[1:-1]}"
+    return f'{{"restaurantRecommendation":[{rows}],"nextPage":{dumps(next_page)}{members}}}'
+
+
+def render_batch_body(results: list[tuple[int, str]]) -> str:
+    """
+    The /recommend/batch response body: the (status code, body) of every
+    query in order, each body an object spliced in with its statusCode.
+    """
+    items = ",".join(f'{{"statusCode":{status_code},{body[1:]}' for status_code, body in results)
+    return f'{{"results":[{items}]}}'
+
+
+def iter_array_items(text: str, key: str):
+    """
+    Yields the items of the array under key in the JSON object text one at
+    a time, each decoded only when it is reached, so the caller can act on
+    the first items before the rest are parsed and never holds all of them.
+    Other members are skipped. Raises json.JSONDecodeError at the first
+    malformed part, after the items before it were yielded.
+    """
+
+    def skip(index: int) -> int:
+        return JSON_WHITESPACE.match(text, index).end()
+
+    def expect(index: int, character: str) -> int:
+        index = skip(index)
+        if text[index : index + 1] != character:
+            raise json.JSONDecodeError(f"Expecting {character!r}", text, index)
+        return index + 1
+
+    index = skip(expect(0, "{"))
+    if text[index : index + 1] == "}":
+        index += 1
+    else:
+        while True:
+            index = skip(index)
+            if text[index : index + 1] != '"':
+                raise json.JSONDecodeError("Expecting property name", text, index)
+            name, index = JSON_DECODER.raw_decode(text, index)
+            index = skip(expect(index, ":"))
+            if name == key and text[index : index + 1] == "[":
+                index = skip(index + 1)
+                if text[index : index + 1] == "]":
+                    index += 1
+                else:
+                    while True:
+                        item, index = JSON_DECODER.raw_decode(text, index)
+                        yield item
+                        index = skip(index)
+                        if text[index : index + 1] != ",":
+                            index = expect(index, "]")
+                            break
+                        index = skip(index + 1)
+            else:
+                _, index = JSON_DECODER.raw_decode(text, index)
+            index = skip(index)
+            if text[index : index + 1] != ",":
+                index = expect(index, "}")
+                break
+            index += 1
+    if skip(index) != len(text):
+        raise json.JSONDecodeError("Extra data", text, skip(index))
@@ -0,0 +1,80 @@
+from typing import NamedTuple
+from collections import Counter
+import threading
+from query.parser import FilterSpec
+
+STYLE_SHAPES = ["any", "eq", "in", "ne", "not_in"]
+BOOLEAN_SHAPES = {None: "any", True: "true", False: "false"}
+
+
+class QueryShape(NamedTuple):
+    """
+    The filter combination of a recommendation query, without its values.
+    """
+
+    style: str
+    vegetarian: str
+    deliver: str
+    time: str
+    paging: str
+    search: str = "none"
+    location: str = "any"
+
+    @property
+    def label(self) -> str:
+        # fields at their default are left out, so older labels stay valid
+        return ",".join(
+            f"{field}={value}"
+            for field, value in zip(self._fields, self)
+            if self._field_defaults.get(field) != value
+        )
+
+    @classmethod
+    def from_label(cls, label: str) -> "QueryShape":
+        values = dict(part.split("=") for part in label.split(","))
+        return cls(
+            *(values.get(field, cls._field_defaults.get(field)) for field in cls._fields)
+        )
+
+
+def get_query_shape(filter_spec: FilterSpec, keyset: bool) -> QueryShape:
+    if not filter_spec.styles:
+        style = "any"
+    elif len(filter_spec.styles) == 1:
+        style = "ne" if filter_spec.style_negation else "eq"
+    else:
+        style = "not_in" if filter_spec.style_negation else "in"
+    return QueryShape(
+        style=style,
+        vegetarian=BOOLEAN_SHAPES[filter_spec.vegetarian],
+        deliver=BOOLEAN_SHAPES[filter_spec.deliver],
+        time=filter_spec.time_context.name if filter_spec.time_context else "any",
+        paging="keyset" if keyset else "offset",
+        search="terms" if filter_spec.terms else "none",
+        location="radius" if filter_spec.near else "any",
+    )
+
+
+class ShapeRecorder:
+    def __init__(self) -> None:
+        """
+        Counts the query shapes sent to the database, so indexes can be
+        chosen for the filter combinations clients actually use.
+        """
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, shape: QueryShape) -> None:
+        with self.lock:
+            self.counts[shape] += 1
+
+    def most_common(self, count: int = None) -> list[tuple[QueryShape, int]]:
+        with self.lock:
+            return self.counts.most_common(count)
+
+    def stats(self, count: int = 5) -> dict:
+        """
+        Label to count of the most common shapes, in the format
+        benchmarks.explain_benchmark --shapes reads.
+        """
+        return {shape.label: total for shape, total in self.most_common(count)}
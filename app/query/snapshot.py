@@ -0,0 +1,536 @@
+from array import array
+import math
+from collections import OrderedDict
+import bisect
+import re
+import threading
+import time
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from query.builder import RecommendationPage
+from query.catalogue import (
+    CatalogueDownloader,
+    CatalogueFile,
+    KeyColumn,
+    VEGETARIAN_FLAG,
+    DELIVERS_FLAG,
+)
+from query.clients import LOGGER
+from query.counts import ResultCounts, facet_counts
+from query.common import (
+    Restaurant,
+    RestaurantTombstone,
+    CatalogueVersion,
+    Style,
+    TimeContext,
+    MINUTES_PER_DAY,
+    local_day_ranges,
+    to_utc_minute,
+)
+from query.geo import GridIndex
+from query.parser import FilterSpec
+from query.search import SearchIndex, positions_bitset
+from query.serialize import RECOMMENDATION_COLUMNS, render_restaurant, with_distance
+
+# RECOMMENDATION_COLUMNS followed by the opening minutes the time filters use
+# and the location lat/lon/radius filters use
+SNAPSHOT_COLUMNS = RECOMMENDATION_COLUMNS + [
+    Restaurant.open_minute,
+    Restaurant.close_minute,
+    Restaurant.latitude,
+    Restaurant.longitude,
+]
+STYLE_CODES = {style.name: style.value for style in Style}
+TIME_BITSET_CACHE_SIZE = 64
+UNKNOWN_MINUTE = -1
+NONZERO_BYTE_PATTERN = re.compile(rb"[^\x00]")
+
+
+def bitset(flags: list[bool]) -> int:
+    """
+    Packs flags into an int whose bit i is flags[i].
+    """
+    return int("".join("1" if flag else "0" for flag in reversed(flags)) or "0", 2)
+
+
+def snapshot_key(row: tuple) -> tuple[str, str]:
+    return row[0], row[2]
+
+
+class RestaurantSnapshot:
+    def __init__(
+        self,
+        version: int,
+        keys,
+        fragments,
+        style_codes,
+        vegetarian,
+        delivers,
+        open_minutes,
+        close_minutes,
+        latitudes,
+        longitudes,
+        rows: list[tuple] = None,
+    ) -> None:
+        """
+        Immutable columnar copy of the restaurants table that answers
+        recommendation queries in process. Styles are small int codes, the
+        boolean columns and every style are bitsets over the row positions
+        and a filter spec is evaluated with integer AND/OR; time filters are
+        bitsets computed from the minute arrays and cached per minute.
+
+        Every column is a sequence over the rows in (name, address) order;
+        lists when built from database rows, views over a memory-mapped file
+        when opened from a catalogue.
+
+        Args:
+            version (int): The catalogue_version the rows reflect.
+            keys: (name, address) of every row, sorted.
+            fragments: Rendered JSON of every row.
+            style_codes: STYLE_CODES value of every row, 0 if unknown.
+            vegetarian: Vegetarian flag of every row.
+            delivers: Delivers flag of every row.
+            open_minutes: UTC opening minute of every row, or UNKNOWN_MINUTE.
+            close_minutes: UTC closing minute of every row, or UNKNOWN_MINUTE.
+            latitudes: Latitude of every row, NaN if unknown.
+            longitudes: Longitude of every row, NaN if unknown.
+            rows (list[tuple]): The SNAPSHOT_COLUMNS rows, kept by from_rows
+                so apply_changes can rebuild the snapshot.
+        """
+        self.version = version
+        self.keys = keys
+        self.fragments = fragments
+        self.style_codes = style_codes
+        self.vegetarian = vegetarian
+        self.delivers = delivers
+        self.open_minutes = open_minutes
+        self.close_minutes = close_minutes
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.rows = rows
+        self.style_bits = {
+            code: bitset([style_code == code for style_code in style_codes])
+            for code in STYLE_CODES.values()
+        }
+        self.vegetarian_bits = bitset(vegetarian)
+        self.delivers_bits = bitset(delivers)
+        self.all_bits = (1 << len(keys)) - 1
+        self.time_bits = OrderedDict()
+        self.lock = threading.Lock()
+        self._search_index = None
+        self._grid_index = None
+
+    @classmethod
+    def from_rows(
+        cls, version: int, rows: list[tuple], fragments: list = None
+    ) -> "RestaurantSnapshot":
+        """
+        Builds a snapshot from SNAPSHOT_COLUMNS rows in any order, rendering
+        the rows whose entry in fragments is missing or None.
+        """
+        order = sorted(range(len(rows)), key=lambda index: snapshot_key(rows[index]))
+        fragments = fragments or [None] * len(rows)
+        rows = [rows[index] for index in order]
+        fragments = [fragments[index] for index in order]
+        return cls(
+            version,
+            keys=[snapshot_key(row) for row in rows],
+            fragments=[
+                fragment or render_restaurant(row[:7])
+                for row, fragment in zip(rows, fragments)
+            ],
+            style_codes=[STYLE_CODES.get(row[1], 0) for row in rows],
+            vegetarian=[bool(row[5]) for row in rows],
+            delivers=[bool(row[6]) for row in rows],
+            open_minutes=array(
+                "h", [UNKNOWN_MINUTE if row[7] is None else row[7] for row in rows]
+            ),
+            close_minutes=array(
+                "h", [UNKNOWN_MINUTE if row[8] is None else row[8] for row in rows]
+            ),
+            latitudes=array("d", [math.nan if row[9] is None else row[9] for row in rows]),
+            longitudes=array(
+                "d", [math.nan if row[10] is None else row[10] for row in rows]
+            ),
+            rows=rows,
+        )
+
+    @classmethod
+    def from_catalogue(cls, catalogue: CatalogueFile) -> "RestaurantSnapshot":
+        """
+        Builds a snapshot over a mapped catalogue file. Only the bitsets are
+        built in memory; keys, fragments and minutes are read from the file.
+        """
+        flags = catalogue.columns["flags"]
+        return cls(
+            catalogue.version,
+            keys=KeyColumn(catalogue.strings("name"), catalogue.strings("address")),
+            fragments=catalogue.strings("fragment"),
+            style_codes=catalogue.columns["style_codes"],
+            vegetarian=[flag & VEGETARIAN_FLAG for flag in flags],
+            delivers=[flag & DELIVERS_FLAG for flag in flags],
+            open_minutes=catalogue.columns["open_minutes"],
+            close_minutes=catalogue.columns["close_minutes"],
+            latitudes=catalogue.columns["latitudes"],
+            longitudes=catalogue.columns["longitudes"],
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _open_at(self, minute: int) -> list[bool]:
+        # same two day axis as common.opening_hours_range
+        flags = []
+        for open_minute, close_minute in zip(self.open_minutes, self.close_minutes):
+            if open_minute == UNKNOWN_MINUTE or close_minute == UNKNOWN_MINUTE:
+                flags.append(False)
+                continue
+            if close_minute <= open_minute:
+                close_minute += MINUTES_PER_DAY
+            flags.append(
+                open_minute <= minute < close_minute
+                or open_minute <= minute + MINUTES_PER_DAY < close_minute
+            )
+        return flags
+
+    def _time_bitset(self, time_context: TimeContext, minute: int, timezone: str) -> int:
+        ranges = None
+        if time_context in (TimeContext.after, TimeContext.before):
+            ranges = tuple(local_day_ranges(time_context, minute, timezone))
+        key = (time_context, minute, ranges)
+        with self.lock:
+            if key in self.time_bits:
+                self.time_bits.move_to_end(key)
+                return self.time_bits[key]
+        if time_context == TimeContext.by:
+            flags = self._open_at(minute)
+        elif time_context == TimeContext.at:
+            flags = [open_minute == minute for open_minute in self.open_minutes]
+        else:
+            flags = [
+                any(start <= open_minute < end for start, end in ranges)
+                for open_minute in self.open_minutes
+            ]
+        bits = bitset(flags)
+        with self.lock:
+            self.time_bits[key] = bits
+            while len(self.time_bits) > TIME_BITSET_CACHE_SIZE:
+                self.time_bits.popitem(last=False)
+        return bits
+
+    def match(self, filter_spec: FilterSpec) -> int:
+        """
+        Bitset of the rows matching the filter spec, with the semantics of
+        builder.build_restaurant_query.
+        """
+        bits = self.all_bits
+        if filter_spec.styles:
+            styles = 0
+            for style in filter_spec.styles:
+                styles |= self.style_bits.get(STYLE_CODES.get(style), 0)
+            bits &= ~styles if filter_spec.style_negation else styles
+        if filter_spec.vegetarian is not None:
+            bits &= self.vegetarian_bits if filter_spec.vegetarian else ~self.vegetarian_bits
+        if filter_spec.deliver is not None:
+            bits &= self.delivers_bits if filter_spec.deliver else ~self.delivers_bits
+        if filter_spec.time_context:
+            minute = to_utc_minute(filter_spec.time, filter_spec.timezone)
+            bits &= self._time_bitset(filter_spec.time_context, minute, filter_spec.timezone)
+        return bits
+
+    def search_index(self) -> SearchIndex:
+        # built by the first search, most snapshots never need one
+        with self.lock:
+            if self._search_index is None:
+                self._search_index = SearchIndex(
+                    [key[0] for key in self.keys],
+                    [key[1] for key in self.keys],
+                )
+            return self._search_index
+
+    def grid_index(self) -> GridIndex:
+        with self.lock:
+            if self._grid_index is None:
+                self._grid_index = GridIndex(self.latitudes, self.longitudes)
+            return self._grid_index
+
+    def _positions(self, bits: int, skip: int, count: int) -> list[int]:
+        """
+        Positions of the set bits of bits, after skipping the first skip.
+        """
+        # the regex skips runs of zero bytes in C, only set bits cost Python
+        data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+        positions = []
+        for match in NONZERO_BYTE_PATTERN.finditer(data):
+            byte = data[match.start()]
+            while byte:
+                lowest = byte & -byte
+                byte ^= lowest
+                if skip:
+                    skip -= 1
+                    continue
+                positions.append(match.start() * 8 + lowest.bit_length() - 1)
+                if len(positions) == count:
+                    return positions
+        return positions
+
+    def page(
+        self,
+        filter_spec: FilterSpec,
+        page_number: int,
+        page_size: int,
+        after: tuple = None,
+    ) -> RecommendationPage:
+        """
+        Same contract as builder.paginated_query_restaurants. Rows are in
+        code point order of (name, address), which can differ from the
+        database collation for non-ASCII names.
+        """
+        bits = self.match(filter_spec)
+        skip = (page_number - 1) * page_size
+        if filter_spec.near:
+            return self._near_page(filter_spec, bits, skip, page_size, after)
+        if filter_spec.terms:
+            levels = self.search_index().search(filter_spec.terms).score_levels(bits)
+        else:
+            levels = [(None, bits)]
+        if after is not None:
+            start = bisect.bisect_right(self.keys, tuple(after[:2]))
+            last_score = after[2] if filter_spec.terms else None
+            levels = [
+                (score, rows >> start << start if score == last_score else rows)
+                for score, rows in levels
+                if last_score is None or score <= last_score
+            ]
+            skip = 0
+
+        positions = []
+        for score, rows in levels:
+            for position in self._positions(rows, skip, page_size - len(positions)):
+                positions.append((score, position))
+            skip = max(0, skip - rows.bit_count())
+            if len(positions) == page_size:
+                break
+        last_key = None
+        if positions:
+            score, position = positions[-1]
+            last_key = self.keys[position]
+            if filter_spec.terms:
+                last_key += (score,)
+        return RecommendationPage(
+            fragments=tuple(self.fragments[position] for _, position in positions),
+            last_key=last_key,
+        )
+
+    def counts(self, filter_spec: FilterSpec) -> ResultCounts:
+        """
+        Same contract as counts.get_result_counts, but always exact: the
+        facets are a popcount of the matches ANDed with each column bitset.
+        """
+        bits = self.match(filter_spec)
+        if filter_spec.near:
+            found = self.grid_index().within(filter_spec.near)
+            bits &= positions_bitset((position for _, position in found), len(self))
+        total = bits.bit_count()
+        styles = {
+            style: (bits & self.style_bits[code]).bit_count()
+            for style, code in STYLE_CODES.items()
+        }
+        facets = facet_counts(
+            total,
+            styles,
+            (bits & self.vegetarian_bits).bit_count(),
+            (bits & self.delivers_bits).bit_count(),
+        )
+        return ResultCounts(total, facets, estimated=False)
+
+    def _near_page(
+        self, filter_spec: FilterSpec, bits: int, skip: int, page_size: int, after: tuple
+    ) -> RecommendationPage:
+        """
+        The rows in bits within the filter's circle, nearest first and then
+        by key, as builder.build_restaurant_query orders them.
+        """
+        found = self.grid_index().within(filter_spec.near)
+        # one AND over the candidates instead of a bit test per candidate
+        candidates = positions_bitset((position for _, position in found), len(self))
+        matched = set(self._positions(candidates & bits, 0, len(found)))
+        found = [(distance, position) for distance, position in found if position in matched]
+        if after is not None:
+            # positions are in key order, so (distance, position) compares
+            # like (distance, name, address)
+            start = bisect.bisect_right(self.keys, tuple(after[:2]))
+            skip = bisect.bisect_left(found, (after[2], start))
+        found = found[skip : skip + page_size]
+        last_key = None
+        if found:
+            distance, position = found[-1]
+            last_key = self.keys[position] + (distance,)
+        return RecommendationPage(
+            fragments=tuple(
+                with_distance(self.fragments[position], distance)
+                for distance, position in found
+            ),
+            last_key=last_key,
+        )
+
+    def apply_changes(
+        self, version: int, changed_rows: list[tuple], deleted_keys: list[tuple]
+    ) -> "RestaurantSnapshot":
+        """
+        Returns a snapshot at version with the changes since this one applied.
+        Only snapshots built by from_rows can be changed.
+
+        Args:
+            version (int): The catalogue_version the changes lead to.
+            changed_rows (list[tuple]): SNAPSHOT_COLUMNS rows followed by
+                their change_version.
+            deleted_keys (list[tuple]): (name, address, change_version)
+                tombstones.
+        """
+        latest = {}
+        for row in changed_rows:
+            key = snapshot_key(row)
+            if key not in latest or latest[key][0] < row[-1]:
+                latest[key] = (row[-1], tuple(row[:-1]))
+        for name, address, change_version in deleted_keys:
+            key = (name, address)
+            if key not in latest or latest[key][0] < change_version:
+                latest[key] = (change_version, None)
+
+        rows = []
+        fragments = []
+        for key, row, fragment in zip(self.keys, self.rows, self.fragments):
+            if key not in latest:
+                rows.append(row)
+                fragments.append(fragment)
+        for _, row in latest.values():
+            if row is not None:
+                rows.append(row)
+                fragments.append(None)
+        return RestaurantSnapshot.from_rows(version, rows, fragments)
+
+
+def get_catalogue_version(session: Session) -> int:
+    version = session.scalar(
+        select(CatalogueVersion.version).where(CatalogueVersion.id == 1)
+    )
+    return version or 0
+
+
+def load_snapshot(session: Session) -> RestaurantSnapshot:
+    # the version is read first: rows written meanwhile are loaded again by
+    # the next refresh, and applying a change twice is harmless
+    version = get_catalogue_version(session)
+    rows = session.execute(select(*SNAPSHOT_COLUMNS)).all()
+    return RestaurantSnapshot.from_rows(version, [tuple(row) for row in rows])
+
+
+def refresh_snapshot(session: Session, snapshot: RestaurantSnapshot) -> RestaurantSnapshot:
+    version = get_catalogue_version(session)
+    if version == snapshot.version:
+        return snapshot
+    changed_rows = session.execute(
+        select(*SNAPSHOT_COLUMNS, Restaurant.change_version).where(
+            Restaurant.change_version > snapshot.version
+        )
+    ).all()
+    deleted_keys = session.execute(
+        select(
+            RestaurantTombstone.name,
+            RestaurantTombstone.address,
+            RestaurantTombstone.change_version,
+        ).where(RestaurantTombstone.change_version > snapshot.version)
+    ).all()
+    return snapshot.apply_changes(version, changed_rows, deleted_keys)
+
+
+class SnapshotStore:
+    def __init__(self, refresh_seconds: float, clock=time.monotonic) -> None:
+        """
+        Keeps the current snapshot across warm invocations. The first call
+        loads the whole table; later calls check the catalogue version at
+        most every refresh_seconds and load only the rows changed since.
+
+        Args:
+            refresh_seconds (float): Seconds between catalogue version checks.
+            clock: Monotonic time source, replaceable in tests.
+        """
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self.snapshot = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+        # off when a long running process refreshes in the background instead
+        self.refresh_in_requests = True
+
+    def load(self, session: Session) -> RestaurantSnapshot:
+        return load_snapshot(session)
+
+    def refresh(self, session: Session, snapshot: RestaurantSnapshot) -> RestaurantSnapshot:
+        return refresh_snapshot(session, snapshot)
+
+    def get(self, session: Session) -> RestaurantSnapshot:
+        # while another caller refreshes, serve the current snapshot rather
+        # than wait for it; only the first load blocks
+        if not self.lock.acquire(blocking=self.snapshot is None):
+            return self.snapshot
+        try:
+            now = self.clock()
+            if self.snapshot is None:
+                self.snapshot = self.load(session)
+                self.checked_at = now
+            elif self.refresh_in_requests and now - self.checked_at >= self.refresh_seconds:
+                self.snapshot = self.refresh(session, self.snapshot)
+                self.checked_at = now
+            return self.snapshot
+        finally:
+            self.lock.release()
+
+
+class CatalogueSnapshotStore(SnapshotStore):
+    def __init__(
+        self, downloader: CatalogueDownloader, refresh_seconds: float, clock=time.monotonic
+    ) -> None:
+        """
+        SnapshotStore over the catalogue files the ETL exports to S3, so
+        /recommend doesn't read the database. Until a catalogue has been
+        exported the snapshot is loaded from the database instead.
+
+        Args:
+            downloader (CatalogueDownloader): Source of the catalogue files.
+            refresh_seconds (float): Seconds between LATEST pointer checks.
+            clock: Monotonic time source, replaceable in tests.
+        """
+        super().__init__(refresh_seconds, clock)
+        self.downloader = downloader
+
+    def load(self, session: Session) -> RestaurantSnapshot:
+        catalogue = self.downloader.refresh()
+        if catalogue is None:
+            LOGGER.warning("No catalogue exported yet, loading from the database")
+            return load_snapshot(session)
+        return RestaurantSnapshot.from_catalogue(catalogue)
+
+    def refresh(self, session: Session, snapshot: RestaurantSnapshot) -> RestaurantSnapshot:
+        catalogue = self.downloader.refresh()
+        if catalogue is None or catalogue.version == snapshot.version:
+            return snapshot
+        return RestaurantSnapshot.from_catalogue(catalogue)
+
+    def refresh_from_catalogue(self) -> bool:
+        """
+        Downloads a newer catalogue, if any, and swaps it in for the
+        current snapshot, which requests keep reading meanwhile. Blocks on
+        S3: the ASGI server calls it from a thread. Returns whether the
+        snapshot changed.
+        """
+        catalogue = self.downloader.refresh()
+        current = self.snapshot
+        if catalogue is None or (current is not None and catalogue.version == current.version):
+            return False
+        snapshot = RestaurantSnapshot.from_catalogue(catalogue)
+        with self.lock:
+            self.snapshot = snapshot
+            self.checked_at = self.clock()
+        return True
@@ -1,4 +1,16 @@
-from query.common import Style, Restaurant, get_database_time
+from query.common import (
+    Style,
+    Restaurant,
+    get_database_time,
+    is_valid_timezone,
+    normalize_time,
+    to_24_hour_format,
+    to_utc_minute,
+)
+from query.geo import NO_LOCATION, parse_location
+import base64
+import binascii
+import json
 
 
 def is_valid_create_restaurant(record: dict):
@@ -19,24 +31,34 @@ def is_valid_create_restaurant(record: dict):
     style = record["style"]
     if style.lower() not in Style._member_names_:
         return False
-    return True
+    return parse_location(record.get("latitude"), record.get("longitude")) is not None
 
 
-def record_to_create_restuarant(record: dict) -> Restaurant:
+def record_to_restaurant_row(record: dict) -> dict:
+    """
+    Column values of a valid create record, as used by the bulk loader.
+    """
     timezone = record.get("timezone")
-    open_hour = get_database_time(record.get("openHour"), timezone)
-    close_hour = get_database_time(record.get("closeHour"), timezone)
-    return Restaurant(
+    latitude, longitude = parse_location(record.get("latitude"), record.get("longitude"))
+    return dict(
         name=record.get("name"),
         style=record.get("style").lower(),
         address=record.get("address"),
-        open_hour=open_hour,
-        close_hour=close_hour,
+        open_hour=get_database_time(record.get("openHour"), timezone),
+        close_hour=get_database_time(record.get("closeHour"), timezone),
+        open_minute=to_utc_minute(to_24_hour_format(record.get("openHour")), timezone),
+        close_minute=to_utc_minute(to_24_hour_format(record.get("closeHour")), timezone),
         vegetarian=str(record.get("vegetarian").lower()) == "true",
         delivers=str(record.get("delivers").lower()) == "true",
+        latitude=latitude,
+        longitude=longitude,
     )
 
 
+def record_to_create_restuarant(record: dict) -> Restaurant:
+    return Restaurant(**record_to_restaurant_row(record))
+
+
 def is_valid_delete_restaurant(record: dict):
     required_keys = ["name", "address"]
     for key in required_keys:
@@ -49,7 +71,94 @@ def record_to_delete_restuarant(record: dict) -> Restaurant:
     return Restaurant(name=record.get("name"), address=record.get("address"))
 
 
+def record_to_update_row(record: dict) -> dict:
+    """
+    Key columns plus only the columns the update record sets; hours are set
+    only when the record also carries a timezone.
+    """
+    row = dict(name=record.get("name"), address=record.get("address"))
+    if record.get("style"):
+        row["style"] = record["style"].lower()
+    timezone = record.get("timezone")
+    if timezone:
+        if record.get("openHour"):
+            row["open_hour"] = get_database_time(record["openHour"], timezone)
+            row["open_minute"] = to_utc_minute(to_24_hour_format(record["openHour"]), timezone)
+        if record.get("closeHour"):
+            row["close_hour"] = get_database_time(record["closeHour"], timezone)
+            row["close_minute"] = to_utc_minute(
+                to_24_hour_format(record["closeHour"]), timezone
+            )
+    if record.get("vegetarian"):
+        row["vegetarian"] = str(record["vegetarian"].lower()) == "true"
+    if record.get("delivers"):
+        row["delivers"] = str(record["delivers"].lower()) == "true"
+    location = parse_location(record.get("latitude"), record.get("longitude"))
+    if location and location != NO_LOCATION:
+        row["latitude"], row["longitude"] = location
+    return row
+
+
+# columns an update record may set besides its (name, address) key; empty
+# values, e.g. blank fields of an update file, leave the column as it is
+UPDATE_FIELDS = ["style", "openHour", "closeHour", "vegetarian", "delivers", "timezone"]
+
+
 def is_valid_update_restaurant(record: dict):
-    if len(record) <= 2:
+    """
+    Checks that record_to_update_row can convert the record and that it
+    changes something: every field it sets must parse, and hours need a
+    timezone.
+    """
+    if not (record.get("name") and record.get("address")):
+        return False
+    fields = {field: record.get(field) for field in UPDATE_FIELDS if record.get(field)}
+    if any(not isinstance(value, str) for value in fields.values()):
         return False
-    return is_valid_delete_restaurant(record)
+    location = parse_location(record.get("latitude"), record.get("longitude"))
+    if location is None:
+        return False
+    if not fields and location == NO_LOCATION:
+        return False
+    if "style" in fields and fields["style"].lower() not in Style._member_names_:
+        return False
+    for flag in ["vegetarian", "delivers"]:
+        if flag in fields and fields[flag].lower() not in ("true", "false"):
+            return False
+    hours = [fields[hour] for hour in ["openHour", "closeHour"] if hour in fields]
+    if "timezone" in fields and not is_valid_timezone(fields["timezone"]):
+        return False
+    if hours and "timezone" not in fields:
+        return False
+    return all(normalize_time(hour) is not None for hour in hours)
+
+
+def encode_page_cursor(last_key: tuple, fingerprint: str) -> str:
+    """
+    Opaque nextPage token holding the (name, address) key of the last row
+    returned, its search score if the query searched, and the fingerprint of
+    the filters that produced the page.
+    """
+    payload = json.dumps(
+        [last_key[0], last_key[1], fingerprint, *last_key[2:]], separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_page_cursor(token: str):
+    """
+    Returns a dict with the last key and fingerprint, or None if the token
+    was not produced by encode_page_cursor.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        name, address, fingerprint, *score = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+    if not all(isinstance(value, str) for value in (name, address, fingerprint)):
+        return None
+    if len(score) > 1 or not all(
+        isinstance(value, int) and not isinstance(value, bool) for value in score
+    ):
+        return None
+    return {"last_key": (name, address, *score), "fingerprint": fingerprint}
@@ -0,0 +1,130 @@
+from asgi import ApiServer, request_event
+from query.snapshot import CatalogueSnapshotStore
+from unittest import mock
+import asyncio
+import json
+import threading
+import unittest
+
+
+def http_scope(method: str, path: str, query_string: bytes = b"", headers=()) -> dict:
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": list(headers),
+    }
+
+
+class TestAsgiModule(unittest.TestCase):
+    def call(self, server: ApiServer, scope: dict, chunks: list[bytes]) -> list[dict]:
+        messages = [
+            {"type": "http.request", "body": chunk, "more_body": index < len(chunks) - 1}
+            for index, chunk in enumerate(chunks)
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(server(scope, receive, send))
+        return sent
+
+    def test_request_event_matches_api_gateway(self):
+        scope = http_scope(
+            "GET",
+            "/recommend",
+            b"query=italian+by+8pm&requestTime=2024-12-29T19%3A00%3A00-06%3A00",
+            [(b"x-auth-api-key", b"secret")],
+        )
+        event = request_event(scope, b"")
+        self.assertEqual(
+            event["queryStringParameters"],
+            {"query": "italian by 8pm", "requestTime": "2024-12-29T19:00:00-06:00"},
+        )
+        self.assertEqual(event["headers"].get("X-AUTH-API-KEY"), "secret")
+        self.assertIsNone(event["body"])
+        event = request_event(http_scope("POST", "/restaurant"), b'{"records": []}')
+        self.assertIsNone(event["queryStringParameters"])
+        self.assertEqual(event["body"], '{"records": []}')
+        self.assertEqual(json.loads(json.dumps(event))["headers"], {})
+
+    def test_responds_with_handler_response(self):
+        events = []
+
+        async def handler(event, context):
+            events.append(event)
+            return {"statusCode": 201, "body": json.dumps({"id": context.aws_request_id})}
+
+        sent = self.call(
+            ApiServer(handler), http_scope("POST", "/restaurant"), [b'{"rec', b'ords": []}']
+        )
+        self.assertEqual(events[0]["body"], '{"records": []}')
+        start, body = sent
+        self.assertEqual(start["status"], 201)
+        headers = dict(start["headers"])
+        self.assertEqual(headers[b"content-type"], b"application/json")
+        self.assertEqual(json.loads(body["body"])["id"], headers[b"x-request-id"].decode())
+
+    def test_rejects_large_body_and_answers_errors(self):
+        async def failing(event, context):
+            raise RuntimeError("connection refused")
+
+        server = ApiServer(failing)
+        with mock.patch("asgi.SERVER_MAX_BODY_BYTES", 4):
+            sent = self.call(server, http_scope("POST", "/restaurant"), [b"123", b"45"])
+        self.assertEqual(sent[0]["status"], 413)
+        sent = self.call(server, http_scope("GET", "/recommend"), [b""])
+        self.assertEqual(sent[0]["status"], 500)
+        self.assertIn("requestId", json.loads(sent[1]["body"])["message"])
+
+    def test_catalogue_refreshes_off_the_event_loop(self):
+        catalogue = mock.Mock(version=5)
+        threads = []
+        downloader = mock.Mock()
+        downloader.refresh.side_effect = (
+            lambda: threads.append(threading.current_thread()) or catalogue
+        )
+        store = CatalogueSnapshotStore(downloader, refresh_seconds=0.01)
+
+        class Session:
+            def __init__(self, engine):
+                pass
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                pass
+
+        async def serve():
+            server = ApiServer()
+            await server.startup()
+            first = store.snapshot
+            # requests only read the snapshot
+            self.assertIs(store.get(None), first)
+            catalogue.version = 6
+            await asyncio.sleep(0.1)
+            server.refresher.cancel()
+            return first, threading.current_thread()
+
+        with mock.patch("lambda_function.RECOMMENDATION_SOURCE", "catalogue"), mock.patch(
+            "lambda_function.get_snapshot_store", return_value=store
+        ), mock.patch("lambda_function.create_request_history_sink"), mock.patch(
+            "asgi.RESOURCES"
+        ), mock.patch("asgi.get_async_engine"), mock.patch("asgi.AsyncSession", Session), mock.patch(
+            "query.snapshot.RestaurantSnapshot.from_catalogue",
+            side_effect=lambda catalogue: mock.Mock(version=catalogue.version),
+        ):
+            first, loop_thread = asyncio.run(serve())
+        self.assertEqual((first.version, store.snapshot.version), (5, 6))
+        self.assertGreater(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+from query.audit import EnvelopeEncryptor, RequestHistorySink, decrypt_data
+from query.common import RequestType
+from unittest import mock
+import io
+import json
+import unittest
+import pendulum
+import time
+
+DATA_KEY = bytes(range(32))
+
+
+class InMemoryKms:
+    def __init__(self):
+        self.generate_calls = 0
+
+    def generate_data_key(self, KeyId, KeySpec):
+        self.generate_calls += 1
+        return {"Plaintext": DATA_KEY, "CiphertextBlob": b"wrapped:" + KeyId.encode()}
+
+    def decrypt(self, CiphertextBlob):
+        return {"Plaintext": DATA_KEY}
+
+
+class TestAuditModule(unittest.TestCase):
+    def setUp(self):
+        self.kms = InMemoryKms()
+        self.rows = []
+        self.request_time = pendulum.now(tz="UTC")
+
+    def make_sink(self, **kwargs):
+        return RequestHistorySink(
+            EnvelopeEncryptor(self.kms, "key-arn"),
+            self.rows.extend,
+            **{"batch_size": 2, "flush_interval": 0.01, "start_worker": False, **kwargs},
+        )
+
+    def test_batches_with_one_data_key_per_batch(self):
+        sink = self.make_sink()
+        for index in range(3):
+            sink.record(f"request{index}", f"response{index}", RequestType.Recommend, self.request_time)
+        # buffered until flushed, however many
+        self.assertEqual(self.rows, [])
+
+        self.assertEqual(sink.flush(), 3)
+        self.assertEqual(len(self.rows), 3)
+        self.assertEqual(self.kms.generate_calls, 2)
+
+    def test_failed_batch_stays_buffered(self):
+        failures = [RuntimeError("database unavailable")]
+
+        def writer(rows):
+            if failures:
+                raise failures.pop()
+            self.rows.extend(rows)
+
+        sink = RequestHistorySink(
+            EnvelopeEncryptor(self.kms, "key-arn"), writer, 2, 0.01, start_worker=False
+        )
+        sink.record("request", "response", RequestType.Recommend, self.request_time)
+        with self.assertRaises(RuntimeError):
+            sink.flush()
+        self.assertEqual(sink.flush(), 1)
+        # encrypted once, on the write that succeeded
+        self.assertEqual(decrypt_data(self.kms, self.rows[0]["request"]), "request")
+
+    def test_buffer_is_bounded(self):
+        def writer(rows):
+            raise RuntimeError("database unavailable")
+
+        sink = RequestHistorySink(
+            EnvelopeEncryptor(self.kms, "key-arn"), writer, 2, 0.01, 3, start_worker=False
+        )
+        for index in range(5):
+            sink.record(f"request{index}", "response", RequestType.Recommend, self.request_time)
+        self.assertEqual(sink.queue.qsize(), 3)
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                sink.flush()
+        # failed writes put their batch back without growing the buffer
+        self.assertEqual(sink.queue.qsize(), 3)
+        sink.writer = self.rows.extend
+        self.assertEqual(sink.flush(), 3)
+        self.assertEqual(
+            sorted(decrypt_data(self.kms, row["request"]) for row in self.rows),
+            ["request0", "request1", "request2"],
+        )
+
+    def test_flush_emits_its_own_metrics(self):
+        def writer(rows):
+            raise RuntimeError("database unavailable")
+
+        sink = RequestHistorySink(
+            EnvelopeEncryptor(self.kms, "key-arn"), writer, 2, 0.01, start_worker=False
+        )
+        sink.record("request", "response", RequestType.Recommend, self.request_time)
+        with mock.patch("query.metrics.METRICS_ENABLED", True), mock.patch(
+            "sys.stdout", new_callable=io.StringIO
+        ) as stdout:
+            with self.assertRaises(RuntimeError):
+                sink.flush()
+        # written by the caller's flush, not a worker the Lambda freezes
+        (line,) = stdout.getvalue().splitlines()
+        emf = json.loads(line)
+        self.assertEqual(emf["Operation"], "RequestHistory")
+        self.assertEqual((emf["records"], emf["errors"]), (1, 1))
+
+    def test_encrypted_round_trip(self):
+        sink = self.make_sink(batch_size=1)
+        sink.record('{"path": "/recommend"}', '{"statusCode": 200}', RequestType.Recommend, self.request_time)
+        sink.flush()
+        row = self.rows[0]
+        self.assertNotIn("recommend", row["request"])
+        self.assertEqual(decrypt_data(self.kms, row["request"]), '{"path": "/recommend"}')
+        self.assertEqual(decrypt_data(self.kms, row["response"]), '{"statusCode": 200}')
+        self.assertEqual(row["request_type"], RequestType.Recommend)
+
+    def test_background_worker_flushes(self):
+        sink = self.make_sink(batch_size=10, start_worker=True)
+        sink.record("request", "response", RequestType.NotImplemented, self.request_time)
+        deadline = time.monotonic() + 2
+        while not self.rows and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.rows), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
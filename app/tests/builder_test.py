@@ -1,11 +1,41 @@
-from query.builder import (
+from benchmarks.parser_benchmark import (
     filter_negation_is_present,
     get_style_filter,
     get_boolean_filter,
 )
+from query.builder import (
+    add_time_filter,
+    bulk_update_restaurants,
+    upsert_record_stream,
+    build_batch_query,
+    paginated_query_restaurants,
+    paginated_query_restaurants_batch,
+    RECOMMENDATION_CACHE,
+    UpsertResult,
+)
+from query.common import Restaurant, TimeContext
+from query.geo import GeoFilter
+from query.parser import FilterSpec
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query, Session
+from query.utils import record_to_restaurant_row
+from benchmarks.catalogue import generate_records
+from query.serialize import iter_array_items
+from unittest import mock
+import datetime
+import json
 import unittest
 
 
+def time_filter_sql(time_context, time, timezone):
+    spec = FilterSpec((), True, None, None, time_context, time, timezone)
+    compiled = add_time_filter(Query(Restaurant), spec).statement.compile(
+        dialect=postgresql.dialect()
+    )
+    return str(compiled).split("WHERE")[1], compiled.params
+
+
 class TestBuilderModule(unittest.TestCase):
     def test_filter_negation_is_present(self):
         self.assertEqual(
@@ -50,6 +80,125 @@ class TestBuilderModule(unittest.TestCase):
         filter = get_style_filter("Find an restaurant open at 8 AM")
         self.assertEqual(filter, (True, []))
 
+    def test_open_by_checks_both_days_of_the_range(self):
+        sql, params = time_filter_sql(TimeContext.by, "20:00", "America/Chicago")
+        self.assertIn("int4range(restaurants.open_minute, CASE WHEN", sql)
+        self.assertIn("restaurants.close_minute + 1440", sql)
+        self.assertEqual(sorted(params.values()), [2 * 60, 2 * 60 + 1440])
+
+    def test_opening_time_compares_the_opening_minute(self):
+        sql, params = time_filter_sql(TimeContext.after, "22:00", "+05:30")
+        self.assertIn("restaurants.open_minute >=", sql)
+        # until the local midnight, 18:30 UTC
+        self.assertEqual(list(params.values()), [16 * 60 + 31, 18 * 60 + 30])
+        sql, params = time_filter_sql(TimeContext.at, "22:00", "+05:30")
+        self.assertEqual(list(params.values()), [16 * 60 + 30])
+
+    def test_opening_time_stays_within_the_local_day(self):
+        # Chicago's day is 06:00-06:00 UTC: after 10pm is 04:00 UTC and must
+        # not match the 8am openings at 14:00 UTC
+        sql, params = time_filter_sql(TimeContext.after, "22:00", "America/Chicago")
+        self.assertEqual(list(params.values()), [4 * 60 + 1, 6 * 60])
+        sql, params = time_filter_sql(TimeContext.before, "22:00", "America/Chicago")
+        self.assertIn(" OR ", sql)
+        self.assertEqual(list(params.values()), [6 * 60, 1440, 0, 4 * 60])
+        sql, params = time_filter_sql(TimeContext.before, "08:00", "America/Chicago")
+        self.assertEqual(list(params.values()), [6 * 60, 14 * 60])
+        sql, _ = time_filter_sql(TimeContext.before, "00:00", "America/Chicago")
+        self.assertIn("false", sql)
+
+    def test_record_stream_writes_batches_and_reports_errors(self):
+        record = {
+            "name": "test",
+            "style": "italian",
+            "address": "address",
+            "openHour": "8 AM",
+            "closeHour": "20:30",
+            "vegetarian": "true",
+            "delivers": "false",
+            "timezone": "UTC",
+        }
+        records = [dict(record, name=f"test{index}") for index in range(7)]
+        records[2] = dict(record, style="thai")
+        records[4] = dict(record, openHour="25:00")
+        records[5] = "not an object"
+        text = json.dumps({"records": records})
+        # the last record is cut off
+        text = text[: text.rindex("{") + 5]
+        batches = []
+
+        def bulk_upsert(session, rows):
+            batches.append([row["name"] for row in rows])
+            return UpsertResult(len(rows), 0, 0)
+
+        with mock.patch("query.builder.bulk_upsert_restaurants", bulk_upsert):
+            result = upsert_record_stream(None, iter_array_items(text, "records"), 2)
+        self.assertEqual(batches, [["test0", "test1"], ["test3"]])
+        self.assertEqual((result.created, result.updated, result.rejected), (3, 0, 3))
+        self.assertEqual([error.index for error in result.errors], [2, 4, 5])
+        self.assertIn("25:00", result.errors[1].message)
+        self.assertIsNotNone(result.source_error)
+
+    def test_update_bumps_the_version_only_when_rows_match(self):
+        rows = [{"name": "test", "address": "address", "style": "korean"}]
+        for existing, expected in [(None, set()), (("test",), {("test", "address")})]:
+            session = mock.Mock()
+            session.execute.return_value.first.return_value = existing
+            session.execute.return_value.__iter__ = lambda self: iter([("test", "address")])
+            with mock.patch("query.builder.bump_catalogue_version", return_value=7) as bump:
+                self.assertEqual(bulk_update_restaurants(session, rows), expected)
+            self.assertEqual(bump.called, existing is not None)
+            session.commit.assert_called_once()
+
+    def test_batch_reads_every_page_in_one_statement(self):
+        engine = create_engine("sqlite://")
+        Restaurant.__table__.create(engine)
+        rows = [record_to_restaurant_row(record) for record in generate_records(300, seed=2)]
+        for row in rows:
+            # SQLite takes times without a zone
+            for key in ["open", "close"]:
+                row[f"{key}_hour"] = datetime.time(*divmod(row[f"{key}_minute"], 60))
+        with engine.begin() as connection:
+            connection.execute(Restaurant.__table__.insert(), rows)
+        everything = FilterSpec((), True, None, None, None, None, None)
+        requests = [
+            (everything._replace(vegetarian=True), 1, None),
+            (everything, 2, None),
+            (everything._replace(styles=("italian",), style_negation=False), 1, None),
+            (everything._replace(deliver=False), 1, ("M", "")),
+            (everything._replace(styles=("thai",), style_negation=False), 1, None),
+        ]
+        RECOMMENDATION_CACHE.invalidate()
+        with Session(engine) as session:
+            expected = [
+                paginated_query_restaurants(session, filter_spec, page_number, 7, after)
+                for filter_spec, page_number, after in requests
+            ]
+            RECOMMENDATION_CACHE.invalidate()
+            # one of them cached
+            paginated_query_restaurants(session, *requests[1][:2], 7)
+            with mock.patch.object(session, "execute", wraps=session.execute) as execute:
+                pages = paginated_query_restaurants_batch(session, requests, 7)
+                statements = execute.call_args_list
+        self.assertEqual(pages, expected)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual([len(page.fragments) for page in pages], [7, 7, 7, 7, 0])
+
+    def test_batch_keeps_ranked_members_in_order(self):
+        everything = FilterSpec((), True, None, None, None, None, None)
+        near = everything._replace(near=GeoFilter(41.88, -87.63, 1000))
+        search = everything._replace(terms=("pizza",))
+        sql = str(
+            build_batch_query(
+                Session(), [(near, 1, None), (search, 1, ("a", "b", 2))], 20
+            ).compile(dialect=postgresql.dialect())
+        )
+        self.assertEqual(sql.count("UNION ALL"), 1)
+        self.assertEqual(sql.count("LIMIT"), 2)
+        self.assertIn("row_number() OVER (ORDER BY CAST(round(", sql)
+        self.assertIn("anon_3.score AS rank", sql)
+        self.assertTrue(sql.endswith("ORDER BY anon_1.batch_index, anon_1.position"))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,52 @@
+from query.cache import ResultCache
+import unittest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCacheModule(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = ResultCache(max_size=2, ttl_seconds=10)
+        self.assertEqual(cache.get("a"), None)
+        cache.put("a", (1, 2))
+        self.assertEqual(cache.get("a"), (1, 2))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResultCache(max_size=2, ttl_seconds=10)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = ResultCache(max_size=2, ttl_seconds=10, clock=clock)
+        cache.put("a", 1)
+        clock.now = 10
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_invalidate_and_disabled(self):
+        cache = ResultCache(max_size=2, ttl_seconds=10)
+        cache.put("a", 1)
+        cache.invalidate()
+        self.assertEqual(cache.get("a"), None)
+
+        disabled = ResultCache(max_size=0, ttl_seconds=10)
+        disabled.put("a", 1)
+        self.assertEqual(disabled.get("a"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
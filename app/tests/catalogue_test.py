@@ -0,0 +1,210 @@
+from benchmarks.catalogue import generate_records
+from etl.export import export_catalogue
+from query.catalogue import (
+    CatalogueDownloader,
+    CatalogueFile,
+    CATALOGUE_FORMAT_VERSION,
+    CATALOGUE_HEADER,
+    catalogue_key,
+    encode_catalogue,
+    read_catalogue_header,
+)
+from query.snapshot import RestaurantSnapshot
+from tests.snapshot_test import random_spec, snapshot_row
+from unittest import mock
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+
+
+class FakeClientError(Exception):
+    def __init__(self, code: str) -> None:
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakePaginator:
+    def __init__(self, s3) -> None:
+        self.s3 = s3
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for key in self.s3.objects if key.startswith(Prefix))
+        yield {"Contents": [{"Key": key} for key in keys]}
+
+
+class FakeS3:
+    def __init__(self) -> None:
+        self.objects = {}
+        self.downloads = []
+        # key -> callables run once after that key is written
+        self.put_hooks = {}
+
+    def etag(self, key: str) -> str:
+        return hashlib.md5(self.objects[key]).hexdigest()
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        if (IfNoneMatch == "*" and Key in self.objects) or (
+            IfMatch and (Key not in self.objects or IfMatch != self.etag(Key))
+        ):
+            raise FakeClientError("PreconditionFailed")
+        self.objects[Key] = bytes(Body)
+        for hook in self.put_hooks.pop(Key, []):
+            hook()
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        if Key not in self.objects:
+            raise FakeClientError("NoSuchKey")
+        if IfNoneMatch == self.etag(Key):
+            raise FakeClientError("304")
+        return {"Body": io.BytesIO(self.objects[Key]), "ETag": self.etag(Key)}
+
+    def download_file(self, Bucket, Key, Filename):
+        self.downloads.append(Key)
+        with open(Filename, "wb") as file:
+            file.write(self.objects[Key])
+
+    def get_paginator(self, operation):
+        return FakePaginator(self)
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete["Objects"]:
+            del self.objects[item["Key"]]
+
+
+class TestCatalogueModule(unittest.TestCase):
+    def setUp(self):
+        records = list(generate_records(300, seed=5, timezones=["UTC", "Asia/Tokyo"]))
+        records[0].update(name="Café Ünïcode", openHour="22:00", closeHour="02:00")
+        rows = [snapshot_row(record) for record in records]
+        # hours unknown
+        rows[1] = rows[1][:7] + (None, None) + rows[1][9:]
+        self.snapshot = RestaurantSnapshot.from_rows(4, rows)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "catalogue.rcat")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, data: bytes) -> str:
+        with open(self.path, "wb") as file:
+            file.write(data)
+        return self.path
+
+    def test_round_trip(self):
+        catalogue = CatalogueFile(self.write(encode_catalogue(self.snapshot)))
+        self.assertEqual(catalogue.version, 4)
+        self.assertEqual(len(catalogue), len(self.snapshot))
+        self.assertEqual(list(catalogue.strings("fragment")), self.snapshot.fragments)
+        self.assertEqual(
+            list(catalogue.columns["open_minutes"]), list(self.snapshot.open_minutes)
+        )
+        snapshot = RestaurantSnapshot.from_catalogue(catalogue)
+        self.assertEqual(list(snapshot.keys), self.snapshot.keys)
+
+    def test_catalogue_snapshot_pages_match(self):
+        snapshot = RestaurantSnapshot.from_catalogue(
+            CatalogueFile(self.write(encode_catalogue(self.snapshot)))
+        )
+        rng = random.Random(11)
+        for _ in range(100):
+            spec = random_spec(rng)
+            self.assertEqual(
+                snapshot.page(spec, 2, 20), self.snapshot.page(spec, 2, 20), spec
+            )
+            after = self.snapshot.keys[rng.randrange(len(self.snapshot))]
+            self.assertEqual(
+                snapshot.page(spec, 1, 20, after),
+                self.snapshot.page(spec, 1, 20, after),
+                spec,
+            )
+
+    def test_rejects_corrupt_truncated_and_unexpected(self):
+        data = encode_catalogue(self.snapshot)
+        corrupt = bytearray(data)
+        corrupt[-1] ^= 0xFF
+        for invalid in [bytes(corrupt), data[:-1], data[: CATALOGUE_HEADER.size - 1]]:
+            with self.assertRaises(ValueError):
+                CatalogueFile(self.write(invalid))
+        with self.assertRaises(ValueError):
+            CatalogueFile(self.write(data), checksum=read_catalogue_header(data).checksum + 1)
+
+    def test_export_and_download_only_new_versions(self):
+        s3 = FakeS3()
+        downloader = CatalogueDownloader(s3, "bucket", "catalogue/", self.directory.name)
+        self.assertIsNone(downloader.refresh())
+
+        with mock.patch("etl.export.load_snapshot", lambda session: self.snapshot), mock.patch(
+            "etl.export.get_catalogue_version", lambda session: self.snapshot.version
+        ):
+            self.assertIsNotNone(export_catalogue(None, s3, "bucket", "catalogue/"))
+            # up to date
+            self.assertIsNone(export_catalogue(None, s3, "bucket", "catalogue/"))
+        self.assertEqual(downloader.refresh().version, 4)
+        self.assertEqual(downloader.refresh().version, 4)
+        self.assertEqual(s3.downloads, [catalogue_key("catalogue/", 4)])
+
+        for version in [5, 6]:
+            snapshot = RestaurantSnapshot.from_rows(version, self.snapshot.rows[1:])
+            with mock.patch("etl.export.load_snapshot", lambda session: snapshot), mock.patch(
+                "etl.export.get_catalogue_version", lambda session: version
+            ):
+                export_catalogue(None, s3, "bucket", "catalogue/")
+        catalogue = downloader.refresh()
+        self.assertEqual((catalogue.version, len(catalogue)), (6, len(self.snapshot) - 1))
+        self.assertEqual(len(s3.downloads), 2)
+        # the previous version is kept for readers still downloading it
+        self.assertEqual(
+            sorted(key for key in s3.objects if key.endswith(".rcat")),
+            [catalogue_key("catalogue/", 5), catalogue_key("catalogue/", 6)],
+        )
+        self.assertEqual(
+            os.listdir(self.directory.name), [os.path.basename(downloader.path(6))]
+        )
+
+    def export(self, s3, version: int):
+        snapshot = RestaurantSnapshot.from_rows(version, self.snapshot.rows)
+        with mock.patch("etl.export.load_snapshot", lambda session: snapshot), mock.patch(
+            "etl.export.get_catalogue_version", lambda session: version
+        ):
+            return export_catalogue(None, s3, "bucket", "catalogue/")
+
+    def test_concurrent_export_never_moves_latest_back(self):
+        s3 = FakeS3()
+        self.export(s3, 4)
+        # a faster export of 7 publishes while 5 is being written
+        s3.put_hooks[catalogue_key("catalogue/", 5)] = [lambda: self.export(s3, 7)]
+        self.assertIsNone(self.export(s3, 5))
+        self.assertEqual(json.loads(s3.objects["catalogue/LATEST"])["version"], 7)
+
+        # an older one published meanwhile is replaced
+        s3.put_hooks[catalogue_key("catalogue/", 9)] = [lambda: self.export(s3, 8)]
+        self.assertEqual(self.export(s3, 9).version, 9)
+        self.assertEqual(json.loads(s3.objects["catalogue/LATEST"])["version"], 9)
+        self.assertEqual(
+            sorted(key for key in s3.objects if key.endswith(".rcat")),
+            [catalogue_key("catalogue/", 8), catalogue_key("catalogue/", 9)],
+        )
+
+    def test_exports_again_in_new_format(self):
+        s3 = FakeS3()
+        data = encode_catalogue(self.snapshot)
+        # a pointer written before format_version existed
+        s3.objects["catalogue/LATEST"] = json.dumps(
+            dict(version=4, key=catalogue_key("catalogue/", 4), checksum=0, size=len(data))
+        ).encode("utf-8")
+        downloader = CatalogueDownloader(s3, "bucket", "catalogue/", self.directory.name)
+        self.assertIsNone(downloader.refresh())
+        with mock.patch("etl.export.load_snapshot", lambda session: self.snapshot), mock.patch(
+            "etl.export.get_catalogue_version", lambda session: self.snapshot.version
+        ):
+            pointer = export_catalogue(None, s3, "bucket", "catalogue/")
+        self.assertEqual(pointer.format_version, CATALOGUE_FORMAT_VERSION)
+        self.assertEqual(downloader.refresh().version, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+from query.clients import (
+    ResourceRegistry,
+    RESOURCES,
+    POOL_METRICS,
+    bind_session,
+    create_pooled_engine,
+    get_session,
+    session_scope,
+)
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import unittest
+
+
+class TestClientsModule(unittest.TestCase):
+    def setUp(self):
+        # the registry is process wide: put back whatever engine was there
+        self.saved_engine = RESOURCES.instances.get("engine")
+
+    def tearDown(self):
+        engine = RESOURCES.instances.pop("engine", None)
+        if engine is not None and engine is not self.saved_engine:
+            engine.dispose()
+        if self.saved_engine is not None:
+            RESOURCES.override("engine", self.saved_engine)
+
+    def test_factory_runs_once_on_first_use(self):
+        registry = ResourceRegistry()
+        calls = []
+        registry.register("client", lambda: calls.append(1) or object())
+        self.assertEqual(registry.initialized(), [])
+        first = registry.get("client")
+        self.assertIs(registry.get("client"), first)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(registry.initialized(), ["client"])
+
+    def test_override_skips_factory(self):
+        registry = ResourceRegistry()
+        registry.register("client", lambda: self.fail("factory should not run"))
+        stub = object()
+        registry.override("client", stub)
+        self.assertIs(registry.get("client"), stub)
+
+    def test_session_scope_rolls_back_and_replaces_session(self):
+        RESOURCES.override("engine", create_pooled_engine("sqlite://"))
+        with session_scope() as session:
+            self.assertIs(get_session(), session)
+            session.execute(text("CREATE TABLE scoped (id INTEGER)"))
+            session.commit()
+        checkouts = POOL_METRICS.stats()["checkouts"]
+        with self.assertRaises(RuntimeError):
+            with session_scope() as failed:
+                failed.execute(text("INSERT INTO scoped VALUES (1)"))
+                raise RuntimeError("failed request")
+        with session_scope() as session:
+            self.assertIsNot(session, failed)
+            count = session.execute(text("SELECT count(*) FROM scoped")).scalar()
+            self.assertEqual(count, 0)
+        self.assertEqual(POOL_METRICS.stats()["checkouts"], checkouts + 2)
+
+    def test_bound_session_is_left_to_its_owner(self):
+        RESOURCES.override("engine", create_pooled_engine("sqlite://"))
+        bound = Session(RESOURCES.get("engine"))
+        bound.execute(text("CREATE TABLE bound (id INTEGER)"))
+        with bind_session(bound):
+            with session_scope() as session:
+                self.assertIs(session, bound)
+                self.assertIs(get_session(), bound)
+            # still open: whoever bound it closes it
+            bound.execute(text("INSERT INTO bound VALUES (1)"))
+        self.assertIsNot(get_session(), bound)
+        bound.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
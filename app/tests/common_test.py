@@ -1,4 +1,4 @@
-from query.common import extract_time_and_context, TimeContext
+from query.common import extract_time_and_context, to_utc_minute, TimeContext
 import unittest
 import pendulum
 
@@ -69,6 +69,13 @@ class TestCommonModule(unittest.TestCase):
         expected = {"context": TimeContext.by, "time": "20:00", "timezone": "UTC"}
         self.assertEqual(extract_time_and_context(sentence, pendulum.now(tz='UTC')), expected)
 
+    def test_to_utc_minute(self):
+        self.assertEqual(to_utc_minute("09:00", "America/Chicago"), 15 * 60)
+        # wraps to the previous UTC day
+        self.assertEqual(to_utc_minute("08:00", "Asia/Tokyo"), 23 * 60)
+        self.assertEqual(to_utc_minute("10:00", "+05:30"), 4 * 60 + 30)
+        self.assertEqual(to_utc_minute("10:00", "-03:00"), 13 * 60)
+
 
 if __name__ == "__main__":
     unittest.main()
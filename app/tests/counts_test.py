@@ -0,0 +1,181 @@
+from benchmarks.catalogue import generate_records
+from query.common import Restaurant
+from query.counts import (
+    ResultCounts,
+    build_counts_query,
+    count_restaurants,
+    estimate_counts,
+    estimate_total,
+    get_result_counts,
+    parse_array_text,
+)
+from query.geo import GeoFilter, haversine_meters
+from query.parser import FilterSpec
+from query.serialize import render_recommendation_body
+from query.utils import record_to_restaurant_row
+from query.snapshot import RestaurantSnapshot
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql.asyncpg import PGDialect_asyncpg
+from sqlalchemy.orm import Session
+from tests.snapshot_test import random_spec, reference_match, snapshot_row
+from unittest import mock
+import datetime
+import json
+import random
+import unittest
+
+CENTRE = (41.88, -87.63)
+FREQUENCIES = {
+    "style": {"italian": 0.5, "french": 0.3, "korean": 0.2},
+    "vegetarian": {True: 0.25, False: 0.75},
+    "delivers": {False: 0.6, True: 0.4},
+}
+
+
+def everything(**filters) -> FilterSpec:
+    return FilterSpec((), True, None, None, None, None, None)._replace(**filters)
+
+
+class TestCountsModule(unittest.TestCase):
+    def reference_counts(self, rows: list[tuple], spec: FilterSpec) -> ResultCounts:
+        matched = [row for row in rows if reference_match(row, spec)]
+        if spec.near:
+            near = spec.near
+            matched = [
+                row
+                for row in matched
+                if row[9] is not None
+                and round(haversine_meters(near.latitude, near.longitude, row[9], row[10]))
+                <= near.radius_meters
+            ]
+        styles = {}
+        for row in matched:
+            styles[row[1]] = styles.get(row[1], 0) + 1
+        vegetarian = sum(1 for row in matched if row[5])
+        delivers = sum(1 for row in matched if row[6])
+        return ResultCounts(
+            len(matched),
+            {
+                "style": {style: styles.get(style, 0) for style in ["italian", "french", "korean"]},
+                "vegetarian": {"true": vegetarian, "false": len(matched) - vegetarian},
+                "delivers": {"true": delivers, "false": len(matched) - delivers},
+            },
+            estimated=False,
+        )
+
+    def test_snapshot_counts_match_reference(self):
+        records = list(generate_records(400, seed=5, locations_around=CENTRE))
+        rows = [snapshot_row(record) for record in records]
+        snapshot = RestaurantSnapshot.from_rows(1, rows)
+        rng = random.Random(5)
+        for _ in range(30):
+            spec = random_spec(rng)
+            if rng.random() < 0.3:
+                spec = spec._replace(near=GeoFilter(*CENTRE, rng.choice([2000, 10000])))
+            self.assertEqual(snapshot.counts(spec), self.reference_counts(rows, spec), spec)
+
+    def test_counts_query_groups_in_one_scan(self):
+        spec = everything(styles=("italian", "french"), style_negation=False, vegetarian=True)
+        sql = str(build_counts_query(Session(), spec).statement.compile(dialect=postgresql.dialect()))
+        self.assertIn(
+            "GROUP BY GROUPING SETS((), restaurants.style, restaurants.vegetarian, "
+            "restaurants.delivers)",
+            sql,
+        )
+        self.assertIn("restaurants.style IN", sql)
+        self.assertIn("restaurants.vegetarian IS true", sql)
+        self.assertNotIn("ORDER BY", sql)
+
+    def test_grouping_sets_rows_become_facets(self):
+        rows = [
+            (None, None, None, 10),
+            ("italian", None, None, 6),
+            ("korean", None, None, 4),
+            (None, True, None, 3),
+            (None, False, None, 7),
+            (None, None, True, 10),
+        ]
+        query = mock.Mock(all=mock.Mock(return_value=rows))
+        session = mock.Mock(bind=mock.Mock(dialect=postgresql.dialect()))
+        with mock.patch("query.counts.build_counts_query", return_value=query):
+            counts = count_restaurants(session, everything())
+        self.assertEqual(counts.total, 10)
+        self.assertEqual(counts.facets["style"], {"italian": 6, "french": 0, "korean": 4})
+        self.assertEqual(counts.facets["vegetarian"], {"true": 3, "false": 7})
+        self.assertEqual(counts.facets["delivers"], {"true": 10, "false": 0})
+        self.assertFalse(counts.estimated)
+
+    def test_counts_rows_off_postgres(self):
+        engine = create_engine("sqlite://")
+        Restaurant.__table__.create(engine)
+        records = list(generate_records(300, seed=7))
+        rows = [record_to_restaurant_row(record) for record in records]
+        for row in rows:
+            # SQLite takes times without a zone
+            for key in ["open", "close"]:
+                row[f"{key}_hour"] = datetime.time(*divmod(row[f"{key}_minute"], 60))
+        with engine.begin() as connection:
+            connection.execute(Restaurant.__table__.insert(), rows)
+        snapshot_rows = [snapshot_row(record) for record in records]
+        specs = [
+            everything(),
+            everything(styles=("italian", "korean"), style_negation=False, vegetarian=True),
+            everything(styles=("french",), style_negation=True, deliver=False),
+            everything(styles=("thai",), style_negation=False),
+        ]
+        with Session(engine) as session:
+            for spec in specs:
+                self.assertEqual(
+                    count_restaurants(session, spec), self.reference_counts(snapshot_rows, spec)
+                )
+
+    def test_estimates_split_by_frequency_within_filters(self):
+        counts = estimate_counts(everything(), 1000, FREQUENCIES)
+        self.assertTrue(counts.estimated)
+        self.assertEqual(counts.facets["style"], {"italian": 500, "french": 300, "korean": 200})
+        self.assertEqual(counts.facets["vegetarian"], {"true": 250, "false": 750})
+        spec = everything(styles=("italian",), style_negation=True, deliver=False)
+        counts = estimate_counts(spec, 1000, FREQUENCIES)
+        self.assertEqual(counts.facets["style"], {"italian": 0, "french": 600, "korean": 400})
+        self.assertEqual(counts.facets["delivers"], {"true": 0, "false": 1000})
+        self.assertEqual(parse_array_text("{f,t}"), ["f", "t"])
+        self.assertEqual(parse_array_text(None), [])
+
+    def test_estimate_binds_parameters_for_any_driver(self):
+        session = mock.Mock()
+        session.query = Session().query
+        session.execute.return_value.scalar.return_value = '[{"Plan": {"Plan Rows": 42}}]'
+        spec = everything(styles=("italian", "french"), style_negation=False, vegetarian=True)
+        self.assertEqual(estimate_total(session, spec), 42)
+        statement, params = session.execute.call_args.args
+        self.assertEqual(sorted(params.values()), ["french", "italian"])
+        # what the ASGI server's async engine sends: positional $n
+        compiled = statement.compile(dialect=PGDialect_asyncpg())
+        self.assertIn("restaurants.style IN ($1, $2)", str(compiled))
+        self.assertEqual(
+            [params[name] for name in compiled.positiontup], ["italian", "french"]
+        )
+        # and the Lambda's psycopg2 engine: %(name)s
+        self.assertIn("%(style_1_1)s", str(statement.compile(dialect=postgresql.dialect())))
+
+    def test_estimates_need_postgres_statistics(self):
+        session = Session(create_engine("sqlite://"))
+        exact = ResultCounts(0, {}, False)
+        with mock.patch("query.counts.count_restaurants", return_value=exact) as counted:
+            self.assertIs(get_result_counts(session, everything(vegetarian=False), "estimate"), exact)
+            # cached with the pages
+            get_result_counts(session, everything(vegetarian=False), "estimate")
+        self.assertEqual(counted.call_count, 1)
+
+    def test_counts_are_members_of_the_body(self):
+        counts = estimate_counts(everything(), 10, FREQUENCIES)
+        body = json.loads(render_recommendation_body((), None, counts.to_dict()))
+        self.assertEqual(body["total"], 10)
+        self.assertTrue(body["estimated"])
+        self.assertEqual(body["facets"]["vegetarian"], {"true": 2, "false": 8})
+        self.assertEqual(body["restaurantRecommendation"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+from benchmarks.catalogue import generate_records
+from etl.transform import transform_create_lines, rows_to_object
+from query.builder import build_restaurant_query
+from query.catalogue import CatalogueFile, encode_catalogue
+from query.geo import (
+    GeoFilter,
+    NO_LOCATION,
+    bounding_boxes,
+    get_geo_filter,
+    haversine_meters,
+    parse_location,
+)
+from query.parser import FilterSpec, get_filter_fingerprint
+from query.snapshot import RestaurantSnapshot
+from query.utils import is_valid_create_restaurant, record_to_restaurant_row
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from tests.snapshot_test import random_spec, reference_match, snapshot_row
+import os
+import random
+import tempfile
+import unittest
+
+CENTRE = (41.88, -87.63)
+
+
+def near_spec(near: GeoFilter, **filters) -> FilterSpec:
+    return FilterSpec((), True, None, None, None, None, None)._replace(near=near, **filters)
+
+
+class TestGeoModule(unittest.TestCase):
+    def setUp(self):
+        records = list(generate_records(500, seed=4, locations_around=CENTRE))
+        # unknown location
+        del records[0]["latitude"], records[0]["longitude"]
+        self.rows = [snapshot_row(record) for record in records]
+        self.snapshot = RestaurantSnapshot.from_rows(1, self.rows)
+
+    def expected(self, spec: FilterSpec) -> list[tuple]:
+        near = spec.near
+        found = []
+        for row in self.rows:
+            if row[9] is None or not reference_match(row, spec):
+                continue
+            distance = round(haversine_meters(near.latitude, near.longitude, row[9], row[10]))
+            if distance <= near.radius_meters:
+                found.append((distance, row[0], row[2]))
+        return sorted(found)
+
+    def read_pages(self, snapshot: RestaurantSnapshot, spec: FilterSpec) -> list[tuple]:
+        found = []
+        after = None
+        while True:
+            page = snapshot.page(spec, 1, 20, after)
+            for fragment in page.fragments:
+                name = fragment.split('"name":"')[1].split('"')[0]
+                address = fragment.split('"address":"')[1].split('"')[0]
+                distance = int(fragment.split('"distanceMeters":')[1].rstrip("}"))
+                found.append((distance, name, address))
+            if len(page.fragments) < 20:
+                return found
+            after = page.last_key
+
+    def test_snapshot_pages_nearest_first(self):
+        rng = random.Random(8)
+        for radius in [2000, 10000, 50000]:
+            spec = random_spec(rng)._replace(near=GeoFilter(*CENTRE, radius))
+            expected = self.expected(spec)
+            self.assertEqual(self.read_pages(self.snapshot, spec), expected, spec)
+            offset = self.snapshot.page(spec, 2, 20)
+            self.assertEqual(len(offset.fragments), len(expected[20:40]))
+        self.assertGreater(len(self.expected(near_spec(GeoFilter(*CENTRE, 10000)))), 40)
+
+    def test_catalogue_keeps_locations(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "catalogue.rcat")
+            with open(path, "wb") as file:
+                file.write(encode_catalogue(self.snapshot))
+            snapshot = RestaurantSnapshot.from_catalogue(CatalogueFile(path))
+            spec = near_spec(GeoFilter(*CENTRE, 20000))
+            self.assertEqual(self.read_pages(snapshot, spec), self.expected(spec))
+
+    def test_bounding_boxes(self):
+        # about 111km per degree of latitude
+        ((min_latitude, _, max_latitude, _),) = bounding_boxes(GeoFilter(0, 0, 111195))
+        self.assertAlmostEqual(max_latitude - min_latitude, 2, places=3)
+        boxes = bounding_boxes(GeoFilter(10, 179.99, 5000))
+        self.assertEqual([box[2] > box[0] for box in boxes], [True, True])
+        self.assertEqual(boxes[0][3], 180)
+        self.assertEqual(boxes[1][1], -180)
+        self.assertEqual(bounding_boxes(GeoFilter(89.99, 0, 5000))[0][1:4:2], (-180, 180))
+
+    def test_query_filters_by_box_and_distance(self):
+        near = GeoFilter(*CENTRE, 5000)
+        query = build_restaurant_query(Session(), near_spec(near), 1, 20, ("a", "b", 120))
+        sql = str(
+            query.statement.compile(
+                dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+            )
+        )
+        # the expression of idx_location
+        self.assertIn("point(restaurants.longitude, restaurants.latitude) <@ box(point(", sql)
+        self.assertIn("ORDER BY distance, restaurants.name, restaurants.address", sql)
+        self.assertIn(", restaurants.name, restaurants.address) > (120, 'a', 'b')", sql)
+        self.assertNotIn("OFFSET", sql)
+
+    def test_request_parameters(self):
+        self.assertIsNone(get_geo_filter({}))
+        self.assertEqual(
+            get_geo_filter({"lat": "41.88", "lon": "-87.63", "radius": "800"}),
+            GeoFilter(41.88, -87.63, 800),
+        )
+        self.assertEqual(get_geo_filter({"lat": "0", "lon": "0"}).radius_meters, 5000)
+        for invalid in [
+            {"lat": "41.88"},
+            {"lat": "91", "lon": "0"},
+            {"lat": "nan", "lon": "0"},
+            {"lat": "", "lon": ""},
+            {"lat": "1", "lon": "1", "radius": "0"},
+            {"lat": "1", "lon": "1", "radius": "1.5"},
+            {"lat": "1", "lon": "1", "radius": "50001"},
+            {"radius": "100"},
+        ]:
+            with self.assertRaises(ValueError):
+                get_geo_filter(invalid)
+        spec = near_spec(None)
+        self.assertNotEqual(
+            get_filter_fingerprint(spec),
+            get_filter_fingerprint(spec._replace(near=GeoFilter(1, 1, 100))),
+        )
+
+    def test_records_carry_optional_locations(self):
+        self.assertEqual(parse_location(None, ""), NO_LOCATION)
+        self.assertEqual(parse_location("1.5", 2), (1.5, 2.0))
+        self.assertIsNone(parse_location("1.5", None))
+        self.assertIsNone(parse_location("1.5", "181"))
+        headers = "name|style|address|openHour|closeHour|vegetarian|delivers|timezone|latitude|longitude".split("|")
+        lines = [
+            "test1|italian|address1|8 AM|20:30|true|false|UTC|41.88|-87.63",
+            "test2|korean|address2|8 AM|23|false|true|UTC||",
+            "test3|korean|address3|8 AM|23|false|true|UTC|41.88|",
+            "test4|korean|address4|8 AM|23|false|true|UTC|north|east",
+        ]
+        rows, rejected = transform_create_lines(headers, lines, "|")
+        self.assertEqual(rejected, lines[2:])
+        for line, row in zip(lines, rows):
+            record = rows_to_object(headers, line.split("|"))
+            self.assertTrue(is_valid_create_restaurant(record))
+            self.assertEqual(row, record_to_restaurant_row(record))
+        self.assertEqual(
+            [(row["latitude"], row["longitude"]) for row in rows],
+            [(41.88, -87.63), (None, None)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+from etl.ingest import S3RangeReader
+from etl.lambda_function import run_job, update_lines
+from query.common import EtlJobState, EtlJobStatus
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from unittest import mock
+import io
+import random
+import unittest
+
+
+class LocalS3:
+    """
+    Stand-in for the S3 client serving objects from memory, with ranged GETs.
+    """
+
+    def __init__(self, objects: dict[str, bytes]):
+        self.objects = objects
+        self.get_calls = 0
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[Key]), "ETag": f'"{hash(Key)}"'}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key, Range):
+        self.get_calls += 1
+        start, end = (int(value) for value in Range.removeprefix("bytes=").split("-"))
+        return {"Body": io.BytesIO(self.objects[Key][start : end + 1])}
+
+
+def make_lines(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        "|".join(["name", "café " * rng.randint(0, 5), str(index)])
+        for index in range(count)
+    ]
+
+
+class TestIngestModule(unittest.TestCase):
+    def read_all(self, data: bytes, range_size: int, batch_size: int = 7, start_offset: int = 0):
+        reader = S3RangeReader(
+            LocalS3({"create/file": data}), "bucket", "create/file", range_size, 3, tail_size=5
+        )
+        batches = list(reader.iter_batches(batch_size, start_offset))
+        return reader, batches
+
+    def test_ranges_reassemble_every_line(self):
+        lines = make_lines(200, seed=1)
+        data = ("name|style|address\n" + "\n".join(lines) + "\n").encode("utf-8")
+        for range_size in [1, 2, 3, 17, 64, 1000, len(data) + 10]:
+            reader, batches = self.read_all(data, range_size)
+            self.assertEqual(reader.header, "name|style|address")
+            self.assertEqual([line for batch in batches for line in batch.lines], lines, range_size)
+            offsets = [batch.end_offset for batch in batches]
+            self.assertEqual(offsets, sorted(offsets))
+            self.assertEqual(offsets[-1], len(data))
+
+    def test_no_trailing_newline_and_crlf(self):
+        data = b"h1|h2\r\na|b\r\n\r\nc|d"
+        reader, batches = self.read_all(data, range_size=4, batch_size=1)
+        self.assertEqual(reader.header, "h1|h2")
+        self.assertEqual([line for batch in batches for line in batch.lines], ["a|b", "c|d"])
+
+    def test_resume_from_batch_offset(self):
+        lines = make_lines(50, seed=2)
+        data = ("header\n" + "\n".join(lines)).encode("utf-8")
+        _, batches = self.read_all(data, range_size=40)
+        resume_at = batches[3].end_offset
+        already_read = sum(len(batch.lines) for batch in batches[:4])
+        _, resumed = self.read_all(data, range_size=40, start_offset=resume_at)
+        self.assertEqual([line for batch in resumed for line in batch.lines], lines[already_read:])
+
+    def test_rejected_lines_are_saved_with_their_batch(self):
+        lines = make_lines(30, seed=3)
+        s3 = LocalS3({"create/file": ("header\n" + "\n".join(lines)).encode("utf-8")})
+        engine = create_engine("sqlite://")
+        EtlJobState.__table__.create(engine)
+        failures = [RuntimeError("timed out")]
+
+        def process_lines(session, headers, batch, s3_writer):
+            rejected = [line for line in batch if line.endswith(("0", "5"))]
+            for line in rejected:
+                s3_writer.append_line(line)
+            if lines[20] in batch and failures:
+                raise failures.pop()
+            return len(batch) - len(rejected), len(rejected)
+
+        def run(session):
+            with mock.patch("etl.lambda_function.get_session", return_value=session), mock.patch(
+                "etl.lambda_function.get_s3_client", return_value=s3
+            ), mock.patch("etl.utils.get_s3_client", return_value=s3), mock.patch(
+                "etl.lambda_function.MAX_BATCH_WRITE", 7
+            ):
+                run_job("bucket", "create/file", "unprocessed/create/", process_lines)
+
+        def saved() -> list[str]:
+            return [
+                line
+                for key, body in sorted(s3.objects.items())
+                if key.startswith("unprocessed/")
+                for line in body.decode("utf-8").splitlines()
+            ]
+
+        with Session(engine) as session, self.assertRaises(RuntimeError):
+            run(session)
+        # the committed batches' lines, none of the failed one's
+        self.assertEqual(
+            sorted(saved()), sorted(line for line in lines[:14] if line.endswith(("0", "5")))
+        )
+        with Session(engine) as session:
+            # the failed invocation's lease hasn't expired
+            run(session)
+            self.assertEqual(session.get(EtlJobState, "create/file").line_number, 14)
+        with Session(engine) as session, mock.patch("query.builder.ETL_JOB_LEASE_SECONDS", 0):
+            run(session)
+            state = session.get(EtlJobState, "create/file")
+            self.assertEqual((state.status, state.line_number), (EtlJobStatus.completed, 30))
+        self.assertEqual(sorted(saved()), sorted(line for line in lines if line.endswith(("0", "5"))))
+
+    def test_bad_update_lines_are_rejected_alone(self):
+        headers = "name|address|openHour|closeHour|timezone".split("|")
+        lines = ["a|1 Main|8am|22:00|UTC", "b|2 Main|25:00||UTC", "c|3 Main|8am||Mars/Olympus"]
+        writer = mock.Mock()
+        with mock.patch(
+            "etl.lambda_function.bulk_update_restaurants", return_value={("a", "1 Main")}
+        ) as update, mock.patch(
+            "etl.lambda_function.record_to_update_row",
+            side_effect=lambda record: {"name": record["name"]},
+        ):
+            self.assertEqual(update_lines(None, headers, lines, writer), (1, 2))
+        self.assertEqual(update.call_args.args[1], [{"name": "a"}])
+        self.assertEqual(
+            [call.args[0] for call in writer.append_line.call_args_list], lines[1:]
+        )
+        with mock.patch(
+            "etl.lambda_function.bulk_update_restaurants", return_value=set()
+        ), mock.patch("etl.lambda_function.record_to_update_row", side_effect=ValueError("bad hour")):
+            self.assertEqual(update_lines(None, headers, lines[:1], writer), (0, 1))
+
+    def test_header_only(self):
+        reader, batches = self.read_all(b"header\n", range_size=3)
+        self.assertEqual(reader.header, "header")
+        self.assertEqual(batches, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
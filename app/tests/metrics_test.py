@@ -0,0 +1,56 @@
+from query import metrics
+import json
+import unittest
+
+
+class TestMetricsModule(unittest.TestCase):
+    def setUp(self):
+        self.lines = []
+
+    def test_invocation_emits_emf(self):
+        @metrics.timed("query")
+        def query():
+            metrics.count("rows", 3)
+
+        with metrics.invocation("api", emit=self.lines.append, enabled=True):
+            metrics.set_operation("Recommend")
+            metrics.set_property("requestId", "r1")
+            with metrics.span("parse"):
+                pass
+            query()
+            query()
+        (line,) = self.lines
+        emf = json.loads(line)
+        directive = emf["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(directive["Dimensions"], [["Service", "Operation"]])
+        self.assertEqual(
+            {metric["Name"]: metric["Unit"] for metric in directive["Metrics"]},
+            {
+                "parse_ms": "Milliseconds",
+                "query_ms": "Milliseconds",
+                "total_ms": "Milliseconds",
+                "rows": "Count",
+            },
+        )
+        self.assertEqual((emf["Service"], emf["Operation"]), ("api", "Recommend"))
+        self.assertEqual((emf["requestId"], emf["rows"]), ("r1", 6))
+        self.assertGreaterEqual(emf["total_ms"], emf["query_ms"])
+
+    def test_error_is_counted_and_emitted(self):
+        with self.assertRaises(KeyError):
+            with metrics.invocation("etl", "create", emit=self.lines.append, enabled=True):
+                raise KeyError("x")
+        self.assertEqual(json.loads(self.lines[0])["errors"], 1)
+
+    def test_disabled_is_a_no_op(self):
+        with metrics.invocation("api", emit=self.lines.append, enabled=False) as current:
+            self.assertIsNone(current)
+            self.assertIs(metrics.span("parse"), metrics.NULL_SPAN)
+            metrics.count("rows")
+        self.assertEqual(self.lines, [])
+        # outside any invocation too
+        self.assertIs(metrics.span("parse"), metrics.NULL_SPAN)
+
+
+if __name__ == "__main__":
+    unittest.main()
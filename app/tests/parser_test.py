@@ -0,0 +1,72 @@
+from benchmarks.parser_benchmark import get_style_filter, get_boolean_filter
+from query.common import TimeContext
+from query.parser import FilterSpec, parse_sentence, get_filter_fingerprint
+import unittest
+import pendulum
+
+SENTENCES = [
+    "Find a non-vegetarian open at 8 AM",
+    "Find an Italian French restaurant open at 8 AM",
+    "Find an Italian not French restaurant open at 8 AM",
+    "A vegetarian Italian restaurant that can deliver",
+    "a NOT korean place, non-french, that does not deliver",
+    "Italian but not italian, vegetarian and non-vegetarian",
+    "cannot italian, vegetarians, delivers, koreanish",
+    "Find places open now",
+    "Find an restaurant open at 8 AM",
+]
+
+
+class TestParserModule(unittest.TestCase):
+    def test_parse_sentence(self):
+        now = pendulum.now(tz="UTC")
+        self.assertEqual(
+            parse_sentence("A vegetarian Italian place not delivering at 8 PM", now),
+            FilterSpec(
+                styles=("italian",),
+                style_negation=False,
+                vegetarian=True,
+                deliver=None,
+                time_context=TimeContext.at,
+                time="20:00",
+                timezone="UTC",
+            ),
+        )
+
+    def test_matches_legacy_filters(self):
+        now = pendulum.now(tz="UTC")
+        for sentence in SENTENCES:
+            filter_spec = parse_sentence(sentence, now)
+            style_filter = get_style_filter(sentence)
+            self.assertEqual(
+                (filter_spec.style_negation, list(filter_spec.styles)),
+                style_filter,
+                sentence,
+            )
+            self.assertEqual(
+                filter_spec.vegetarian, get_boolean_filter("vegetarian", sentence)
+            )
+            self.assertEqual(filter_spec.deliver, get_boolean_filter("deliver", sentence))
+
+    def test_get_filter_fingerprint(self):
+        now = pendulum.now(tz="UTC")
+        self.assertEqual(
+            get_filter_fingerprint(
+                parse_sentence("A vegetarian Italian place open at 8 PM", now)
+            ),
+            get_filter_fingerprint(
+                parse_sentence("an italian VEGETARIAN spot open at 8PM", now)
+            ),
+        )
+        self.assertNotEqual(
+            get_filter_fingerprint(
+                parse_sentence("A vegetarian Italian place open at 8 PM", now)
+            ),
+            get_filter_fingerprint(
+                parse_sentence("A non-vegetarian Italian place open at 8 PM", now)
+            ),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+from benchmarks.catalogue import generate_records
+from query.builder import build_restaurant_query
+from query.parser import FilterSpec, parse_sentence, get_filter_fingerprint
+from query.search import SearchIndex, add_bitsets, search_terms, tokenize
+from query.snapshot import RestaurantSnapshot
+from query.utils import encode_page_cursor, decode_page_cursor
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from tests.snapshot_test import snapshot_row
+import pendulum
+import random
+import unittest
+
+
+def reference_score(term: str, name: str, address: str) -> int:
+    """
+    Score of one term against one row, word by word.
+    """
+    if any(word.startswith(term) for word in tokenize(name)):
+        return 2
+    if any(word.startswith(term) for word in tokenize(address)):
+        return 1
+    return 0
+
+
+def where_clause(filter_spec: FilterSpec) -> str:
+    query = build_restaurant_query(Session(), filter_spec, 1, 20)
+    sql = str(
+        query.statement.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+    # no WHERE at all when nothing is filtered
+    return sql.partition("WHERE")[2].split("ORDER BY")[0]
+
+
+def search_spec(*terms: str) -> FilterSpec:
+    return FilterSpec((), True, None, None, None, None, None, tuple(terms))
+
+
+class TestSearchModule(unittest.TestCase):
+    def setUp(self):
+        records = list(generate_records(400, seed=9, descriptive_names=True))
+        self.rows = [snapshot_row(record) for record in records]
+        self.snapshot = RestaurantSnapshot.from_rows(1, self.rows)
+
+    def expected(self, terms: tuple[str, ...]) -> list[tuple]:
+        # every row, those scoring more first
+        return sorted(
+            (-sum(reference_score(term, row[0], row[2]) for term in terms), row[0], row[2])
+            for row in self.rows
+        )
+
+    def test_index_matches_reference(self):
+        index = SearchIndex([row[0] for row in self.rows], [row[2] for row in self.rows])
+        every_row = (1 << len(self.rows)) - 1
+        for terms in [("pizza",), ("piza",), ("sushi", "oak"), ("main", "14"), ("zzz",)]:
+            result = index.search(terms)
+            found = []
+            for score, rows in result.score_levels(every_row):
+                for position in range(len(self.rows)):
+                    if rows >> position & 1:
+                        row = self.rows[position]
+                        found.append((-score, row[0], row[2]))
+            self.assertEqual(sorted(found), self.expected(terms), terms)
+
+    def test_snapshot_pages_rank_and_continue(self):
+        terms = ("golden", "pizza", "main")
+        expected = [name for _, name, _ in self.expected(terms)]
+        names = []
+        after = None
+        while True:
+            page = self.snapshot.page(search_spec(*terms), 1, 20, after)
+            names.extend(
+                fragment.split('"name":"')[1].split('"')[0] for fragment in page.fragments
+            )
+            if len(page.fragments) < 20:
+                break
+            after = page.last_key
+        self.assertEqual(names, expected)
+        offset = self.snapshot.page(search_spec(*terms), 3, 20)
+        self.assertEqual(
+            [fragment.split('"name":"')[1].split('"')[0] for fragment in offset.fragments],
+            expected[40:60],
+        )
+
+    def test_add_bitsets(self):
+        rng = random.Random(3)
+        values = [[rng.randrange(3) for _ in range(50)] for _ in range(4)]
+        planes = []
+        for row_values in values:
+            addend = [
+                sum(1 << index for index, value in enumerate(row_values) if value >> bit & 1)
+                for bit in range(2)
+            ]
+            planes = add_bitsets(planes, addend)
+        for index in range(50):
+            total = sum((plane >> index & 1) << bit for bit, plane in enumerate(planes))
+            self.assertEqual(total, sum(row_values[index] for row_values in values))
+
+    def test_sentence_terms(self):
+        now = pendulum.datetime(2024, 12, 29, 19, 0, tz="UTC")
+        self.assertEqual(
+            parse_sentence("pizza near Main Street", now).terms, ("pizza", "main", "street")
+        )
+        spec = parse_sentence("A vegetarian Italian place that delivers after 10pm", now)
+        self.assertEqual(spec.terms, ())
+        self.assertEqual(
+            search_terms(["the", "a", "sushi", "sushi", "x", "bar"]), ("sushi", "bar")
+        )
+        self.assertNotEqual(
+            get_filter_fingerprint(spec), get_filter_fingerprint(spec._replace(terms=("bar",)))
+        )
+
+    def test_query_ranks_by_score(self):
+        query = build_restaurant_query(
+            Session(), search_spec("pizza", "main"), 1, 20, ("a", "b", 3)
+        )
+        sql = str(
+            query.statement.compile(
+                dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+            )
+        )
+        self.assertIn(
+            "to_tsvector('simple'::regconfig, restaurants.name) @@ "
+            "to_tsquery('simple'::regconfig, 'pizza:*')",
+            sql,
+        )
+        self.assertIn("ORDER BY score DESC, restaurants.name, restaurants.address", sql)
+        self.assertNotIn("OFFSET", sql)
+        # the terms only rank: without a keyset condition nothing is filtered
+        first_page = build_restaurant_query(Session(), search_spec("pizza", "main"), 1, 20)
+        self.assertNotIn("WHERE", str(first_page.statement.compile(dialect=postgresql.dialect())))
+
+    def test_filler_words_keep_the_results(self):
+        now = pendulum.datetime(2024, 12, 29, 19, 0, tz="UTC")
+        for sentence, plain in [
+            ("Find me a tasty italian restaurant", "Find me an italian restaurant"),
+            ("italian with great pasta", "italian"),
+            ("open till late", "open"),
+        ]:
+            spec, plain_spec = parse_sentence(sentence, now), parse_sentence(plain, now)
+            self.assertNotEqual(spec.terms, ())
+            page = self.snapshot.page(spec, 1, 1000)
+            self.assertGreater(len(page.fragments), 0, sentence)
+            plain_page = self.snapshot.page(plain_spec, 1, 1000)
+            self.assertEqual(sorted(page.fragments), sorted(plain_page.fragments), sentence)
+            self.assertEqual(self.snapshot.counts(spec), self.snapshot.counts(plain_spec))
+
+            self.assertEqual(where_clause(spec), where_clause(plain_spec), sentence)
+
+    def test_cursor_carries_score(self):
+        token = encode_page_cursor(("a", "b", 4), "f")
+        self.assertEqual(decode_page_cursor(token), {"last_key": ("a", "b", 4), "fingerprint": "f"})
+        self.assertIsNone(decode_page_cursor(encode_page_cursor(("a", "b", "4"), "f")))
+
+
+if __name__ == "__main__":
+    unittest.main()
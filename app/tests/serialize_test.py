@@ -0,0 +1,86 @@
+from query import serialize
+from query.serialize import (
+    iter_array_items,
+    render_batch_body,
+    render_restaurant,
+    render_recommendation_body,
+)
+from unittest import mock
+import datetime
+import json
+import unittest
+
+ROW = (
+    "café 1",
+    "italian",
+    "address1",
+    datetime.time(8, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=-6))),
+    datetime.time(20, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=-6))),
+    True,
+    False,
+)
+EXPECTED = {
+    "name": "café 1",
+    "style": "italian",
+    "address": "address1",
+    "openHour": "08:00:00-06:00",
+    "clouseHour": "20:30:00-06:00",
+    "vegetarian": True,
+    "delivers": False,
+}
+
+
+class TestSerializeModule(unittest.TestCase):
+    def test_body_matches_the_dict_response(self):
+        body = render_recommendation_body([render_restaurant(ROW)] * 2, "cursor")
+        self.assertEqual(
+            json.loads(body),
+            {"restaurantRecommendation": [EXPECTED, EXPECTED], "nextPage": "cursor"},
+        )
+
+    def test_empty_page(self):
+        self.assertEqual(
+            json.loads(render_recommendation_body((), None)),
+            {"restaurantRecommendation": [], "nextPage": None},
+        )
+
+    def test_batch_body_keeps_each_status(self):
+        body = render_batch_body(
+            [
+                (200, render_recommendation_body([render_restaurant(ROW)], None)),
+                (400, json.dumps({"message": "query and requestTime required"})),
+            ]
+        )
+        self.assertEqual(
+            json.loads(body),
+            {
+                "results": [
+                    {"statusCode": 200, "restaurantRecommendation": [EXPECTED], "nextPage": None},
+                    {"statusCode": 400, "message": "query and requestTime required"},
+                ]
+            },
+        )
+
+    def test_standard_library_fallback(self):
+        with mock.patch.object(serialize, "orjson", None):
+            body = render_recommendation_body([render_restaurant(ROW)], 2)
+        self.assertEqual(
+            json.loads(body), {"restaurantRecommendation": [EXPECTED], "nextPage": 2}
+        )
+
+    def test_array_items_are_read_one_by_one(self):
+        text = ' {"other": {"records": [0]}, "records" : [ {"a": [1, 2]}, "b" ,3 ], "c": null }'
+        self.assertEqual(list(iter_array_items(text, "records")), [{"a": [1, 2]}, "b", 3])
+        self.assertEqual(list(iter_array_items("{}", "records")), [])
+        self.assertEqual(list(iter_array_items('{"records": []}', "records")), [])
+        items = iter_array_items('{"records": [1, {"a": }]}', "records")
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(json.JSONDecodeError):
+            next(items)
+        for invalid in ["", "[]", '{"records": [1]} x', '{"records": [1] "x": 2}']:
+            with self.assertRaises(json.JSONDecodeError):
+                list(iter_array_items(invalid, "records"))
+
+
+if __name__ == "__main__":
+    unittest.main()
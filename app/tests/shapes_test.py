@@ -0,0 +1,44 @@
+from benchmarks.sentences import generate_sentences
+from query.common import TimeContext
+from query.parser import FilterSpec, parse_sentence
+from query.shapes import QueryShape, ShapeRecorder, get_query_shape
+import pendulum
+import unittest
+
+
+class TestShapesModule(unittest.TestCase):
+    def test_get_query_shape_drops_values(self):
+        spec = FilterSpec(("italian", "french"), True, True, None, TimeContext.by, "20:00", "UTC")
+        shape = get_query_shape(spec, keyset=True)
+        self.assertEqual(shape, QueryShape("not_in", "true", "any", "by", "keyset"))
+        other = spec._replace(styles=("korean", "french"), time="08:00")
+        self.assertEqual(get_query_shape(other, keyset=True), shape)
+
+    def test_label_round_trip(self):
+        shape = QueryShape("eq", "false", "true", "any", "offset")
+        self.assertEqual(
+            shape.label, "style=eq,vegetarian=false,deliver=true,time=any,paging=offset"
+        )
+        self.assertEqual(QueryShape.from_label(shape.label), shape)
+
+    def test_recorder_reports_most_common(self):
+        recorder = ShapeRecorder()
+        common = QueryShape("any", "any", "any", "any", "offset")
+        rare = QueryShape("eq", "any", "any", "by", "keyset")
+        for shape in [common, rare, common]:
+            recorder.record(shape)
+        self.assertEqual(recorder.stats(1), {common.label: 2})
+
+    def test_generated_sentences_cover_shapes(self):
+        sentences = list(generate_sentences(500, seed=3))
+        self.assertEqual(sentences, list(generate_sentences(500, seed=3)))
+        now = pendulum.parse("2024-12-29T19:00:00-06:00")
+        shapes = {get_query_shape(parse_sentence(sentence, now), False) for sentence in sentences}
+        self.assertEqual({shape.style for shape in shapes}, {"any", "eq", "in", "ne", "not_in"})
+        self.assertEqual(
+            {shape.time for shape in shapes}, {"any", "by", "after", "before", "at"}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+from benchmarks.catalogue import generate_records
+from query.common import TimeContext, to_utc_minute
+from query.parser import FilterSpec
+from query.snapshot import RestaurantSnapshot, SnapshotStore
+from query.utils import record_to_restaurant_row
+from unittest import mock
+import random
+import unittest
+
+
+def snapshot_row(record: dict) -> tuple:
+    row = record_to_restaurant_row(record)
+    return (
+        row["name"],
+        row["style"],
+        row["address"],
+        row["open_hour"],
+        row["close_hour"],
+        row["vegetarian"],
+        row["delivers"],
+        row["open_minute"],
+        row["close_minute"],
+        row["latitude"],
+        row["longitude"],
+    )
+
+
+def reference_match(row: tuple, spec: FilterSpec) -> bool:
+    """
+    The WHERE clause of builder.build_restaurant_query, row by row.
+    """
+    if spec.styles and (row[1] in spec.styles) == spec.style_negation:
+        return False
+    if spec.vegetarian is not None and row[5] != spec.vegetarian:
+        return False
+    if spec.deliver is not None and row[6] != spec.deliver:
+        return False
+    if spec.time_context:
+        minute = to_utc_minute(spec.time, spec.timezone)
+        open_minute, close_minute = row[7], row[8]
+        if spec.time_context == TimeContext.by:
+            end = close_minute + 1440 if close_minute <= open_minute else close_minute
+            return open_minute <= minute < end or open_minute <= minute + 1440 < end
+        if spec.time_context == TimeContext.at:
+            return open_minute == minute
+        if open_minute is None:
+            return False
+        # minutes since the request's local midnight
+        day_start = to_utc_minute("00:00", spec.timezone)
+        local_open, local_minute = (open_minute - day_start) % 1440, (minute - day_start) % 1440
+        if spec.time_context == TimeContext.after:
+            return local_open > local_minute
+        return local_open < local_minute
+    return True
+
+
+def random_spec(rng: random.Random) -> FilterSpec:
+    styles = tuple(rng.sample(["italian", "french", "korean"], rng.randint(0, 2)))
+    time_context = rng.choice([None, *TimeContext])
+    return FilterSpec(
+        styles=styles,
+        style_negation=rng.random() < 0.5,
+        vegetarian=rng.choice([None, True, False]),
+        deliver=rng.choice([None, True, False]),
+        time_context=time_context,
+        time=f"{rng.randrange(24):02d}:{rng.choice([0, 15, 30, 45]):02d}",
+        timezone=rng.choice(["America/Chicago", "UTC", "Asia/Tokyo"]),
+    )
+
+
+class FakeSession:
+    pass
+
+
+class TestSnapshotModule(unittest.TestCase):
+    def setUp(self):
+        records = list(generate_records(500, seed=3, timezones=["UTC", "Asia/Tokyo"]))
+        # overnight hours
+        records[0].update(openHour="22:00", closeHour="02:00", timezone="UTC")
+        self.rows = [snapshot_row(record) for record in records]
+        self.snapshot = RestaurantSnapshot.from_rows(1, list(reversed(self.rows)))
+        self.ordered = sorted(self.rows, key=lambda row: (row[0], row[2]))
+
+    def expected_names(self, spec, skip, size, after=None):
+        rows = [row for row in self.ordered if reference_match(row, spec)]
+        if after is not None:
+            rows = [row for row in rows if (row[0], row[2]) > after]
+        return [row[0] for row in rows[skip : skip + size]]
+
+    def page_names(self, page):
+        return [fragment.split('"name":"')[1].split('"')[0] for fragment in page.fragments]
+
+    def test_pages_match_reference(self):
+        rng = random.Random(7)
+        for _ in range(300):
+            spec = random_spec(rng)
+            page_number = rng.randint(1, 3)
+            page = self.snapshot.page(spec, page_number, 20)
+            self.assertEqual(
+                self.page_names(page),
+                self.expected_names(spec, (page_number - 1) * 20, 20),
+                spec,
+            )
+
+    def test_keyset_pages_walk_every_match(self):
+        spec = FilterSpec(("italian",), True, None, None, None, None, None)
+        names = []
+        after = None
+        while True:
+            page = self.snapshot.page(spec, 1, 20, after)
+            names.extend(self.page_names(page))
+            if len(page.fragments) < 20:
+                break
+            after = page.last_key
+        self.assertEqual(names, self.expected_names(spec, 0, len(self.rows)))
+
+    def test_overnight_hours_match_after_midnight(self):
+        spec = FilterSpec((), True, None, None, TimeContext.by, "01:00", "UTC")
+        self.assertIn(self.rows[0][0], self.page_names(self.snapshot.page(spec, 1, 500)))
+
+    def test_apply_changes(self):
+        changed = self.rows[1][:1] + ("korean",) + self.rows[1][2:] + (5,)
+        deleted = (self.rows[2][0], self.rows[2][2], 6)
+        # deleted, then created again by a later write
+        recreated = self.rows[3] + (8,)
+        stale_delete = (self.rows[3][0], self.rows[3][2], 7)
+        snapshot = self.snapshot.apply_changes(
+            8, [changed, recreated], [deleted, stale_delete]
+        )
+        self.assertEqual(snapshot.version, 8)
+        self.assertEqual(len(snapshot), len(self.rows) - 1)
+        keys = set(snapshot.keys)
+        self.assertNotIn((self.rows[2][0], self.rows[2][2]), keys)
+        self.assertIn((self.rows[3][0], self.rows[3][2]), keys)
+        korean = FilterSpec(("korean",), False, None, None, None, None, None)
+        self.assertIn(self.rows[1][0], self.page_names(snapshot.page(korean, 1, 500)))
+
+    def test_store_refreshes_on_interval(self):
+        now = [0.0]
+        store = SnapshotStore(refresh_seconds=30, clock=lambda: now[0])
+        loads = []
+        with mock.patch(
+            "query.snapshot.load_snapshot", lambda session: loads.append(1) or self.snapshot
+        ), mock.patch(
+            "query.snapshot.refresh_snapshot",
+            lambda session, snapshot: loads.append(2) or snapshot,
+        ):
+            for now[0] in [0, 10, 29, 30, 31]:
+                store.get(FakeSession())
+        self.assertEqual(loads, [1, 2])
+
+    def test_store_serves_current_snapshot_while_refreshing(self):
+        store = SnapshotStore(refresh_seconds=0)
+        with mock.patch("query.snapshot.load_snapshot", lambda session: self.snapshot):
+            store.get(FakeSession())
+        # another request is refreshing
+        with store.lock, mock.patch(
+            "query.snapshot.refresh_snapshot", lambda session, snapshot: self.fail("refreshed")
+        ):
+            self.assertIs(store.get(FakeSession()), self.snapshot)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+from benchmarks.time_format_benchmark import strptime_to_24_hour_format
+from query.common import to_24_hour_format, normalize_time
+import random
+import unittest
+
+
+def oracle(time_str):
+    try:
+        return strptime_to_24_hour_format(time_str)
+    except ValueError:
+        return None
+
+
+def random_time_string(rng: random.Random) -> str:
+    hour = rng.choice([str(rng.randint(0, 30)), f"{rng.randint(0, 30):02d}", "", "١٢", "007"])
+    minute = rng.choice(
+        ["", f":{rng.randint(0, 70)}", f":{rng.randint(0, 70):02d}", ":", ":5 ", ":000"]
+    )
+    space = rng.choice(["", " ", "  ", "\t", " \n "])
+    meridiem = rng.choice(["", "", "am", "PM", "Am", "pM", "a.m.", "m", "amx", "p"])
+    padding = rng.choice(["", " ", "\t", "  "])
+    junk = rng.choice(["", "", "", "x", ":", "-", "8"])
+    parts = [padding, hour, minute, space, meridiem, padding]
+    parts.insert(rng.randint(0, len(parts)), junk)
+    return "".join(parts)
+
+
+class TestTimeFormat(unittest.TestCase):
+    def test_every_24_hour_time(self):
+        for hour in range(24):
+            for minute in range(60):
+                for time_str in [f"{hour}:{minute:02d}", f"{hour:02d}:{minute:02d}", f"{hour}:{minute}"]:
+                    self.assertEqual(normalize_time(time_str), oracle(time_str), time_str)
+
+    def test_every_12_hour_time(self):
+        for hour in range(0, 14):
+            for minute in range(0, 61, 7):
+                for meridiem in ["AM", "pm"]:
+                    for time_str in [
+                        f"{hour}:{minute:02d} {meridiem}",
+                        f"{hour}:{minute:02d}{meridiem}",
+                        f"{hour}{meridiem}",
+                        f"{hour:02d} {meridiem}",
+                    ]:
+                        self.assertEqual(normalize_time(time_str), oracle(time_str), time_str)
+
+    def test_random_strings_match_strptime(self):
+        rng = random.Random(20241229)
+        for _ in range(20000):
+            time_str = random_time_string(rng)
+            self.assertEqual(normalize_time(time_str), oracle(time_str), repr(time_str))
+
+    def test_to_24_hour_format_raises(self):
+        self.assertEqual(to_24_hour_format(" 8:30pm "), "20:30")
+        with self.assertRaises(ValueError):
+            to_24_hour_format("25:00")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+from etl.transform import transform_create_lines, rows_to_object
+from query.utils import is_valid_create_restaurant, record_to_restaurant_row
+import unittest
+
+HEADERS = "name|style|address|openHour|closeHour|vegetarian|delivers|timezone".split("|")
+
+
+class TestTransformModule(unittest.TestCase):
+    def test_matches_per_row_conversion(self):
+        lines = [
+            "test1|Italian|address1|8 AM|20:30|true|false|America/Chicago",
+            "test2|korean|address2|7:15pm|23|FALSE|True|UTC",
+        ]
+        rows, rejected = transform_create_lines(HEADERS, lines, "|")
+        self.assertEqual(rejected, [])
+        expected = []
+        for line in lines:
+            record = rows_to_object(HEADERS, line.split("|"))
+            self.assertTrue(is_valid_create_restaurant(record))
+            expected.append(record_to_restaurant_row(record))
+        self.assertEqual(rows, expected)
+
+    def test_rejects_invalid_lines(self):
+        lines = [
+            "test1|thai|address1|8 AM|20:30|true|false|UTC",
+            "test2|korean|address2|25:00|23|false|true|UTC",
+            "test3|korean|address3|8 AM|23|maybe|true|UTC",
+            "test4|korean|address4|8 AM|23|false|true|Mars/Olympus",
+            "test5|korean",
+            "|korean|address6|8 AM|23|false|true|UTC",
+            "test7|french|address7|8 AM|23|false|true|UTC",
+        ]
+        rows, rejected = transform_create_lines(HEADERS, lines, "|")
+        self.assertEqual([row["name"] for row in rows], ["test7"])
+        self.assertEqual(rejected, lines[:-1])
+
+    def test_missing_header_rejects_everything(self):
+        lines = ["test1|italian|address1"]
+        self.assertEqual(
+            transform_create_lines(["name", "style", "address"], lines, "|"),
+            ([], lines),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+from query.utils import (
+    encode_page_cursor,
+    decode_page_cursor,
+    is_valid_update_restaurant,
+    record_to_restaurant_row,
+    record_to_update_row,
+)
+import unittest
+
+
+class TestUtilsModule(unittest.TestCase):
+    def test_page_cursor_round_trip(self):
+        token = encode_page_cursor(("test1", "1 Main St, Apt #2"), "abc123")
+        self.assertEqual(
+            decode_page_cursor(token),
+            {"last_key": ("test1", "1 Main St, Apt #2"), "fingerprint": "abc123"},
+        )
+
+    def test_invalid_page_cursor(self):
+        self.assertEqual(decode_page_cursor("2"), None)
+        self.assertEqual(decode_page_cursor("not a cursor"), None)
+        self.assertEqual(decode_page_cursor(encode_page_cursor(("a", "b"), "")[:-2]), None)
+
+    def test_record_to_restaurant_row(self):
+        record = {
+            "name": "test1",
+            "style": "Italian",
+            "address": "address1",
+            "openHour": "8 AM",
+            "closeHour": "20:30",
+            "vegetarian": "TRUE",
+            "delivers": "false",
+            "timezone": "America/Chicago",
+        }
+        self.assertEqual(
+            record_to_restaurant_row(record),
+            {
+                "name": "test1",
+                "style": "italian",
+                "address": "address1",
+                "open_hour": "2000-01-01 08:00 America/Chicago",
+                "close_hour": "2000-01-01 20:30 America/Chicago",
+                "open_minute": 14 * 60,
+                "close_minute": 2 * 60 + 30,
+                "vegetarian": True,
+                "delivers": False,
+                # a create replaces the location too
+                "latitude": None,
+                "longitude": None,
+            },
+        )
+
+    def test_record_to_update_row_sets_minutes_with_hours(self):
+        row = record_to_update_row(
+            {"name": "a", "address": "b", "openHour": "22:00", "timezone": "UTC"}
+        )
+        self.assertEqual(row["open_minute"], 22 * 60)
+        self.assertNotIn("close_minute", row)
+        row = record_to_update_row({"name": "a", "address": "b", "openHour": "22:00"})
+        self.assertNotIn("open_minute", row)
+
+    def test_update_records_must_change_something_that_parses(self):
+        key = {"name": "a", "address": "b"}
+        # a CSV row carries every header, blank when not updated
+        blank = dict.fromkeys(
+            ["style", "openHour", "closeHour", "vegetarian", "delivers", "timezone"]
+            + ["latitude", "longitude"],
+            "",
+        )
+        self.assertFalse(is_valid_update_restaurant(key | blank))
+        self.assertTrue(is_valid_update_restaurant(key | blank | {"style": "French"}))
+        self.assertTrue(
+            is_valid_update_restaurant(key | blank | {"latitude": "41.9", "longitude": "-87.6"})
+        )
+        self.assertTrue(
+            is_valid_update_restaurant(
+                key | blank | {"openHour": "8am", "closeHour": "22:00", "timezone": "UTC"}
+            )
+        )
+        for invalid in [
+            {"style": "martian"},
+            {"vegetarian": "yes"},
+            {"openHour": "25:00", "timezone": "UTC"},
+            {"closeHour": "soon", "timezone": "UTC"},
+            {"openHour": "8am"},
+            {"openHour": "8am", "timezone": "Mars/Olympus"},
+            {"latitude": "91", "longitude": "0"},
+        ]:
+            self.assertFalse(is_valid_update_restaurant(key | blank | invalid), invalid)
+        self.assertFalse(is_valid_update_restaurant(blank | {"style": "French"}))
+        # no location given: the current one stays
+        self.assertNotIn("latitude", record_to_update_row(key | blank | {"style": "French"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -48,6 +48,9 @@ module "api" {
   db_port                      = module.postgres.db_instance_port
   db_endpoint                  = module.postgres.db_instance_endpoint
   db_name                      = "restaurants"
+  catalogue_bucket_name        = module.restaurant-etl.bucket_name
+  catalogue_bucket_arn         = module.restaurant-etl.bucket_arn
+  catalogue_kms_key_arn        = module.restaurant-etl.kms_key_arn
 
   depends_on = [module.postgres, module.api_gateway_account]
 }
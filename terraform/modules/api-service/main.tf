@@ -56,6 +56,9 @@ resource "aws_lambda_function" "lambda_function" {
       DATABASE_ENDPOINT             = var.db_endpoint
       DATABASE_NAME                 = var.db_name
       SERVICE_KMS_KEY_ARN           = aws_kms_key.service.arn
+      RECOMMENDATION_SOURCE         = var.recommendation_source
+      CATALOGUE_BUCKET_NAME         = var.catalogue_bucket_name
+      METRICS_ENABLED               = "true"
     }
   }
 
@@ -148,6 +151,16 @@ resource "aws_iam_policy" "lambda_secrets_access_policy" {
         Effect   = "Allow",
         Action   = ["kms:Encrypt", "kms:Generate*", "kms:Decrypt"],
         Resource = [aws_kms_key.service.arn, var.db_credential_secret_key_arn]
+      },
+      {
+        Effect   = "Allow",
+        Action   = ["s3:GetObject"],
+        Resource = ["${var.catalogue_bucket_arn}/catalogue/*"]
+      },
+      {
+        Effect   = "Allow",
+        Action   = ["kms:Decrypt"],
+        Resource = [var.catalogue_kms_key_arn]
       }
     ]
   })
@@ -169,6 +182,12 @@ resource "aws_api_gateway_resource" "recommend_resource" {
   path_part   = "recommend"
 }
 
+resource "aws_api_gateway_resource" "recommend_batch_resource" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.recommend_resource.id
+  path_part   = "batch"
+}
+
 resource "aws_api_gateway_resource" "restaurant_resource" {
   rest_api_id = aws_api_gateway_rest_api.api.id
   parent_id   = aws_api_gateway_rest_api.api.root_resource_id
@@ -188,6 +207,13 @@ resource "aws_api_gateway_method" "recommend_method" {
   authorization = "NONE"
 }
 
+resource "aws_api_gateway_method" "recommend_batch_method" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.recommend_batch_resource.id
+  http_method   = "POST"
+  authorization = "NONE"
+}
+
 resource "aws_api_gateway_method" "restaurant_method_post" {
   rest_api_id   = aws_api_gateway_rest_api.api.id
   resource_id   = aws_api_gateway_resource.restaurant_resource.id
@@ -218,6 +244,15 @@ resource "aws_api_gateway_integration" "recommend_integration" {
   uri                     = aws_lambda_function.lambda_function.invoke_arn
 }
 
+resource "aws_api_gateway_integration" "recommend_batch_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.recommend_batch_resource.id
+  http_method             = aws_api_gateway_method.recommend_batch_method.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.lambda_function.invoke_arn
+}
+
 resource "aws_api_gateway_integration" "restaurant_integration_post" {
   rest_api_id             = aws_api_gateway_rest_api.api.id
   resource_id             = aws_api_gateway_resource.restaurant_resource.id
@@ -251,13 +286,16 @@ resource "aws_api_gateway_deployment" "api" {
   triggers = {
     redeployment = sha1(jsonencode([
       aws_api_gateway_resource.recommend_resource.id,
+      aws_api_gateway_resource.recommend_batch_resource.id,
       aws_api_gateway_resource.restaurant_resource.id,
       aws_api_gateway_resource.delete_restaurant_resource.id,
       aws_api_gateway_method.recommend_method.id,
+      aws_api_gateway_method.recommend_batch_method.id,
       aws_api_gateway_method.restaurant_method_post.id,
       aws_api_gateway_method.restaurant_method_put.id,
       aws_api_gateway_method.restaurant_method_delete.id,
       aws_api_gateway_integration.recommend_integration.id,
+      aws_api_gateway_integration.recommend_batch_integration.id,
       aws_api_gateway_integration.restaurant_integration_post.id,
       aws_api_gateway_integration.restaurant_integration_put.id,
       aws_api_gateway_integration.restaurant_integration_delete.id,
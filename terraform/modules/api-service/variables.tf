@@ -63,3 +63,24 @@ variable "db_name" {
   description = "Name of service database"
   type        = string
 }
+
+variable "catalogue_bucket_name" {
+  description = "Bucket the ETL exports the restaurant catalogue to"
+  type        = string
+}
+
+variable "catalogue_bucket_arn" {
+  description = "Arn of the catalogue bucket"
+  type        = string
+}
+
+variable "catalogue_kms_key_arn" {
+  description = "key arn used to encrypt the catalogue bucket"
+  type        = string
+}
+
+variable "recommendation_source" {
+  description = "Where /recommend is answered from: database, snapshot or catalogue"
+  type        = string
+  default     = "database"
+}
@@ -49,6 +49,8 @@ resource "aws_lambda_function" "lambda_function" {
       DATABASE_CREDENTIAL_SECRET_ID = var.db_credential_secret_arn
       DATABASE_ENDPOINT             = var.db_endpoint
       DATABASE_NAME                 = var.db_name
+      DATABASE_STATEMENT_TIMEOUT_MS = "300000"
+      METRICS_ENABLED               = "true"
     }
   }
 
@@ -150,6 +152,11 @@ resource "aws_iam_policy" "lambda_access_policy" {
           "${aws_s3_bucket.private_bucket.arn}/*"
         ]
       },
+      {
+        Effect : "Allow",
+        Action : ["s3:DeleteObject"],
+        Resource : ["${aws_s3_bucket.private_bucket.arn}/catalogue/*"]
+      },
     ]
   })
 }
@@ -190,3 +197,13 @@ resource "aws_s3_bucket_notification" "bucket_notification" {
 
   depends_on = [aws_lambda_permission.allow_bucket]
 }
+
+# Schema changes run once per deployment instead of on every cold start.
+resource "aws_lambda_invocation" "migrate" {
+  function_name = aws_lambda_function.lambda_function.function_name
+  input         = jsonencode({ action = "migrate" })
+
+  triggers = {
+    source_code_hash = aws_lambda_function.lambda_function.source_code_hash
+  }
+}
@@ -0,0 +1,11 @@
+output "bucket_name" {
+  value = aws_s3_bucket.private_bucket.id
+}
+
+output "bucket_arn" {
+  value = aws_s3_bucket.private_bucket.arn
+}
+
+output "kms_key_arn" {
+  value = aws_kms_key.service.arn
+}